@@ -0,0 +1,196 @@
+"""
+Cache helpers: generational namespaces and stampede-protected fills.
+
+Keys built with namespace_key() embed the namespace's current generation, so
+invalidate_namespace() drops every key in it with one atomic incr: the old
+keys are never read again and age out on their own timeout. Unlike
+django-redis's delete_pattern this is O(1) and works on every cache backend.
+
+    key = namespace_key('events', 'list', query)
+    ...
+    invalidate_namespace('events')
+
+fill() builds on this to serve computed results (pages, listings) without a
+stampede on the database when they expire or are invalidated.
+
+Both use the 'tiered' cache, so with Redis configured hot keys (namespace
+generations, filled pages) are usually served from process memory. compact()
+and expand() keep what is cached small.
+"""
+import logging
+import math
+import pickle
+import random
+import threading
+import time
+import zlib
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+logger = logging.getLogger(__name__)
+
+cache = ConnectionProxy(caches, 'tiered')
+
+
+def _generation_key(namespace):
+    return f'ns_generation_{namespace}'
+
+
+def namespace_generation(namespace):
+    generation = cache.get(_generation_key(namespace))
+    if generation is None:
+        # Start from the clock, not 1: if the counter was evicted, a restart at 1
+        # could bring back entries cached under an earlier generation
+        cache.add(_generation_key(namespace), time.time_ns(), None)
+        generation = cache.get(_generation_key(namespace))
+    return generation
+
+
+def namespace_key(namespace, *parts):
+    """A cache key in `namespace`'s current generation"""
+    return ':'.join([namespace, str(namespace_generation(namespace)), *(str(part) for part in parts)])
+
+
+def invalidate_namespace(namespace):
+    """Drop every key in `namespace`. Returns the new generation."""
+    try:
+        return cache.incr(_generation_key(namespace))
+    except ValueError:
+        # No generation yet (or it was evicted): whatever starts one is new
+        return namespace_generation(namespace)
+
+
+# ---------------------------------------------------------------------------
+# Stampede-protected fills
+# ---------------------------------------------------------------------------
+
+# What fill() keeps for a key. `delta` is how long computing it took.
+Entry = namedtuple('Entry', 'value generation expires delta')
+
+OUTCOMES = ('hit', 'stale', 'recompute', 'wait', 'miss')
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+_counts_flushed = time.monotonic()
+
+
+def fill(namespace, key, compute, timeout, metric=None):
+    """
+    The cached result of compute() for `key` in `namespace`, recomputing it at
+    most once at a time across all processes:
+
+    - a fresh entry is returned as is (hit);
+    - an expired or invalidated one is recomputed by whichever request takes
+      the lock (recompute), while the others keep serving it (stale);
+    - with nothing to serve, requests wait for the lock holder (wait), and only
+      compute it themselves if it takes too long (miss).
+
+    Entries are also refreshed early, with a probability that rises towards
+    expiry and with the cost of computing them (XFetch), so a hot key is
+    usually recomputed before it expires at all.
+    """
+    metric = metric or namespace
+    cache_key = f'{namespace}:fill:{key}'
+    generation = namespace_generation(namespace)
+    entry = cache.get(cache_key)
+    if entry is not None and entry.generation == generation and not _refresh_early(entry):
+        _count(metric, 'hit')
+        return entry.value
+
+    lock_key = f'{cache_key}:lock'
+    if cache.add(lock_key, 1, settings.CACHE_FILL_LOCK_SECONDS):
+        try:
+            _count(metric, 'recompute')
+            return _recompute(cache_key, generation, compute, timeout)
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        _count(metric, 'stale')
+        return entry.value
+
+    deadline = time.monotonic() + settings.CACHE_FILL_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(cache_key)
+        if entry is not None and entry.generation == generation:
+            _count(metric, 'wait')
+            return entry.value
+    _count(metric, 'miss')
+    return _recompute(cache_key, generation, compute, timeout)
+
+
+def _refresh_early(entry):
+    beta = settings.CACHE_EARLY_REFRESH_BETA
+    return time.time() - entry.delta * beta * math.log(1 - random.random()) >= entry.expires
+
+
+def _recompute(cache_key, generation, compute, timeout):
+    started = time.time()
+    value = compute()
+    delta = time.time() - started
+    # Kept past its expiry so there is something to serve while it is recomputed
+    cache.set(cache_key, Entry(value, generation, started + delta + timeout, delta),
+              timeout + settings.CACHE_STALE_SECONDS)
+    logger.debug("Recomputed %s in %.3fs", cache_key, delta)
+    return value
+
+
+def _metric_key(metric, outcome):
+    return f'cache_fill_{metric}_{outcome}'
+
+
+def _count(metric, outcome):
+    global _counts_flushed
+    with _counts_lock:
+        _counts[metric, outcome] += 1
+        due = time.monotonic() - _counts_flushed >= settings.CACHE_METRICS_FLUSH_SECONDS
+    if due:
+        flush_metrics()
+
+
+def flush_metrics():
+    """Add this process's fill counts to the shared totals"""
+    global _counts_flushed
+    with _counts_lock:
+        counts = dict(_counts)
+        _counts.clear()
+        _counts_flushed = time.monotonic()
+    for (metric, outcome), count in counts.items():
+        cache.add(_metric_key(metric, outcome), 0, None)
+        cache.incr(_metric_key(metric, outcome), count)
+
+
+def fill_stats(metric):
+    """Fill outcomes for `metric` across all processes, as of their last flush"""
+    flush_metrics()
+    found = cache.get_many([_metric_key(metric, outcome) for outcome in OUTCOMES])
+    return {outcome: found.get(_metric_key(metric, outcome), 0) for outcome in OUTCOMES}
+
+
+# ---------------------------------------------------------------------------
+# Compact values
+# ---------------------------------------------------------------------------
+
+PLAIN, COMPRESSED = b'p', b'z'
+
+
+def compact(value):
+    """
+    Encode plain data (tuples, strings, numbers, datetimes) for the cache:
+    pickled, and zlib-compressed when larger than CACHE_COMPRESS_MIN_BYTES.
+    """
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(data) >= settings.CACHE_COMPRESS_MIN_BYTES:
+        return COMPRESSED + zlib.compress(data, settings.CACHE_COMPRESS_LEVEL)
+    return PLAIN + data
+
+
+def expand(data):
+    """Decode what compact() produced"""
+    if data[:1] == COMPRESSED:
+        return pickle.loads(zlib.decompress(data[1:]))
+    return pickle.loads(data[1:])
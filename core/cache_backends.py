@@ -0,0 +1,252 @@
+"""
+TieredCache: a small per-process LRU (L1) in front of a shared cache (L2).
+
+Reads are served from L1 when possible, so hot keys cost no network hop.
+Writes go to L2 and are broadcast on a Redis pub/sub channel, so other
+processes drop their L1 copy; L1 entries also expire after a few seconds,
+which bounds staleness should a message be missed. Atomic operations (add,
+incr, decr) always go to L2.
+
+    CACHES['tiered'] = {
+        'BACKEND': 'core.cache_backends.TieredCache',
+        'LOCATION': 'default',  # the L2 cache alias
+        'OPTIONS': {'L1_MAX_ENTRIES': 1024, 'L1_TIMEOUT': 5},
+    }
+
+Pub/sub needs L2 to be django-redis; with any other L2 only the L1 timeout applies.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+
+class LocalTier:
+    """The L1 of one TieredCache alias, shared by every thread of the process"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            found = self.entries.get(key)
+            if found is None:
+                return _missing
+            pickled, expires = found
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return _missing
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (pickled, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_tiers = {}
+# Subscriber threads: channel -> (pid, thread)
+_listeners = {}
+_tiers_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._origin = None
+        options = params.get('OPTIONS', {})
+        self.l2_alias = location or 'default'
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.channel = options.get('CHANNEL', f'cache_invalidation_{self.l2_alias}')
+        with _tiers_lock:
+            if self.channel not in _tiers:
+                _tiers[self.channel] = LocalTier(options.get('L1_MAX_ENTRIES', 1024))
+            self.l1 = _tiers[self.channel]
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    # -----------------------------------------------------------------------
+    # Invalidation across processes
+    # -----------------------------------------------------------------------
+
+    @property
+    def origin(self):
+        """Identifies this cache's own invalidation messages; new in a forked worker"""
+        pid = os.getpid()
+        if self._origin is None or self._origin[0] != pid:
+            self._origin = (pid, uuid.uuid4().hex)
+        return self._origin[1]
+
+    def redis(self):
+        """Raw Redis client behind L2, or None when L2 isn't django-redis"""
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection(self.l2_alias)
+        except (ImportError, NotImplementedError):
+            return None
+
+    def invalidate(self, key):
+        """Drop `key` (a made key, or '*' for everything) from every process's L1"""
+        if key == '*':
+            self.l1.clear()
+        else:
+            self.l1.discard(key)
+        client = self.redis()
+        if client is not None:
+            self.ensure_listening(client)
+            try:
+                client.publish(self.channel, f'{self.origin}:{key}')
+            except Exception:
+                # The L1 timeout still bounds how stale other processes get
+                logger.warning("Could not publish cache invalidation for %s", key, exc_info=True)
+
+    def handle_message(self, data):
+        origin, _, key = (data.decode() if isinstance(data, bytes) else data).partition(':')
+        if origin == self.origin:
+            return
+        if key == '*':
+            self.l1.clear()
+        else:
+            self.l1.discard(key)
+
+    def ensure_listening(self, client):
+        # One subscriber thread per channel and process (restarted in forked workers)
+        listener = _listeners.get(self.channel)
+        if listener is not None and listener[0] == os.getpid() and listener[1].is_alive():
+            return
+        with _tiers_lock:
+            listener = _listeners.get(self.channel)
+            if listener is not None and listener[0] == os.getpid() and listener[1].is_alive():
+                return
+            thread = threading.Thread(target=self.listen, args=(client,), daemon=True,
+                                      name=f'{self.channel}-listener')
+            _listeners[self.channel] = (os.getpid(), thread)
+            thread.start()
+
+    def listen(self, client):
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Whatever was published while we weren't subscribed is lost
+                self.l1.clear()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.handle_message(message['data'])
+            except Exception:
+                logger.warning("Cache invalidation listener for %s failed, resubscribing", self.channel,
+                               exc_info=True)
+                time.sleep(1)
+
+    # -----------------------------------------------------------------------
+    # Cache API
+    # -----------------------------------------------------------------------
+
+    def l1_timeout_for(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        return self.l1_timeout if timeout is None else min(self.l1_timeout, timeout)
+
+    def get(self, key, default=None, version=None):
+        made_key = self.make_and_validate_key(key, version=version)
+        value = self.l1.get(made_key)
+        if value is not _missing:
+            return value
+        value = self.l2.get(key, _missing, version=version)
+        if value is _missing:
+            return default
+        self.l1.set(made_key, value, self.l1_timeout)
+        # Keep the subscriber running even in processes that only read
+        client = self.redis()
+        if client is not None:
+            self.ensure_listening(client)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        for key in keys:
+            value = self.l1.get(self.make_and_validate_key(key, version=version))
+            if value is _missing:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote:
+            fetched = self.l2.get_many(remote, version=version)
+            for key, value in fetched.items():
+                self.l1.set(self.make_and_validate_key(key, version=version), value, self.l1_timeout)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout, version=version)
+        self.invalidate(made_key)
+        if self.l1_timeout_for(timeout) > 0:
+            self.l1.set(made_key, value, self.l1_timeout_for(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        for key, value in data.items():
+            self.set(key, value, timeout, version=version)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Atomic in L2 only; L1 never answers an add
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self.invalidate(self.make_and_validate_key(key, version=version))
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        self.invalidate(self.make_and_validate_key(key, version=version))
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        value = self.l2.decr(key, delta, version=version)
+        self.invalidate(self.make_and_validate_key(key, version=version))
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        deleted = self.l2.delete(key, version=version)
+        self.invalidate(self.make_and_validate_key(key, version=version))
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        self.l2.clear()
+        self.invalidate('*')
@@ -0,0 +1,112 @@
+"""
+Keyset (seek) pagination.
+
+A page is the rows that come after the last row of the previous page in a
+unique ordering such as (date, id), read with a WHERE on those columns rather
+than an OFFSET. With an index on the ordering columns, page 500 costs the same
+as page 1, and rows added or removed meanwhile don't shift pages. The cursor
+is the previous page's last row's ordering values, opaque to clients.
+
+KeysetPagination is the DRF default; a view sets `keyset_ordering` (default
+('id',)). HTML views use paginate() directly.
+"""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(values):
+    plain = [value.isoformat() if isinstance(value, (date, datetime)) else
+             str(value) if isinstance(value, (UUID, Decimal)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(plain, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """The ordering values in `cursor`; ValueError if it isn't one for `ordering`"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def seek(queryset, ordering, values):
+    """Rows after `values` in `ordering` (field names, '-' for descending)"""
+    fields = [(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt') for field in ordering]
+    after = Q()
+    for i, (field, lookup) in enumerate(fields):
+        ties = {name: value for (name, _), value in zip(fields[:i], values)}
+        after |= Q(**ties, **{f'{field}__{lookup}': values[i]})
+    # Bound the leading column on its own too, so the index is range-scanned from the cursor
+    leading, lookup = fields[0]
+    return queryset.filter(Q(**{f'{leading}__{lookup}e': values[0]}) & after)
+
+
+def paginate(queryset, ordering, cursor=None, page_size=None):
+    """
+    One page of `queryset` in `ordering`, after `cursor`. Returns the rows and
+    the cursor of the next page (None on the last one).
+    """
+    page_size = page_size or settings.REST_FRAMEWORK['PAGE_SIZE']
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = seek(queryset, ordering, decode_cursor(cursor, ordering))
+    # One row more than the page tells whether there is a next page
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor([getattr(rows[-1], field.lstrip('-')) for field in ordering])
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.REST_FRAMEWORK['PAGE_SIZE']
+        return max(1, min(requested, settings.API_MAX_PAGE_SIZE))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = getattr(view, 'keyset_ordering', ('id',))
+        try:
+            rows, self.next_cursor = paginate(
+                queryset, ordering, request.query_params.get(self.cursor_query_param), self.get_page_size(request),
+            )
+        except ValueError:
+            raise NotFound('Invalid cursor')
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
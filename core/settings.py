@@ -165,7 +165,13 @@ REST_FRAMEWORK = {
         "rest_framework.throttling.UserRateThrottle",
     ],
     "DEFAULT_THROTTLE_RATES": {"anon": "100/day", "user": "1000/day"},
+    # Lists are paged by keyset on each view's keyset_ordering; ?page_size= up to API_MAX_PAGE_SIZE
+    "DEFAULT_PAGINATION_CLASS": "core.pagination.KeysetPagination",
+    "PAGE_SIZE": env.int("API_PAGE_SIZE", default=50),
 }
+API_MAX_PAGE_SIZE = env.int("API_MAX_PAGE_SIZE", default=200)
+# Events per page of the public event listing
+EVENT_LIST_PAGE_SIZE = env.int("EVENT_LIST_PAGE_SIZE", default=24)
 
 # Celery
 CELERY_BROKER_URL = env("CELERY_BROKER_URL", default="redis://127.0.0.1:6379/0")
@@ -174,6 +180,152 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    "expire-pending-orders": {
+        "task": "orders.tasks.expire_pending_orders",
+        "schedule": float(env.int("ORDER_EXPIRY_TICK_SECONDS", default=5)),
+    },
+    "reconcile-stock-gate": {
+        "task": "orders.tasks.reconcile_stock_gate",
+        "schedule": float(env.int("STOCK_GATE_RECONCILE_SECONDS", default=5)),
+    },
+    "resume-fulfillments": {
+        "task": "orders.tasks.resume_fulfillments",
+        "schedule": 300.0,
+    },
+    "flush-redemptions": {
+        "task": "tickets.tasks.flush_redemptions",
+        "schedule": float(env.int("REDEMPTION_FLUSH_TICK_SECONDS", default=2)),
+    },
+    "reconcile-checkins": {
+        "task": "tickets.tasks.reconcile_checkins",
+        "schedule": float(env.int("CHECKIN_RECONCILE_SECONDS", default=30)),
+    },
+    "flush-search-index": {
+        "task": "events.tasks.flush_search_index",
+        "schedule": 60.0,
+    },
+}
+
+# Cache
+# A shared Redis when REDIS_URL is set; otherwise each process keeps its own in memory
+REDIS_URL = env("REDIS_URL", default="")
+# Hot keys (core.cache) are also kept in a small per-process LRU in front of Redis
+CACHE_L1_MAX_ENTRIES = env.int("CACHE_L1_MAX_ENTRIES", default=1024)
+# How long a process may serve its L1 copy if it misses an invalidation message
+CACHE_L1_TIMEOUT = env.int("CACHE_L1_TIMEOUT", default=5)
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
+        },
+        "tiered": {
+            "BACKEND": "core.cache_backends.TieredCache",
+            "LOCATION": "default",
+            "OPTIONS": {"L1_MAX_ENTRIES": CACHE_L1_MAX_ENTRIES, "L1_TIMEOUT": CACHE_L1_TIMEOUT},
+        },
+    }
+else:
+    # Both aliases share one local-memory store; an L1 in front of it would only add staleness
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "tiered": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+
+# Cached pages and listings (core.cache.fill)
+# How long one request may hold the recompute lock for a key
+CACHE_FILL_LOCK_SECONDS = env.int("CACHE_FILL_LOCK_SECONDS", default=30)
+# With nothing cached at all, how long other requests wait for it before computing it themselves
+CACHE_FILL_WAIT_SECONDS = env.float("CACHE_FILL_WAIT_SECONDS", default=2.0)
+# How long an expired entry is kept, to serve while it is recomputed
+CACHE_STALE_SECONDS = env.int("CACHE_STALE_SECONDS", default=60 * 10)
+# Early refresh eagerness (XFetch beta); 0 turns it off
+CACHE_EARLY_REFRESH_BETA = env.float("CACHE_EARLY_REFRESH_BETA", default=1.0)
+CACHE_METRICS_FLUSH_SECONDS = env.int("CACHE_METRICS_FLUSH_SECONDS", default=10)
+# Cached values (core.cache.compact) are zlib-compressed from this size on
+CACHE_COMPRESS_MIN_BYTES = env.int("CACHE_COMPRESS_MIN_BYTES", default=1024)
+CACHE_COMPRESS_LEVEL = env.int("CACHE_COMPRESS_LEVEL", default=1)
+
+# Inventory
+# Orders expired per query on each expiry tick
+ORDER_EXPIRY_BATCH_SIZE = env.int("ORDER_EXPIRY_BATCH_SIZE", default=500)
+# How long the aggregated sold count of a sharded ticket may be served from cache
+INVENTORY_SHARD_CACHE_SECONDS = env.int("INVENTORY_SHARD_CACHE_SECONDS", default=2)
+# Reject sold-out checkouts from cache-side stock counters before touching the database
+INVENTORY_GATE_ENABLED = env.bool("INVENTORY_GATE_ENABLED", default=False)
+
+# Fulfillment (issue tickets -> notify, as Celery tasks after payment)
+# Paid orders still unfulfilled this long after payment are re-queued
+FULFILLMENT_STALL_SECONDS = env.int("FULFILLMENT_STALL_SECONDS", default=60 * 10)
+# Rows per INSERT/UPDATE when issuing tickets in bulk
+ISSUANCE_BATCH_SIZE = env.int("ISSUANCE_BATCH_SIZE", default=1000)
+
+# Ticket QR codes, rendered on request rather than stored
+# Images kept in each process's memory, in front of the shared cache
+QR_MEMORY_CACHE_SIZE = env.int("QR_MEMORY_CACHE_SIZE", default=1024)
+QR_CACHE_SECONDS = env.int("QR_CACHE_SECONDS", default=60 * 60 * 24 * 30)
+# Processes used to pre-render QR codes in bulk (0 = one per CPU)
+QR_RENDER_WORKERS = env.int("QR_RENDER_WORKERS", default=0)
+# Per-event ticket signing keys are derived from this
+TICKET_SIGNING_SECRET = env("TICKET_SIGNING_SECRET", default=SECRET_KEY)
+# Signed tickets stay valid this long after the event ends
+TICKET_SIGNATURE_GRACE_SECONDS = env.int("TICKET_SIGNATURE_GRACE_SECONDS", default=60 * 60 * 24)
+TICKET_SIGNING_VERSION_CACHE_SECONDS = env.int("TICKET_SIGNING_VERSION_CACHE_SECONDS", default=60)
+# Most scans an entry gate may send to validate_batch at once
+VALIDATION_BATCH_MAX = env.int("VALIDATION_BATCH_MAX", default=500)
+# Offline scanners: deltas re-read this far before the version they were asked for...
+SCANNER_MANIFEST_OVERLAP_SECONDS = env.int("SCANNER_MANIFEST_OVERLAP_SECONDS", default=30)
+# ...and versions older than this get a full manifest instead
+SCANNER_MANIFEST_DELTA_MAX_AGE_SECONDS = env.int("SCANNER_MANIFEST_DELTA_MAX_AGE_SECONDS", default=60 * 60 * 12)
+SCANNER_UPLOAD_MAX = env.int("SCANNER_UPLOAD_MAX", default=5000)
+# Redeem signed scans against cache-side marks and write them to the database behind
+# (needs a shared cache that doesn't evict, i.e. Redis with maxmemory-policy noeviction)
+REDEMPTION_FAST_PATH_ENABLED = env.bool("REDEMPTION_FAST_PATH_ENABLED", default=False)
+REDEMPTION_FLUSH_BATCH_SIZE = env.int("REDEMPTION_FLUSH_BATCH_SIZE", default=1000)
+# A log position left unwritten this long (a crashed scan) stops holding up the flush
+REDEMPTION_LOG_GAP_SECONDS = env.int("REDEMPTION_LOG_GAP_SECONDS", default=30)
+REDEMPTION_ORGANIZER_CACHE_SECONDS = env.int("REDEMPTION_ORGANIZER_CACHE_SECONDS", default=60 * 5)
+# Redemption marks outlive the event's signed codes by this much (late flushes, offline uploads)
+REDEMPTION_MARK_MARGIN_SECONDS = env.int("REDEMPTION_MARK_MARGIN_SECONDS", default=60 * 60 * 24)
+# Live check-in stream: how often each connection polls the cache, and how long it stays open
+CHECKIN_STREAM_INTERVAL_SECONDS = env.float("CHECKIN_STREAM_INTERVAL_SECONDS", default=1.0)
+CHECKIN_STREAM_MAX_SECONDS = env.int("CHECKIN_STREAM_MAX_SECONDS", default=60 * 5)
+CHECKIN_STREAM_KEEPALIVE_SECONDS = env.int("CHECKIN_STREAM_KEEPALIVE_SECONDS", default=15)
+CHECKIN_STREAM_RETRY_SECONDS = env.int("CHECKIN_STREAM_RETRY_SECONDS", default=3)
+# Check-in streams open at once across all workers; keep it well under the worker count
+CHECKIN_MAX_STREAMS = env.int("CHECKIN_MAX_STREAMS", default=20)
+
+# Search indexing (events.indexing): edits within this window are sent to Meilisearch as one update
+SEARCH_INDEX_COALESCE_SECONDS = env.int("SEARCH_INDEX_COALESCE_SECONDS", default=2)
+SEARCH_INDEX_BATCH_SIZE = env.int("SEARCH_INDEX_BATCH_SIZE", default=500)
+SEARCH_INDEX_TASK_TIMEOUT_SECONDS = env.int("SEARCH_INDEX_TASK_TIMEOUT_SECONDS", default=30)
+# Failed updates are retried after this, doubling each time, and given up on after the max attempts
+SEARCH_INDEX_RETRY_SECONDS = env.int("SEARCH_INDEX_RETRY_SECONDS", default=30)
+SEARCH_INDEX_MAX_ATTEMPTS = env.int("SEARCH_INDEX_MAX_ATTEMPTS", default=8)
+# Search (events.search): request timeout, result cache, and the circuit breaker that stops
+# calling Meilisearch for a cooldown after this many failures in a row
+SEARCH_TIMEOUT_SECONDS = env.int("SEARCH_TIMEOUT_SECONDS", default=2)
+SEARCH_RESULT_CACHE_SECONDS = env.int("SEARCH_RESULT_CACHE_SECONDS", default=30)
+# Deepest search hit the event list pages to (Meilisearch's maxTotalHits, set by configure_index)
+SEARCH_MAX_TOTAL_HITS = env.int("SEARCH_MAX_TOTAL_HITS", default=1000)
+SEARCH_BREAKER_FAILURES = env.int("SEARCH_BREAKER_FAILURES", default=3)
+SEARCH_BREAKER_COOLDOWN_SECONDS = env.int("SEARCH_BREAKER_COOLDOWN_SECONDS", default=30)
+
+# Idempotency-Key handling for order creation and payment initiation
+IDEMPOTENCY_TTL_SECONDS = env.int("IDEMPOTENCY_TTL_SECONDS", default=60 * 60 * 24)
+IDEMPOTENCY_LOCK_SECONDS = env.int("IDEMPOTENCY_LOCK_SECONDS", default=60)
+IDEMPOTENCY_WAIT_SECONDS = env.int("IDEMPOTENCY_WAIT_SECONDS", default=10)
+
+# Waiting room (per-event rate is Event.admission_rate)
+WAITING_ROOM_ADMISSION_SECONDS = env.int("WAITING_ROOM_ADMISSION_SECONDS", default=600)
+WAITING_ROOM_CONFIG_CACHE_SECONDS = env.int("WAITING_ROOM_CONFIG_CACHE_SECONDS", default=30)
+WAITING_ROOM_POLL_SECONDS = env.int("WAITING_ROOM_POLL_SECONDS", default=2)
+WAITING_ROOM_STREAM_SECONDS = env.int("WAITING_ROOM_STREAM_SECONDS", default=60)
+# Queue streams open at once across all workers; keep it well under the worker count.
+# Buyers beyond it poll (by EventSource reconnects) instead
+WAITING_ROOM_MAX_STREAMS = env.int("WAITING_ROOM_MAX_STREAMS", default=20)
 
 # Sentry
 import sentry_sdk
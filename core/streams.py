@@ -0,0 +1,66 @@
+"""
+Server-sent event streams that don't starve the workers serving them.
+
+A stream occupies a worker for its whole life, so bounded() makes sure that
+is all it occupies:
+
+- the request's database connections are closed before anything is sent, and
+  again before each later event (a stream mostly reads the cache);
+- at most `limit` streams of a pool are open at once, across processes. Each
+  holds a slot key that expires on its own, so a crashed worker can't leak
+  one. Over the limit, the client gets the `busy` events instead: a single
+  update and a retry hint, which turns EventSource into plain polling.
+"""
+import random
+
+from django.core.cache import cache
+from django.db import connections
+
+
+def _slot_keys(pool, limit):
+    return [f'stream_slot_{pool}_{i}' for i in range(limit)]
+
+
+def acquire_slot(pool, limit, hold_seconds):
+    """A slot key if fewer than `limit` streams of `pool` are open, else None"""
+    keys = _slot_keys(pool, limit)
+    taken = cache.get_many(keys)
+    free = [key for key in keys if key not in taken]
+    random.shuffle(free)
+    # Others may be taking the same free slots; a few tries is enough
+    for key in free[:3]:
+        if cache.add(key, 1, hold_seconds):
+            return key
+    return None
+
+
+def open_streams(pool, limit):
+    return len(cache.get_many(_slot_keys(pool, limit)))
+
+
+def release_connections():
+    """Close this thread's database connections, except one inside a transaction (tests, ATOMIC_REQUESTS)"""
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def bounded(pool, limit, duration, events, busy):
+    """
+    Stream `events()` while holding one of `limit` slots of `pool` for up to
+    `duration` seconds, or `busy()` when they are all taken.
+    """
+    slot = acquire_slot(pool, limit, int(duration) + 30)
+    source = events() if slot else busy()
+
+    def run():
+        try:
+            for chunk in source:
+                # Also whatever an update had to open (e.g. a config cache miss)
+                release_connections()
+                yield chunk
+        finally:
+            if slot:
+                cache.delete(slot)
+
+    return run()
@@ -0,0 +1,218 @@
+import pickle
+import threading
+import time
+from datetime import datetime, timezone
+from unittest import mock
+from uuid import UUID
+
+from django.core.cache import cache, caches
+from django.test import SimpleTestCase, override_settings
+
+from core.cache import compact, expand, fill, fill_stats, flush_metrics, invalidate_namespace, namespace_generation, namespace_key
+from core.pagination import decode_cursor, encode_cursor, seek
+from events.models import Event
+
+
+class CacheNamespaceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_invalidation_drops_every_key_in_the_namespace(self):
+        cache.set(namespace_key('events', 'list', 'q_jazz'), ['jazz'])
+        cache.set(namespace_key('events', 'home_featured'), ['featured'])
+        cache.set(namespace_key('orders', 'summary'), ['kept'])
+
+        invalidate_namespace('events')
+        self.assertIsNone(cache.get(namespace_key('events', 'list', 'q_jazz')))
+        self.assertIsNone(cache.get(namespace_key('events', 'home_featured')))
+        self.assertEqual(cache.get(namespace_key('orders', 'summary')), ['kept'])
+
+    def test_generation_only_moves_forward(self):
+        first = namespace_generation('events')
+        self.assertEqual(invalidate_namespace('events'), first + 1)
+        stale_key = namespace_key('events', 'list')
+        cache.set(stale_key, 'stale')
+
+        # The generation counter itself was evicted
+        cache.delete('ns_generation_events')
+        self.assertNotEqual(namespace_key('events', 'list'), stale_key)
+        self.assertGreater(namespace_generation('events'), first + 1)
+
+    def test_invalidating_a_new_namespace(self):
+        generation = invalidate_namespace('fresh')
+        self.assertEqual(namespace_generation('fresh'), generation)
+
+
+class CacheFillTests(SimpleTestCase):
+    def setUp(self):
+        # Drop counts left in this process by earlier tests
+        flush_metrics()
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value='fresh', seconds=0):
+        def compute():
+            self.calls += 1
+            time.sleep(seconds)
+            return value
+        return compute
+
+    def test_computes_once_then_hits(self):
+        for _ in range(3):
+            self.assertEqual(fill('events', 'list', self.compute(), 60), 'fresh')
+        self.assertEqual(self.calls, 1)
+        stats = fill_stats('events')
+        self.assertEqual((stats['recompute'], stats['hit']), (1, 2))
+
+    def test_concurrent_cold_requests_compute_once(self):
+        results = []
+        compute = self.compute(seconds=0.2)
+        threads = [threading.Thread(target=lambda: results.append(fill('events', 'list', compute, 60)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['fresh'] * 8)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(fill_stats('events')['wait'], 7)
+
+    def test_invalidated_entry_is_served_while_another_request_recomputes(self):
+        fill('events', 'list', self.compute('old'), 60)
+        invalidate_namespace('events')
+        # Another request holds the recompute lock
+        cache.add('events:fill:list:lock', 1)
+        self.assertEqual(fill('events', 'list', self.compute('new'), 60), 'old')
+        self.assertEqual(fill_stats('events')['stale'], 1)
+
+        cache.delete('events:fill:list:lock')
+        self.assertEqual(fill('events', 'list', self.compute('new'), 60), 'new')
+        self.assertEqual(self.calls, 2)
+
+    @override_settings(CACHE_FILL_WAIT_SECONDS=0)
+    def test_computes_itself_when_the_lock_holder_is_too_slow(self):
+        cache.add('events:fill:list:lock', 1)
+        self.assertEqual(fill('events', 'list', self.compute(), 60), 'fresh')
+        self.assertEqual(fill_stats('events')['miss'], 1)
+
+    def test_refreshes_early_near_expiry(self):
+        fill('events', 'list', self.compute(), 60)
+        entry = cache.get('events:fill:list')
+        # Took 10s to compute and expires in 1s: all but certain to be refreshed now
+        cache.set('events:fill:list', entry._replace(expires=time.time() + 1, delta=10))
+        with mock.patch('core.cache.random.random', return_value=0.5):
+            fill('events', 'list', self.compute(), 60)
+        self.assertEqual(self.calls, 2)
+
+        with override_settings(CACHE_EARLY_REFRESH_BETA=0):
+            fill('events', 'list', self.compute(), 60)
+        self.assertEqual(self.calls, 2)
+
+
+TIERED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-l2'},
+    'tiered': {
+        'BACKEND': 'core.cache_backends.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {'L1_MAX_ENTRIES': 3, 'L1_TIMEOUT': 5, 'CHANNEL': 'tiered-test'},
+    },
+}
+
+
+@override_settings(CACHES=TIERED_CACHES)
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tiered = caches['tiered']
+        self.l2 = caches['default']
+        self.tiered.clear()
+
+    def test_reads_are_served_from_process_memory(self):
+        self.tiered.set('featured', ['a', 'b'])
+        self.assertEqual(self.l2.get('featured'), ['a', 'b'])
+        # Gone from L2, still in L1
+        self.l2.delete('featured')
+        self.assertEqual(self.tiered.get('featured'), ['a', 'b'])
+
+        # L1 copies expire, however an invalidation was missed
+        with mock.patch('core.cache_backends.time.monotonic', return_value=time.monotonic() + 6):
+            self.assertIsNone(self.tiered.get('featured'))
+
+    def test_l2_values_are_kept_in_l1(self):
+        self.l2.set_many({'one': 1, 'two': 2})
+        self.assertEqual(self.tiered.get_many(['one', 'two', 'three']), {'one': 1, 'two': 2})
+        self.l2.clear()
+        self.assertEqual(self.tiered.get('one'), 1)
+
+    def test_l1_is_a_bounded_lru_of_copies(self):
+        for key in ('a', 'b', 'c'):
+            self.tiered.set(key, [key])
+        self.tiered.get('a')
+        self.tiered.set('d', ['d'])
+        self.assertEqual(list(self.tiered.l1.entries), [self.tiered.make_key(k) for k in ('c', 'a', 'd')])
+
+        self.tiered.get('a').append('mutated')
+        self.assertEqual(self.tiered.get('a'), ['a'])
+
+    def test_atomic_operations_go_to_l2(self):
+        self.tiered.set('counter', 1)
+        self.l2.set('counter', 10)
+        self.assertEqual(self.tiered.incr('counter'), 11)
+        self.assertEqual(self.tiered.get('counter'), 11)
+        self.assertFalse(self.tiered.add('counter', 0))
+
+    def test_invalidation_messages_from_other_processes(self):
+        self.tiered.set('featured', 'old')
+        self.l2.set('featured', 'new')
+        self.tiered.handle_message(f'{self.tiered.origin}:{self.tiered.make_key("featured")}')
+        self.assertEqual(self.tiered.get('featured'), 'old')
+
+        self.tiered.handle_message(f'elsewhere:{self.tiered.make_key("featured")}'.encode())
+        self.assertEqual(self.tiered.get('featured'), 'new')
+        self.l2.set('featured', 'newer')
+        self.tiered.handle_message('elsewhere:*')
+        self.assertEqual(self.tiered.get('featured'), 'newer')
+
+    def test_forked_workers_get_their_own_origin(self):
+        parent = self.tiered.origin
+        self.assertEqual(self.tiered.origin, parent)
+        with mock.patch('core.cache_backends.os.getpid', return_value=-1):
+            child = self.tiered.origin
+        self.assertNotEqual(child, parent)
+
+        # The parent's messages reach the child
+        self.tiered.set('featured', 'old')
+        self.l2.set('featured', 'new')
+        with mock.patch('core.cache_backends.os.getpid', return_value=-1):
+            self.tiered.handle_message(f'{parent}:{self.tiered.make_key("featured")}')
+        self.assertEqual(self.tiered.get('featured'), 'new')
+
+
+class CompactValueTests(SimpleTestCase):
+    def test_round_trip(self):
+        small = ('id', 1)
+        large = tuple(('event', i, f'description {i} ' * 20) for i in range(50))
+        self.assertEqual(expand(compact(small)), small)
+        self.assertEqual(expand(compact(large)), large)
+        self.assertEqual(compact(small)[:1], b'p')
+        self.assertEqual(compact(large)[:1], b'z')
+        self.assertLess(len(compact(large)), len(pickle.dumps(large)) // 10)
+
+
+class KeysetCursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        values = [datetime(2026, 5, 1, 18, 30, tzinfo=timezone.utc), UUID(int=7)]
+        cursor = encode_cursor(values)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor, ('date', 'id')), ['2026-05-01T18:30:00+00:00', str(UUID(int=7))])
+
+    def test_rejects_foreign_cursors(self):
+        for cursor in ('nonsense', encode_cursor([1]), 'eyJhIjoxfQ'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, ('date', 'id'))
+
+    def test_seek_breaks_ties_on_later_columns(self):
+        queryset = Event.objects.all()
+        where = str(seek(queryset, ('-date', 'id'), ['2026-05-01', 9]).query)
+        self.assertIn('"date" <= ', where)
+        self.assertIn('"date" < ', where)
+        self.assertIn('"id" > 9', where)
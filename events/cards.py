@@ -0,0 +1,29 @@
+"""
+Event cards: the few fields listing pages show, for caching.
+
+A cached listing is a compact() tuple of rows rather than pickled Event
+instances, which would carry _state and every field, including the full
+description. unpack() turns the rows back into Event instances with only the
+card fields loaded, so templates and comparisons work as before.
+"""
+from core.cache import compact, expand
+from .models import Event
+
+# In model field order, as Event.from_db expects
+FIELDS = ('id', 'name', 'description', 'date', 'venue', 'online_link', 'poster')
+# Matches truncatechars in events/event_list.html
+DESCRIPTION_CHARS = 300
+
+
+def pack(events):
+    # One character past the excerpt, so truncatechars still marks it as cut
+    limit = DESCRIPTION_CHARS + 1
+    return compact(tuple(
+        (event.id, event.name, event.description[:limit], event.date, event.venue, event.online_link,
+         event.poster.name or '')
+        for event in events
+    ))
+
+
+def unpack(data):
+    return [Event.from_db('default', FIELDS, row) for row in expand(data)]
@@ -0,0 +1,146 @@
+"""
+Asynchronous search indexing through an outbox.
+
+Saving or deleting an event writes a PendingIndexUpdate row in the same
+transaction, and after commit schedules a flush SEARCH_INDEX_COALESCE_SECONDS
+later; saves make no call to Meilisearch. Each event has at most one row, and
+only one flush is scheduled per window, so a burst of edits is sent as one
+document. flush() reads whether the event still exists at send time: existing
+events are upserted, deleted ones removed.
+
+Failed updates are retried with exponential backoff and marked failed (dead
+letter) after SEARCH_INDEX_MAX_ATTEMPTS. A beat sweep flushes whatever a lost
+task left behind. pause() holds flushes back while a new index is built.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import search
+from .models import Event, PendingIndexUpdate
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_KEY = 'search_index_flush_scheduled'
+PAUSED_KEY = 'search_index_paused'
+
+
+def pause(seconds):
+    """
+    Hold updates back (they keep being queued) for up to `seconds`, e.g. while
+    reindex_events --swap builds a new index that the swap would drop them from
+    """
+    cache.set(PAUSED_KEY, 1, seconds)
+
+
+def resume():
+    cache.delete(PAUSED_KEY)
+
+
+def paused():
+    return cache.get(PAUSED_KEY) is not None
+
+
+def queue(event_id):
+    """Have `event_id`'s search document sent (or removed) after the current transaction commits"""
+    if search.get_client() is None:
+        return
+    now = timezone.now()
+    # One statement, and coalesces with an update already waiting for the event
+    PendingIndexUpdate.objects.bulk_create(
+        [PendingIndexUpdate(event_id=event_id, queued_at=now, next_attempt_at=now)],
+        update_conflicts=True,
+        unique_fields=['event_id'],
+        update_fields=['queued_at', 'next_attempt_at', 'attempts', 'last_error', 'failed'],
+    )
+    transaction.on_commit(schedule_flush)
+
+
+def schedule_flush():
+    """Flush in SEARCH_INDEX_COALESCE_SECONDS, unless a flush is already on its way"""
+    from .tasks import flush_search_index
+
+    window = settings.SEARCH_INDEX_COALESCE_SECONDS
+    # Expires in case the task is lost; the sweep sends what it was to send
+    if not cache.add(SCHEDULED_KEY, 1, window + 30):
+        return
+    try:
+        flush_search_index.apply_async(countdown=window, retry=False)
+    except Exception:
+        cache.delete(SCHEDULED_KEY)
+        logger.exception("Could not schedule a search index flush; the sweep will send it")
+
+
+def flush(batch_size=None):
+    """Send due updates in batches. Returns the number of events sent."""
+    batch_size = batch_size or settings.SEARCH_INDEX_BATCH_SIZE
+    # Changes queued from here on schedule a flush of their own
+    cache.delete(SCHEDULED_KEY)
+    index = search.get_index()
+    if index is None:
+        return 0
+
+    sent = 0
+    claimed = set()
+    while True:
+        if paused():
+            return sent
+        # Not locked while sending, so event saves never wait on Meilisearch. An update
+        # re-queued meanwhile has a newer queued_at and stays for the next flush.
+        due = list(
+            PendingIndexUpdate.objects.filter(failed=False, next_attempt_at__lte=timezone.now())
+            .exclude(pk__in=claimed).order_by('next_attempt_at')[:batch_size]
+        )
+        if not due:
+            return sent
+        claimed.update(update.pk for update in due)
+        try:
+            send(index, [update.event_id for update in due])
+        except Exception as e:
+            search.breaker.failure()
+            search.forget_index(e)
+            logger.warning("Search index update of %d events failed: %s", len(due), e)
+            for update in due:
+                failed(update, e)
+            # Left for the retry unless the engine still takes requests
+            index = search.get_index()
+            if index is None:
+                return sent
+            continue
+        search.breaker.success()
+        search.index_changed()
+        for update in due:
+            PendingIndexUpdate.objects.filter(pk=update.pk, queued_at=update.queued_at).delete()
+        sent += len(due)
+        if len(due) < batch_size:
+            return sent
+
+
+def send(index, event_ids):
+    client = search.get_client()
+    events = Event.objects.filter(id__in=event_ids).only(*search.DOCUMENT_FIELDS)
+    documents = [search.event_document(event) for event in events]
+    deleted = set(event_ids) - {document['id'] for document in documents}
+    timeout_ms = settings.SEARCH_INDEX_TASK_TIMEOUT_SECONDS * 1000
+    if documents:
+        search.wait_for_task(client, index.add_documents(documents, primary_key='id'), timeout_ms)
+    if deleted:
+        search.wait_for_task(client, index.delete_documents(sorted(deleted)), timeout_ms)
+
+
+def failed(update, error):
+    attempts = update.attempts + 1
+    backoff = min(settings.SEARCH_INDEX_RETRY_SECONDS * 2 ** (attempts - 1), 3600)
+    dead = attempts >= settings.SEARCH_INDEX_MAX_ATTEMPTS
+    PendingIndexUpdate.objects.filter(pk=update.pk, queued_at=update.queued_at).update(
+        attempts=attempts,
+        next_attempt_at=timezone.now() + timedelta(seconds=backoff),
+        last_error=str(error)[:2000],
+        failed=dead,
+    )
+    if dead:
+        logger.error("Gave up indexing event %s after %d attempts: %s", update.event_id, attempts, error)
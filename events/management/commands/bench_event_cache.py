@@ -0,0 +1,57 @@
+import pickle
+import random
+import string
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events import cards
+from events.models import Event
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Compare cached event listings stored as pickled Event instances with compact card projections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=50, help='Events per cached listing')
+        parser.add_argument('--description-chars', type=int, default=2000)
+        parser.add_argument('--rounds', type=int, default=500, help='Encode/decode rounds to time')
+
+    def handle(self, *args, **options):
+        organizer = CustomUser.objects.create_user(username=f'bench_cache_{time.time_ns()}', role='organizer')
+        words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(500)]
+        now = timezone.now()
+        Event.objects.bulk_create([
+            Event(
+                name=f'Event {i}', organizer=organizer, is_published=True, date=now + timedelta(days=i + 1),
+                venue='KICC, Nairobi', poster=f'event_posters/poster_{i}.jpg',
+                description=' '.join(random.choices(words, k=options['description_chars'] // 6)),
+            )
+            for i in range(options['events'])
+        ])
+        try:
+            events = list(Event.objects.filter(organizer=organizer).order_by('date'))
+            # What the views used to cache, and what they cache now
+            strategies = {
+                'instances': (lambda: pickle.dumps(events, pickle.HIGHEST_PROTOCOL), pickle.loads),
+                'cards': (lambda: cards.pack(events), cards.unpack),
+            }
+            self.stdout.write(f"{'format':>10} {'bytes':>9} {'per event':>10} {'encode us':>10} {'decode us':>10}")
+            for name, (encode, decode) in strategies.items():
+                data = encode()
+                started = time.perf_counter()
+                for _ in range(options['rounds']):
+                    encode()
+                encode_us = (time.perf_counter() - started) / options['rounds'] * 1e6
+                started = time.perf_counter()
+                for _ in range(options['rounds']):
+                    decode(data)
+                decode_us = (time.perf_counter() - started) / options['rounds'] * 1e6
+                self.stdout.write(
+                    f"{name:>10} {len(data):>9,} {len(data) // len(events):>10,} {encode_us:>10,.0f} {decode_us:>10,.0f}"
+                )
+        finally:
+            organizer.delete()
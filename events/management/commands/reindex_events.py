@@ -1,21 +1,86 @@
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from events import indexing
 from events.models import Event
-from events.search import index_event
+from events.search import (
+    DOCUMENT_FIELDS, INDEX_UID, bulk_index, configure_index, get_client, get_index, index_changed, wait_for_task,
+)
+
+# How long --swap holds queued index updates back without hearing from the build
+PAUSE_SECONDS = 10 * 60
 
 class Command(BaseCommand):
     help = 'Reindex all events to Meilisearch'
 
-    def handle(self, *args, **kwargs):
-        events = Event.objects.all()
-        count = events.count()
-        
-        self.stdout.write(f'Reindexing {count} events...')
-        
-        for event in events:
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents per add_documents call')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time')
+        parser.add_argument('--workers', type=int, default=4, help='Batches in flight at once')
+        parser.add_argument('--swap', action='store_true',
+                            help='Build a fresh index and swap it in when complete (also drops deleted events); '
+                                 'index updates queued meanwhile are held back and sent after the swap')
+
+    def handle(self, *args, **options):
+        client = get_client()
+        if client is None:
+            raise CommandError('Meilisearch is not configured (MEILISEARCH_URL)')
+
+        if not options['swap']:
+            index = get_index()
+            if index is None:
+                raise CommandError('Meilisearch is unavailable')
+            sent, elapsed = self.build(client, index, options)
+            index_changed()
+        else:
+            # Edits sent to the live index during the build would be lost with it in the swap.
+            # They are held in the outbox instead, and sent to the new index once it is live.
+            indexing.pause(PAUSE_SECONDS)
             try:
-                index_event(event)
-                self.stdout.write(f'  Indexed: {event.name}')
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'  Failed: {event.name} - {e}'))
-                
-        self.stdout.write(self.style.SUCCESS('Reindexing completed.'))
+                sent, elapsed = self.build_and_swap(client, options)
+            finally:
+                indexing.resume()
+            held = indexing.flush()
+            self.stdout.write(f'Sent {held} updates queued during the build')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Reindexing completed: {sent} events in {elapsed:.1f}s ({sent / max(elapsed, 1e-9):,.0f} docs/sec)'
+        ))
+
+    def build_and_swap(self, client, options):
+        # Searches keep using the live index until the new one is complete
+        target = f'{INDEX_UID}_reindex'
+        try:
+            wait_for_task(client, client.delete_index(target))
+        except RuntimeError:
+            pass  # No leftover from an earlier run
+        wait_for_task(client, client.create_index(target, {'primaryKey': 'id'}))
+        sent, elapsed = self.build(client, client.index(target), options)
+
+        get_index()  # The live index must exist to be swapped with
+        wait_for_task(client, client.swap_indexes([{'indexes': [INDEX_UID, target]}]))
+        # After the swap it holds the old documents
+        wait_for_task(client, client.delete_index(target))
+        self.stdout.write(f'Swapped {target} in as {INDEX_UID}')
+        index_changed()
+        return sent, elapsed
+
+    def build(self, client, index, options):
+        # Indexes created before a settings change keep their old settings until told otherwise
+        wait_for_task(client, configure_index(index))
+
+        count = Event.objects.count()
+        self.stdout.write(f'Reindexing {count} events into {index.uid}...')
+        events = Event.objects.only(*DOCUMENT_FIELDS).order_by('pk').iterator(chunk_size=options['chunk_size'])
+
+        def progress(sent):
+            self.stdout.write(f'  {sent}/{count}')
+            if options['swap']:
+                indexing.pause(PAUSE_SECONDS)
+
+        started = time.perf_counter()
+        try:
+            sent = bulk_index(index, events, options['batch_size'], options['workers'], on_batch=progress)
+        except Exception as e:
+            raise CommandError(f'Reindexing failed: {e}')
+        return sent, time.perf_counter() - started
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='admission_rate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
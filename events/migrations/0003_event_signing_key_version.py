@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_event_admission_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='signing_key_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
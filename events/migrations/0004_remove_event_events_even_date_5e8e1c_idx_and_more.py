@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_event_signing_key_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='event',
+            name='events_even_date_5e8e1c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['date', 'id'], name='events_even_date_2f23b7_idx'),
+        ),
+    ]
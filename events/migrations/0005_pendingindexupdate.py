@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_remove_event_events_even_date_5e8e1c_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingIndexUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.PositiveIntegerField(unique=True)),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('failed', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['failed', 'next_attempt_at'], name='events_pend_failed_f64b50_idx')],
+            },
+        ),
+    ]
@@ -12,9 +12,14 @@ class Event(models.Model):
     organizer = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='organized_events')
     poster = models.ImageField(upload_to='event_posters/', blank=True, null=True)
     is_published = models.BooleanField(default=False)
+    # Buyers let through the checkout waiting room per second; empty means no waiting room
+    admission_rate = models.PositiveIntegerField(null=True, blank=True)
+    # Version of the key ticket QR payloads are signed with; bumped to rotate it
+    signing_key_version = models.PositiveIntegerField(default=1)
 
     class Meta:
-        indexes = [models.Index(fields=['date'])]
+        # Listings page through events in (date, id) order (core.pagination)
+        indexes = [models.Index(fields=['date', 'id'])]
         permissions = [
             ("can_create_event", "Can create event"),
             ("can_edit_own_event", "Can edit own event"),
@@ -31,4 +36,26 @@ class Event(models.Model):
             return 'Past'
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class PendingIndexUpdate(models.Model):
+    """
+    An event whose search document must be sent to Meilisearch (or removed
+    from it), written in the same transaction as the change. One row per event,
+    so repeated edits before the next flush send one update (events.indexing).
+    """
+    # Not a foreign key: a deleted event's row must outlive it to remove its document
+    event_id = models.PositiveIntegerField(unique=True)
+    queued_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Dead letter: gave up after SEARCH_INDEX_MAX_ATTEMPTS; the next change to the event re-queues it
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        # The flush reads due updates off the front
+        indexes = [models.Index(fields=['failed', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"Index update for event {self.event_id}"
@@ -0,0 +1,16 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets an EventSource (Accept: text/event-stream) through content negotiation.
+    Streams are returned as StreamingHttpResponse; only error responses are rendered here.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f'event: error\ndata: {json.dumps(data)}\n\n'.encode()
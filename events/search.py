@@ -1,8 +1,61 @@
-from typing import List, Optional
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
 from django.conf import settings
 from meilisearch import Client
+from meilisearch.errors import MeilisearchApiError
+from core.cache import cache, invalidate_namespace, namespace_key
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    Stops calling Meilisearch for SEARCH_BREAKER_COOLDOWN_SECONDS after
+    SEARCH_BREAKER_FAILURES failures in a row, so an engine that is down costs
+    requests nothing instead of a timeout each. After the cooldown one call is
+    let through; its outcome closes the breaker or opens it again. Per process.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.failures < settings.SEARCH_BREAKER_FAILURES:
+                return True
+            now = time.monotonic()
+            if now < self.open_until:
+                return False
+            # Half open: this caller tries, everyone else waits out another cooldown
+            self.open_until = now + settings.SEARCH_BREAKER_COOLDOWN_SECONDS
+            return True
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+
+    def failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= settings.SEARCH_BREAKER_FAILURES:
+                self.open_until = time.monotonic() + settings.SEARCH_BREAKER_COOLDOWN_SECONDS
+
+breaker = CircuitBreaker()
+
+INDEX_UID = "events"
+# The columns event_document() reads
+DOCUMENT_FIELDS = ("id", "name", "description", "venue", "date", "organizer_id", "is_published")
 
 _client: Optional[Client] = None
+_index = None
+_index_lock = threading.Lock()
 
 def get_client() -> Optional[Client]:
     global _client
@@ -13,47 +66,131 @@ def get_client() -> Optional[Client]:
     if not url:
         return None
     try:
-        _client = Client(url, api_key)
+        # Bounded, so a hung engine costs a request seconds rather than minutes
+        _client = Client(url, api_key, timeout=settings.SEARCH_TIMEOUT_SECONDS)
         return _client
     except Exception:
         return None
 
 def get_index():
+    """
+    The events index handle. Made once per process: the first call checks
+    that the index exists (creating and configuring it if not), later calls
+    make no request. None when Meilisearch isn't configured, is unreachable,
+    or the circuit breaker is open.
+    """
+    global _index
+    if _index is not None:
+        return _index if breaker.allow() else None
     client = get_client()
-    if not client:
+    if not client or not breaker.allow():
         return None
-    index_uid = "events"
-    try:
-        # Create index if missing
-        client.get_index(index_uid)
-    except Exception:
-        client.create_index(index_uid, {"primaryKey": "id"})
-        # Configure settings
-        client.index(index_uid).update_settings({
-            "searchableAttributes": ["name", "description", "venue"],
-            "filterableAttributes": ["is_published", "organizer_id", "date"],
-            "sortableAttributes": ["date"],
-        })
-    return client.index(index_uid)
+    with _index_lock:
+        if _index is None:
+            try:
+                try:
+                    client.get_index(INDEX_UID)
+                except MeilisearchApiError as e:
+                    if e.code != "index_not_found":
+                        raise
+                    client.create_index(INDEX_UID, {"primaryKey": "id"})
+                    configure_index(client.index(INDEX_UID))
+            except Exception:
+                breaker.failure()
+                logger.warning("Meilisearch is unavailable", exc_info=True)
+                return None
+            _index = client.index(INDEX_UID)
+    return _index
+
+def forget_index(error=None) -> None:
+    """Check the index again on next use, e.g. after it turned out to be missing"""
+    global _index
+    if error is None or getattr(error, "code", None) == "index_not_found":
+        _index = None
+
+def configure_index(index):
+    # Meilisearch compares numbers only, so date windows filter on date_ts (epoch seconds)
+    return index.update_settings({
+        "searchableAttributes": ["name", "description", "venue"],
+        "filterableAttributes": ["is_published", "organizer_id", "date", "date_ts"],
+        "sortableAttributes": ["date", "date_ts"],
+        # How far the event list can page into results
+        "pagination": {"maxTotalHits": settings.SEARCH_MAX_TOTAL_HITS},
+    })
+
+def event_document(event) -> dict:
+    return {
+        "id": event.id,
+        "name": event.name,
+        "description": event.description or "",
+        "venue": event.venue or "",
+        "date": event.date.isoformat(),
+        "date_ts": int(event.date.timestamp()),
+        "organizer_id": event.organizer_id,
+        "is_published": event.is_published,
+    }
 
 def index_event(event) -> bool:
     index = get_index()
     if not index:
         return False
     try:
-        doc = {
-            "id": event.id,
-            "name": event.name,
-            "description": event.description or "",
-            "venue": event.venue or "",
-            "date": event.date.isoformat(),
-            "organizer_id": event.organizer_id,
-            "is_published": event.is_published,
-        }
-        index.add_documents([doc])
-        return True
-    except Exception:
+        index.add_documents([event_document(event)])
+    except Exception as e:
+        breaker.failure()
+        forget_index(e)
         return False
+    breaker.success()
+    index_changed()
+    return True
+
+def wait_for_task(client: Client, task, timeout_ms: int = 300_000):
+    """Wait until Meilisearch has applied an enqueued task; raises if it failed"""
+    result = client.wait_for_task(task.task_uid, timeout_in_ms=timeout_ms, interval_in_ms=100)
+    if result.status != "succeeded":
+        raise RuntimeError(f"Meilisearch task {task.task_uid} {result.status}: {result.error}")
+    return result
+
+def bulk_index(index, events: Iterable, batch_size: int = 5000, workers: int = 4,
+               on_batch: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Send `events` to `index` in batches of `batch_size` documents, with up to
+    `workers` batches in flight, each waited on until Meilisearch has applied
+    it. `events` is read as it goes, so it can be a queryset iterator. Returns
+    the number of documents sent; raises if a batch fails.
+    """
+    client = get_client()
+
+    def send(documents):
+        wait_for_task(client, index.add_documents(documents, primary_key="id"))
+        return len(documents)
+
+    sent = 0
+    in_flight = set()
+
+    def collect(futures):
+        nonlocal sent
+        for future in futures:
+            sent += future.result()
+            if on_batch:
+                on_batch(sent)
+
+    with ThreadPoolExecutor(workers) as pool:
+        batch = []
+        for event in events:
+            batch.append(event_document(event))
+            if len(batch) < batch_size:
+                continue
+            in_flight.add(pool.submit(send, batch))
+            batch = []
+            # Don't read further ahead than the workers can send
+            if len(in_flight) >= workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        if batch:
+            in_flight.add(pool.submit(send, batch))
+        collect(wait(in_flight).done)
+    return sent
 
 def delete_event(event_id: int) -> bool:
     index = get_index()
@@ -61,17 +198,60 @@ def delete_event(event_id: int) -> bool:
         return False
     try:
         index.delete_document(event_id)
-        return True
-    except Exception:
+    except Exception as e:
+        breaker.failure()
+        forget_index(e)
         return False
+    breaker.success()
+    index_changed()
+    return True
+
+def index_changed() -> None:
+    """Drop cached search results, and the listing pages built from them"""
+    invalidate_namespace("search")
+    invalidate_namespace("events")
+
+def search_events(query: str, limit: int = 50, offset: int = 0,
+                  start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[List[int]]:
+    """
+    IDs of published events matching `query`, most relevant first (sooner
+    first among equally relevant), optionally within [start, end]. None when
+    Meilisearch isn't available, so callers can fall back to the database.
+
+    Results are cached for SEARCH_RESULT_CACHE_SECONDS per normalized query
+    and filters, and dropped whenever the index is written to.
+    """
+    filters = ["is_published = true"]
+    if start is not None:
+        # To the minute, so "upcoming" searches share a cache entry; callers re-check the exact window
+        filters.append(f"date_ts >= {int(start.timestamp()) // 60 * 60}")
+    if end is not None:
+        filters.append(f"date_ts <= {int(end.timestamp())}")
+    normalized = " ".join(query.lower().split())
+    key = namespace_key("search", hashlib.sha256(
+        json.dumps([normalized, limit, offset, filters]).encode()
+    ).hexdigest())
+    ids = cache.get(key)
+    if ids is not None:
+        return ids
 
-def search_events(query: str, limit: int = 50) -> List[int]:
     index = get_index()
     if not index:
-        return []
+        return None
     try:
-        results = index.search(query, {"limit": limit, "filter": ["is_published = true"]})
-        hits = results.get("hits", [])
-        return [hit["id"] for hit in hits]
-    except Exception:
-        return []
+        results = index.search(normalized, {
+            "limit": limit,
+            "offset": offset,
+            "filter": filters,
+            "sort": ["date_ts:asc"],
+            "attributesToRetrieve": ["id"],
+        })
+    except Exception as e:
+        breaker.failure()
+        forget_index(e)
+        logger.warning("Search for %r failed: %s", normalized, e)
+        return None
+    breaker.success()
+    ids = [hit["id"] for hit in results.get("hits", [])]
+    cache.set(key, ids, settings.SEARCH_RESULT_CACHE_SECONDS)
+    return ids
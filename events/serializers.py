@@ -10,6 +10,6 @@ class EventSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'description', 'date', 'end_date',
             'venue', 'online_link', 'organizer', 'poster',
-            'is_published', 'status'
+            'is_published', 'status', 'admission_rate', 'signing_key_version'
         ]
-        read_only_fields = ['id', 'organizer', 'status']
+        read_only_fields = ['id', 'organizer', 'status', 'signing_key_version']
@@ -1,34 +1,22 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
+from core.cache import invalidate_namespace
 from .models import Event
-from .search import index_event, delete_event
+from . import indexing
 
 @receiver(post_save, sender=Event)
 def on_event_saved(sender, instance: Event, **kwargs):
-    # 1. Update Search Index (Meilisearch)
-    index_event(instance)
+    # 1. Queue a Search Index update (Meilisearch), sent in the background after commit
+    indexing.queue(instance.pk)
     
     # 2. Invalidate Cache
-    # Always clear homepage featured events
-    cache.delete('home_featured_events')
-    
-    # Clear event list caches (wildcard delete)
-    # Note: delete_pattern is specific to django-redis
-    try:
-        cache.delete_pattern("events_list_*")
-    except AttributeError:
-        # Fallback for other backends (or if not supported)
-        pass
+    # Homepage featured events and every event list page live in the 'events' namespace
+    invalidate_namespace('events')
 
 @receiver(post_delete, sender=Event)
 def on_event_deleted(sender, instance: Event, **kwargs):
-    # 1. Remove from Search Index
-    delete_event(instance.id)
+    # 1. Queue removal from the Search Index
+    indexing.queue(instance.pk)
     
     # 2. Invalidate Cache
-    cache.delete('home_featured_events')
-    try:
-        cache.delete_pattern("events_list_*")
-    except AttributeError:
-        pass
+    invalidate_namespace('events')
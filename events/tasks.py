@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from . import indexing
+
+
+@shared_task
+def flush_search_index():
+    """Send queued search index updates to Meilisearch"""
+    return indexing.flush()
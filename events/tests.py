@@ -1,12 +1,20 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import Event
+from django.core.cache import cache
+from django.conf import settings
+from meilisearch.errors import MeilisearchApiError
+from . import cards, indexing, search
+from .models import Event, PendingIndexUpdate
+from .views import EventListView
 from users.models import CustomUser
-from tickets.models import Ticket
+from tickets.models import Ticket, TicketShard
 from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.management import CommandError, call_command
 
 class EventModelTest(TestCase):
     def setUp(self):
@@ -110,14 +118,32 @@ class EventAPITest(APITestCase):
         # Anonymous user sees only published
         self.client.logout()
         response = self.client.get(self.list_url)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
         
         # Organizer sees both (their own)
         self.client.force_authenticate(user=self.organizer)
         response = self.client.get(self.list_url)
-        # Handle pagination if necessary, usually response.data['results']
-        results = response.data['results'] if 'results' in response.data else response.data
-        self.assertEqual(len(results), 2)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_list_pages_by_date_then_id(self):
+        date = timezone.now() + timedelta(days=3)
+        # Same date: the id breaks the tie, so no event is skipped or repeated across pages
+        events = [Event.objects.create(organizer=self.organizer, is_published=True, name=f"E{i}",
+                                       date=date if i < 3 else date - timedelta(days=1), description="D")
+                  for i in range(5)]
+        self.client.logout()
+        seen = []
+        url = f'{self.list_url}?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [event['id'] for event in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [event.id for event in events[3:] + events[:3]])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(self.list_url, {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class EventListViewTest(TestCase):
@@ -166,6 +192,54 @@ class EventListViewTest(TestCase):
         self.assertNotContains(response, self.past_event.name)
         self.assertNotContains(response, self.unpublished_event.name)
 
+    def test_list_cache_is_dropped_when_an_event_changes(self):
+        url = reverse('events:list')
+        self.assertNotContains(self.client.get(url), 'Late Addition')
+        Event.objects.create(
+            name='Late Addition', date=timezone.now() + timedelta(days=5), organizer=self.user, is_published=True
+        )
+        self.assertContains(self.client.get(url), 'Late Addition')
+
+        self.future_event.delete()
+        self.assertNotContains(self.client.get(url), self.future_event.name)
+
+    @override_settings(EVENT_LIST_PAGE_SIZE=1)
+    def test_list_pages_through_events(self):
+        later = Event.objects.create(
+            name='Later Concert', date=timezone.now() + timedelta(days=20), organizer=self.user, is_published=True
+        )
+        response = self.client.get(reverse('events:list'))
+        self.assertEqual(list(response.context['events']), [self.future_event])
+        response = self.client.get(reverse('events:list') + response.context['next_page_url'])
+        self.assertEqual(list(response.context['events']), [later])
+        self.assertNotIn('next_page_url', response.context)
+
+        self.assertEqual(self.client.get(reverse('events:list'), {'cursor': 'nonsense'}).status_code, 404)
+
+    def test_listings_are_cached_as_cards(self):
+        self.future_event.description = 'word ' * 1000
+        self.future_event.save()
+        response = self.client.get(reverse('events:list'))
+        self.assertContains(response, self.future_event.name)
+        self.assertNotContains(response, 'word ' * 100)
+
+        entry = cache.get('events:fill:' + EventListView.cache_key('', '', ''))
+        packed, next_cursor = entry.value
+        self.assertIsNone(next_cursor)
+        self.assertIsInstance(packed, bytes)
+        self.assertLess(len(packed), 1024)
+        event, = cards.unpack(packed)
+        self.assertEqual(event, self.future_event)
+        self.assertEqual(event.get_deferred_fields(), {'end_date', 'organizer_id', 'is_published',
+                                                       'admission_rate', 'signing_key_version'})
+
+    def test_listing_cache_key_holds_any_search(self):
+        q = 'café night ' * 40
+        self.assertContains(self.client.get(reverse('events:list'), {'q': q}), 'No upcoming events')
+        key = EventListView.cache_key(q.strip(), '', '')
+        self.assertRegex(key, r'^list:[0-9a-f]{64}$')
+        self.assertIsNotNone(cache.get('events:fill:' + key))
+
     def test_search_filter_name(self):
         url = reverse('events:list')
         response = self.client.get(url, {'q': 'Future'})
@@ -181,6 +255,61 @@ class EventListViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, self.future_event.name)
 
+    @override_settings(EVENT_LIST_PAGE_SIZE=1)
+    def test_search_pages_come_from_the_engine_in_its_order(self):
+        later = Event.objects.create(
+            name='Later Concert', date=timezone.now() + timedelta(days=20), organizer=self.user, is_published=True
+        )
+        url = reverse('events:list')
+        with mock.patch('events.views.search_events', return_value=[later.id, self.future_event.id]) as search:
+            response = self.client.get(url, {'q': 'concert'})
+        self.assertEqual(list(response.context['events']), [later])
+        _, kwargs = search.call_args
+        self.assertEqual((kwargs['limit'], kwargs['offset']), (2, 0))
+        self.assertIsNone(kwargs['end'])
+
+        with mock.patch('events.views.search_events', return_value=[self.future_event.id, self.unpublished_event.id]) as search:
+            response = self.client.get(url + response.context['next_page_url'])
+        self.assertEqual(search.call_args[1]['offset'], 1)
+        # Hits the index has but the database no longer shows are dropped
+        self.assertEqual(list(response.context['events']), [self.future_event])
+
+    @override_settings(EVENT_LIST_PAGE_SIZE=1)
+    def test_search_cursor_survives_a_switch_of_backend(self):
+        later = Event.objects.create(
+            name='Later Future', date=timezone.now() + timedelta(days=20), organizer=self.user, is_published=True
+        )
+        url = reverse('events:list')
+        with mock.patch('events.views.search_events', return_value=[later.id, self.future_event.id]):
+            next_page = self.client.get(url, {'q': 'future'}).context['next_page_url']
+        # Meilisearch went down: the database starts over at its first page
+        with mock.patch('events.views.search_events', return_value=None):
+            response = self.client.get(url + next_page)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['events']), [self.future_event])
+
+        # And back: a database cursor restarts the search
+        with mock.patch('events.views.search_events', return_value=[later.id]) as search:
+            response = self.client.get(url + response.context['next_page_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(search.call_args[1]['offset'], 0)
+        self.assertEqual(list(response.context['events']), [later])
+
+    @override_settings(EVENT_LIST_PAGE_SIZE=1, SEARCH_MAX_TOTAL_HITS=1)
+    def test_search_stops_paging_at_max_total_hits(self):
+        later = Event.objects.create(
+            name='Later Concert', date=timezone.now() + timedelta(days=20), organizer=self.user, is_published=True
+        )
+        with mock.patch('events.views.search_events', return_value=[later.id, self.future_event.id]):
+            response = self.client.get(reverse('events:list'), {'q': 'concert'})
+        self.assertEqual(list(response.context['events']), [later])
+        self.assertNotIn('next_page_url', response.context)
+
+    def test_search_with_no_hits_shows_nothing(self):
+        with mock.patch('events.views.search_events', return_value=[]):
+            response = self.client.get(reverse('events:list'), {'q': 'Future'})
+        self.assertNotContains(response, self.future_event.name)
+
 
     def test_date_filters(self):
         url = reverse('events:list')
@@ -214,6 +343,193 @@ class EventListViewTest(TestCase):
         self.assertNotContains(response, next_month_event.name)
 
 
+def fake_meilisearch(test):
+    """Patch in a mocked Meilisearch client, with a fresh index handle and circuit breaker"""
+    meili = mock.Mock()
+    meili.wait_for_task.return_value = mock.Mock(status='succeeded')
+    for patcher in (mock.patch.object(search, '_client', meili), mock.patch.object(search, '_index', None),
+                    mock.patch.object(search, 'breaker', search.CircuitBreaker())):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return meili
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.meili = fake_meilisearch(self)
+        self.index = self.meili.index.return_value
+        self.index.search.return_value = {'hits': [{'id': 3}, {'id': 1}]}
+        cache.clear()
+
+    def test_date_window_and_paging_are_sent_to_the_engine(self):
+        start = timezone.now()
+        ids = search.search_events('Jazz  Night', limit=5, offset=10, start=start, end=start + timedelta(days=1))
+        self.assertEqual(ids, [3, 1])
+        query, params = self.index.search.call_args[0]
+        self.assertEqual(query, 'jazz night')
+        self.assertEqual((params['limit'], params['offset']), (5, 10))
+        self.assertEqual(params['filter'], [
+            'is_published = true',
+            f'date_ts >= {int(start.timestamp()) // 60 * 60}',
+            f'date_ts <= {int(start.timestamp()) + 86400}',
+        ])
+
+    def test_index_is_checked_once_per_process(self):
+        search.search_events('jazz')
+        search.search_events('rock')
+        self.meili.get_index.assert_called_once_with('events')
+        self.meili.create_index.assert_not_called()
+
+    def test_missing_index_is_created(self):
+        self.meili.get_index.side_effect = MeilisearchApiError('Index not found', mock.Mock(
+            status_code=404, text='{"code": "index_not_found", "message": "Index not found"}'
+        ))
+        self.assertEqual(search.search_events('jazz'), [3, 1])
+        self.meili.create_index.assert_called_once_with('events', {'primaryKey': 'id'})
+        self.index.update_settings.assert_called_once()
+
+    def test_results_are_cached_until_the_index_changes(self):
+        self.assertEqual(search.search_events('jazz'), [3, 1])
+        self.assertEqual(search.search_events(' JAZZ '), [3, 1])
+        self.assertEqual(self.index.search.call_count, 1)
+
+        search.index_changed()
+        search.search_events('jazz')
+        self.assertEqual(self.index.search.call_count, 2)
+
+    def test_unavailable_engine_is_none(self):
+        with mock.patch.object(search, '_client', None), mock.patch.object(search, 'get_client', return_value=None):
+            self.assertIsNone(search.search_events('jazz'))
+        self.index.search.side_effect = ConnectionError
+        self.assertIsNone(search.search_events('jazz'))
+
+    @override_settings(SEARCH_BREAKER_FAILURES=2)
+    def test_breaker_skips_the_engine_after_failures(self):
+        self.index.search.side_effect = ConnectionError
+        for query in ('a', 'b', 'c', 'd'):
+            self.assertIsNone(search.search_events(query))
+        self.assertEqual(self.index.search.call_count, 2)
+
+        # After the cooldown one request tries again, and its success closes the breaker
+        search.breaker.open_until = 0
+        self.index.search.side_effect = None
+        self.assertEqual(search.search_events('e'), [3, 1])
+        self.assertEqual(search.search_events('f'), [3, 1])
+        self.assertEqual(self.index.search.call_count, 4)
+
+
+class ReindexTest(TestCase):
+    def setUp(self):
+        organizer = CustomUser.objects.create_user(username='org_reindex', password='password', role='organizer')
+        self.events = Event.objects.bulk_create([
+            Event(name=f'Event {i}', date=timezone.now() + timedelta(days=i), organizer=organizer) for i in range(7)
+        ])
+        self.meili = fake_meilisearch(self)
+
+    def reindex(self, **options):
+        out = StringIO()
+        call_command('reindex_events', batch_size=3, workers=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_sends_events_in_batches(self):
+        output = self.reindex()
+        batches = [call[0][0] for call in self.meili.index.return_value.add_documents.call_args_list]
+        self.assertEqual(sorted(len(batch) for batch in batches), [1, 3, 3])
+        self.assertEqual(sorted(doc['id'] for batch in batches for doc in batch), sorted(e.id for e in self.events))
+        self.assertIn('date_ts', batches[0][0])
+        self.assertIn('7 events', output)
+        self.assertIn('docs/sec', output)
+        self.meili.swap_indexes.assert_not_called()
+
+    def test_swap_builds_a_fresh_index(self):
+        self.reindex(swap=True)
+        self.meili.create_index.assert_called_with('events_reindex', {'primaryKey': 'id'})
+        self.meili.swap_indexes.assert_called_once_with([{'indexes': ['events', 'events_reindex']}])
+        self.assertEqual(self.meili.delete_index.call_args[0][0], 'events_reindex')
+
+    def test_updates_queued_during_a_swap_are_sent_after_it(self):
+        PendingIndexUpdate.objects.create(event_id=self.events[0].id)
+        add_documents = self.meili.index.return_value.add_documents
+        paused_while_building = []
+
+        def add(*args, **kwargs):
+            paused_while_building.append(indexing.paused())
+            return mock.Mock()
+        add_documents.side_effect = add
+
+        output = self.reindex(swap=True)
+        self.assertEqual(paused_while_building[:3], [True] * 3)
+        self.assertFalse(indexing.paused())
+        # The queued update went out after the swap, not into the index the swap dropped
+        self.assertEqual([doc['id'] for doc in add_documents.call_args[0][0]], [self.events[0].id])
+        self.assertFalse(PendingIndexUpdate.objects.exists())
+        self.assertIn('Sent 1 updates queued during the build', output)
+
+    def test_failed_batch_fails_the_command(self):
+        failed = mock.Mock(status='failed', error={'code': 'invalid_document_id'})
+        # The settings update goes through; the document batches don't
+        self.meili.wait_for_task.side_effect = [mock.Mock(status='succeeded')] + [failed] * 3
+        with self.assertRaises(CommandError):
+            self.reindex()
+
+
+class IndexingTest(TestCase):
+    def setUp(self):
+        self.organizer = CustomUser.objects.create_user(username='org_index', password='password', role='organizer')
+        self.meili = fake_meilisearch(self)
+        self.index = self.meili.index.return_value
+        patcher = mock.patch('events.tasks.flush_search_index.apply_async')
+        self.scheduled = patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.delete(indexing.SCHEDULED_KEY)
+
+    def test_saves_queue_one_coalesced_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            event = Event.objects.create(organizer=self.organizer, name='Draft', date=timezone.now(), description='D')
+        with self.captureOnCommitCallbacks(execute=True):
+            event.name = 'Final'
+            event.save()
+        self.index.add_documents.assert_not_called()
+        self.assertEqual(PendingIndexUpdate.objects.get().event_id, event.id)
+        self.scheduled.assert_called_once_with(countdown=settings.SEARCH_INDEX_COALESCE_SECONDS, retry=False)
+
+        self.assertEqual(indexing.flush(), 1)
+        (documents,), _ = self.index.add_documents.call_args
+        self.assertEqual([document['name'] for document in documents], ['Final'])
+        self.assertFalse(PendingIndexUpdate.objects.exists())
+
+    def test_deleted_events_are_removed(self):
+        event = Event.objects.create(organizer=self.organizer, name='Gone', date=timezone.now(), description='D')
+        event_id = event.id
+        event.delete()
+        indexing.flush()
+        self.index.delete_documents.assert_called_once_with([event_id])
+        self.index.add_documents.assert_not_called()
+
+    @override_settings(SEARCH_INDEX_MAX_ATTEMPTS=2)
+    def test_failures_are_retried_then_dead_lettered(self):
+        event = Event.objects.create(organizer=self.organizer, name='Flaky', date=timezone.now(), description='D')
+        self.index.add_documents.side_effect = ConnectionError('down')
+        indexing.flush()
+        update = PendingIndexUpdate.objects.get()
+        self.assertEqual((update.attempts, update.failed), (1, False))
+        self.assertGreater(update.next_attempt_at, timezone.now())
+
+        # Not due yet
+        indexing.flush()
+        self.assertEqual(self.index.add_documents.call_count, 1)
+
+        PendingIndexUpdate.objects.update(next_attempt_at=timezone.now())
+        indexing.flush()
+        update.refresh_from_db()
+        self.assertEqual((update.attempts, update.failed, update.last_error), (2, True, 'down'))
+
+        # Editing the event again gives it a fresh start
+        event.save()
+        update.refresh_from_db()
+        self.assertEqual((update.attempts, update.failed), (0, False))
+
+
 class EventDetailViewTest(TestCase):
     def setUp(self):
         self.user = CustomUser.objects.create_user(
@@ -280,3 +596,13 @@ class HomeViewTest(TestCase):
         # Check ordering (popular first)
         self.assertEqual(events[0], self.popular_event)
         self.assertEqual(events[1], self.less_popular_event)
+
+    def test_sharded_sales_count_towards_popularity(self):
+        ticket = Ticket.objects.create(
+            event=self.less_popular_event, type='vip', price=10, quantity_available=100, shard_count=2,
+        )
+        TicketShard.objects.create(ticket=ticket, index=0, capacity=50, quantity_sold=30)
+        TicketShard.objects.create(ticket=ticket, index=1, capacity=50, quantity_sold=30)
+
+        events = self.client.get(reverse('home')).context['events']
+        self.assertEqual(events[0], self.less_popular_event)
@@ -1,23 +1,35 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from datetime import timedelta
 from django.views.generic import ListView, TemplateView
-from django.db.models import Q, Sum, F
+from django.db.models import Q, Sum, F, OuterRef, DecimalField
+from django.db.models.functions import Coalesce
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.cache import cache  # Import cache
+from core import streams
+from core.cache import fill
+from core.pagination import decode_cursor, encode_cursor, paginate
+from . import cards
+import base64
 import csv
+import hashlib
+import json
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.renderers import JSONRenderer
 
 from .models import Event
 from .serializers import EventSerializer
 from .forms import EventForm
+from .renderers import EventStreamRenderer
 from users.permissions import IsOrganizerOrReadOnly
 from .search import search_events
+from tickets.models import shard_sales
+from tickets import checkins, manifests, redemption, redemption_store, signing
 
 
 # ==========================
@@ -26,6 +38,7 @@ from .search import search_events
 class EventViewSet(viewsets.ModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
+    keyset_ordering = ('date', 'id')
 
     # Public read, organizer-only write
     permission_classes = [
@@ -65,6 +78,114 @@ class EventViewSet(viewsets.ModelViewSet):
         event.save()
         return Response({'status': 'unpublished', 'is_published': False})
 
+    @action(detail=True, methods=['get'], permission_classes=[IsOrganizerOrReadOnly])
+    def scanner_key(self, request, pk=None):
+        """The current ticket signing key, for provisioning offline scanners"""
+        event = self.get_object()
+        if event.organizer != request.user:
+             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+
+        key = signing.event_key(event.pk, event.signing_key_version)
+        return Response({
+            'event_id': event.pk,
+            'key_version': event.signing_key_version,
+            'key': base64.urlsafe_b64encode(key).decode(),
+            'format': signing.FORMAT_VERSION,
+            'algorithm': 'HMAC-SHA256/96',
+        })
+
+    @action(detail=True, methods=['post'], permission_classes=[IsOrganizerOrReadOnly])
+    def rotate_signing_key(self, request, pk=None):
+        """Sign tickets with a new key; QR codes issued under the old one stop verifying"""
+        event = self.get_object()
+        if event.organizer != request.user:
+             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+
+        return Response({'key_version': signing.rotate_key(event)})
+
+    @action(detail=True, methods=['get'], permission_classes=[IsOrganizerOrReadOnly], throttle_classes=[])
+    def scanner_manifest(self, request, pk=None):
+        """
+        Binary manifest of the event's tickets for offline scanners (see tickets.manifests).
+        Pass ?since=<X-Manifest-Version of the last download> to get only what changed.
+        """
+        event = self.get_object()
+        if event.organizer != request.user:
+             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+
+        since = request.query_params.get('since')
+        if since is not None and not since.isdigit():
+            return Response({'error': 'since must be a manifest version'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data, version = manifests.build(event.pk, int(since) if since else None)
+        response = HttpResponse(data, content_type='application/octet-stream')
+        response['X-Manifest-Version'] = str(version)
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    @action(detail=True, methods=['post'], permission_classes=[IsOrganizerOrReadOnly], throttle_classes=[])
+    def scanner_redemptions(self, request, pk=None):
+        """
+        Upload redemptions logged offline:
+        {"redemptions": [{"ticket_id": "...", "scanned_at": <epoch ms>, "device": "gate-3"}, ...]}
+        """
+        event = self.get_object()
+        if event.organizer != request.user:
+             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+
+        entries = request.data.get('redemptions')
+        if not isinstance(entries, list):
+            return Response({'error': 'redemptions must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(entries) > settings.SCANNER_UPLOAD_MAX:
+            return Response({'error': f'At most {settings.SCANNER_UPLOAD_MAX} redemptions per upload'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results, conflicts = redemption.apply_offline(event.pk, entries)
+        return Response({
+            'applied': sum(result['status'] == 'applied' for result in results),
+            'results': results,
+            'conflicts': conflicts,
+        })
+
+    def checkin_event_id(self, request, pk):
+        """
+        The event id if the user organizes it. Uses the cached organizer rather
+        than get_object, so dashboards polling check-ins stay off the database.
+        """
+        organizer_id = redemption_store.organizer_id(int(pk)) if str(pk).isdigit() else None
+        if organizer_id is None:
+            raise Http404
+        return int(pk) if organizer_id == request.user.pk else None
+
+    @action(detail=True, methods=['get'], permission_classes=[IsOrganizerOrReadOnly], throttle_classes=[])
+    def checkins(self, request, pk=None):
+        """Live check-in counts, total and per ticket type"""
+        event_id = self.checkin_event_id(request, pk)
+        if event_id is None:
+             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(checkins.snapshot(event_id), headers={'Cache-Control': 'no-store'})
+
+    @action(detail=True, methods=['get'], url_path='checkins/stream', permission_classes=[IsOrganizerOrReadOnly],
+            throttle_classes=[], renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def checkins_stream(self, request, pk=None):
+        """
+        Server-sent events: a snapshot of the check-in counts, then a delta whenever they change.
+        Each connection polls the cache and holds no database connection. Beyond
+        CHECKIN_MAX_STREAMS open streams, dashboards get a snapshot per reconnect instead.
+        """
+        event_id = self.checkin_event_id(request, pk)
+        if event_id is None:
+             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+        stream = streams.bounded(
+            'checkins', settings.CHECKIN_MAX_STREAMS, settings.CHECKIN_STREAM_MAX_SECONDS,
+            lambda: checkins.stream(event_id), lambda: checkins.stream(event_id, duration=0),
+        )
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Don't let nginx buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 
 # ==========================
 # TEMPLATE-BASED VIEWS
@@ -75,25 +196,23 @@ class HomeView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Try to get from cache
-        featured_events = cache.get('home_featured_events')
-        
-        if featured_events is None:
-            now = timezone.now()
-            # Featured events: Published, Upcoming, ordered by popularity (ticket sales)
-            featured_events = list(Event.objects.filter(
-                is_published=True,
-                date__gte=now
-            ).annotate(
-                total_sales=Sum('tickets__quantity_sold')
-            ).order_by('-total_sales', 'date')[:6])
-            
-            # Cache for 15 minutes
-            cache.set('home_featured_events', featured_events, 60 * 15)
-            
+        # Cached for 15 minutes; one request recomputes it while the rest are served the last result
+        featured_events = cards.unpack(fill(
+            'events', 'home_featured', lambda: cards.pack(self.featured_events()), 60 * 15, metric='home_featured',
+        ))
         context['events'] = featured_events
         return context
 
+    def featured_events(self):
+        now = timezone.now()
+        # Featured events: Published, Upcoming, ordered by popularity (ticket sales, sharded ones included)
+        return Event.objects.filter(
+            is_published=True,
+            date__gte=now
+        ).annotate(
+            total_sales=Coalesce(Sum('tickets__quantity_sold'), 0) + shard_sales(ticket__event=OuterRef('pk'))
+        ).order_by('-total_sales', 'date').only(*cards.FIELDS)[:6]
+
 
 class EventListView(ListView):
     model = Event
@@ -105,34 +224,87 @@ class EventListView(ListView):
         # Generate cache key based on GET parameters
         q = self.request.GET.get('q', '').strip().lower()
         date_filter = self.request.GET.get('date', '').strip().lower()
+        cursor = self.request.GET.get('cursor', '').strip()
         
-        # Unique cache key for these filters
-        cache_key = f'events_list_q_{q}_date_{date_filter}'
-        
-        # Try fetching from cache
-        cached_results = cache.get(cache_key)
-        if cached_results is not None:
-            return cached_results
+        # Cached per filter and page for 5 mins and dropped whenever an event changes; stampede-protected
+        packed, self.next_cursor = fill(
+            'events', self.cache_key(q, date_filter, cursor),
+            lambda: self.page(q, date_filter, cursor), 60 * 5, metric='event_list',
+        )
+        return cards.unpack(packed)
 
-        queryset = super().get_queryset()
-        
-        # Base filter: only published events
-        queryset = queryset.filter(is_published=True)
-        
+    @staticmethod
+    def cache_key(q, date_filter, cursor):
+        # Hashed: the parameters are free text of any length, which a cache key can't hold
+        return 'list:' + hashlib.sha256(json.dumps([q, date_filter, cursor]).encode()).hexdigest()
+
+    def page(self, q, date_filter, cursor):
+        """
+        One page of cards, and the cursor of the next. Cursors are tagged with
+        the backend that made them ('search.' or 'db.'); when the other one
+        serves the next page (Meilisearch went down or came back), it starts
+        over at the first page.
+        """
+        start, end = self.date_window(date_filter)
+        source, _, position = cursor.partition('.')
+        if cursor and source not in ('search', 'db'):
+            raise Http404('Invalid cursor')
+        try:
+            # Searches are filtered, ranked and paged by Meilisearch; the database is the fallback
+            found = self.search_page(q, start, end, position if source == 'search' else None) if q else None
+            if found is None:
+                events, next_cursor = paginate(self.filtered_events(q, start, end), ('date', 'id'),
+                                               position if source == 'db' else None, settings.EVENT_LIST_PAGE_SIZE)
+                found = events, next_cursor and f'db.{next_cursor}'
+        except ValueError:
+            raise Http404('Invalid cursor')
+        events, next_cursor = found
+        return cards.pack(events), next_cursor
+
+    def search_page(self, q, start, end, cursor):
+        """
+        One page of search hits in relevance order, read from the database in a
+        single query. The cursor is the offset in the results; there is none
+        past SEARCH_MAX_TOTAL_HITS, which Meilisearch won't page beyond. None
+        when Meilisearch isn't available.
+        """
+        offset, = decode_cursor(cursor, ('offset',)) if cursor else (0,)
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError('Invalid cursor')
+        page_size = settings.EVENT_LIST_PAGE_SIZE
+        ids = search_events(q, limit=page_size + 1, offset=offset, start=start, end=end)
+        if ids is None:
+            return None
+        more = len(ids) > page_size and offset + page_size < settings.SEARCH_MAX_TOTAL_HITS
+        next_cursor = 'search.' + encode_cursor([offset + page_size]) if more else None
+        # Re-checked here too, in case the index lags behind an edit
+        found = self.window(Event.objects.filter(id__in=ids[:page_size], is_published=True), start, end)
+        by_id = {event.id: event for event in found.only(*cards.FIELDS)}
+        return [by_id[event_id] for event_id in ids[:page_size] if event_id in by_id], next_cursor
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.next_cursor:
+            params = self.request.GET.copy()
+            params['cursor'] = self.next_cursor
+            context['next_page_url'] = f'?{params.urlencode()}'
+        return context
+
+    def date_window(self, date_filter):
+        """The (start, end) of the dates shown; end is None when open-ended"""
         # Date logic: Show upcoming events by default (or filter by date if provided)
         # Using timezone.now() to filter out past events
         now = timezone.now()
-        queryset = queryset.filter(date__gte=now)
 
         # Advanced Date Filtering
         if date_filter == 'today':
             end_of_day = now.replace(hour=23, minute=59, second=59)
-            queryset = queryset.filter(date__lte=end_of_day)
+            return now, end_of_day
         elif date_filter == 'this-week':
             # End of week (Sunday)
             end_of_week = now + timedelta(days=(6 - now.weekday()))
             end_of_week = end_of_week.replace(hour=23, minute=59, second=59)
-            queryset = queryset.filter(date__lte=end_of_week)
+            return now, end_of_week
         elif date_filter == 'this-month':
             # End of month logic could be complex, simple approximation or use calendar
             # Simplified: next 30 days or strictly this month? 
@@ -140,7 +312,7 @@ class EventListView(ListView):
             import calendar
             last_day = calendar.monthrange(now.year, now.month)[1]
             end_of_month = now.replace(day=last_day, hour=23, minute=59, second=59)
-            queryset = queryset.filter(date__lte=end_of_month)
+            return now, end_of_month
         elif date_filter == 'weekend':
             # Next Friday/Saturday/Sunday
             # If today is Friday, it includes today.
@@ -156,29 +328,38 @@ class EventListView(ListView):
             if now > start_weekend:
                 start_weekend = now
             
-            queryset = queryset.filter(date__range=[start_weekend, end_weekend])
+            return start_weekend, end_weekend
+        return now, None
+
+    def window(self, queryset, start, end):
+        queryset = queryset.filter(date__gte=start)
+        if end is not None:
+            queryset = queryset.filter(date__lte=end)
+        return queryset
 
-        # Search query (q)
+    def filtered_events(self, q, start, end):
+        queryset = super().get_queryset()
+        
+        # Base filter: only published events
+        queryset = self.window(queryset.filter(is_published=True), start, end)
+
+        # Search query (q), when Meilisearch isn't available
         if q:
-            # Try Meilisearch first
-            ms_ids = search_events(q)
-            if ms_ids:
-                queryset = queryset.filter(id__in=ms_ids)
-            else:
-                # Fallback to DB search
-                queryset = queryset.filter(
-                    Q(name__icontains=q) | 
-                    Q(venue__icontains=q)
-                )
-            
-        # Evaluate and cache
-        results = list(queryset)
-        cache.set(cache_key, results, 60 * 5) # Cache for 5 mins
-        return results
+            queryset = queryset.filter(
+                Q(name__icontains=q) | 
+                Q(venue__icontains=q)
+            )
+
+        # Only what the cards show
+        return queryset.only(*cards.FIELDS)
 
 
 def event_detail(request, event_id):
-    event = get_object_or_404(Event, id=event_id, is_published=True)
+    # The event row is a hot key while it's on sale; it is dropped from the cache whenever an event changes
+    event = fill('events', f'detail:{event_id}',
+                 lambda: Event.objects.filter(id=event_id, is_published=True).first(), 60 * 5, metric='event_detail')
+    if event is None:
+        raise Http404
     return render(request, 'events/event_detail.html', {'event': event})
 
 
@@ -227,9 +408,13 @@ def dashboard(request):
     if request.user.role != 'organizer':
         return render(request, 'events/unauthorized.html', status=403)
 
+    # Sharded ticket types keep part of their sales on TicketShard rows
+    revenue_field = DecimalField(max_digits=12, decimal_places=2)
     events = Event.objects.filter(organizer=request.user).annotate(
-        total_tickets_sold=Sum('tickets__quantity_sold'),
-        revenue=Sum(F('tickets__quantity_sold') * F('tickets__price'))
+        total_tickets_sold=Sum('tickets__quantity_sold') + shard_sales(ticket__event=OuterRef('pk')),
+        revenue=Sum(F('tickets__quantity_sold') * F('tickets__price'), output_field=revenue_field) + shard_sales(
+            F('quantity_sold') * F('ticket__price'), output_field=revenue_field, ticket__event=OuterRef('pk'),
+        ),
     ).order_by('-date')
 
     # Calculate aggregate stats
@@ -0,0 +1,124 @@
+"""
+Virtual waiting room for events with an admission_rate.
+
+Buyers join a per-event FIFO queue and get a signed queue token carrying their
+position. Once per second the first poller moves the `admitted` watermark
+forward by admission_rate (never past the end of the queue, so an idle queue
+doesn't bank credit for a later spike). Buyers at or below the watermark are
+handed a short-lived signed admission token, which the checkout endpoints
+require for that event.
+
+Everything lives in the cache and in signed tokens; only checkout touches the database.
+"""
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from events.models import Event
+from tickets.models import Ticket
+
+QUEUE_SALT = 'orders.admission.queue'
+ADMISSION_SALT = 'orders.admission.token'
+ADMISSION_HEADER = 'HTTP_X_ADMISSION_TOKEN'
+
+
+def _key(event_id, name):
+    return f'waiting_room_{event_id}_{name}'
+
+
+def get_admission_rate(event_id):
+    """Buyers admitted per second, or None when the event has no waiting room"""
+    key = _key(event_id, 'rate')
+    rate = cache.get(key)
+    if rate is None:
+        rate = Event.objects.filter(id=event_id).values_list('admission_rate', flat=True).first() or 0
+        cache.set(key, rate, settings.WAITING_ROOM_CONFIG_CACHE_SECONDS)
+    return rate or None
+
+
+def events_for_tickets(ticket_ids):
+    """Event ids for a set of tickets; a ticket never moves between events, so this is cached indefinitely"""
+    keys = {f'ticket_event_{ticket_id}': ticket_id for ticket_id in ticket_ids}
+    found = cache.get_many(keys.keys())
+    missing = [ticket_id for key, ticket_id in keys.items() if key not in found]
+    if missing:
+        fetched = dict(Ticket.objects.filter(id__in=missing).values_list('id', 'event_id'))
+        cache.set_many({f'ticket_event_{ticket_id}': event_id for ticket_id, event_id in fetched.items()}, None)
+        found.update({f'ticket_event_{ticket_id}': event_id for ticket_id, event_id in fetched.items()})
+    return set(found.values())
+
+
+def join(event_id, user_id):
+    """Take the next place in the queue. Returns the signed queue token."""
+    head = _key(event_id, 'head')
+    cache.add(head, 0, None)
+    position = cache.incr(head)
+    return signing.dumps({'e': event_id, 'u': user_id, 'p': position}, salt=QUEUE_SALT)
+
+
+def read_queue_token(token, event_id, user_id):
+    """Position encoded in a queue token, or None if it isn't this user's token for this event"""
+    try:
+        data = signing.loads(token, salt=QUEUE_SALT)
+    except signing.BadSignature:
+        return None
+    if data.get('e') != event_id or data.get('u') != user_id:
+        return None
+    return data['p']
+
+
+def advance(event_id, rate):
+    """Let the next `rate` buyers in, at most once per wall-clock second. Returns the watermark."""
+    admitted = _key(event_id, 'admitted')
+    cache.add(admitted, 0, None)
+    if cache.add(_key(event_id, f'tick_{int(time.time())}'), 1, 5):
+        watermark = cache.incr(admitted, rate)
+        head = cache.get(_key(event_id, 'head'), 0)
+        if watermark > head:
+            # Don't bank admissions nobody is waiting for
+            cache.set(admitted, head, None)
+            watermark = head
+        return watermark
+    return cache.get(admitted, 0)
+
+
+def queue_status(event_id, user_id, position):
+    rate = get_admission_rate(event_id)
+    watermark = advance(event_id, rate) if rate else position
+    result = {
+        'position': position,
+        'ahead': max(position - watermark - 1, 0),
+        'admitted': position <= watermark,
+    }
+    if result['admitted']:
+        result['admission_token'] = signing.dumps({'e': event_id, 'u': user_id}, salt=ADMISSION_SALT)
+    elif rate:
+        result['estimated_wait'] = (position - watermark) / rate
+    return result
+
+
+def is_admitted(token, event_id, user_id):
+    try:
+        data = signing.loads(token, salt=ADMISSION_SALT, max_age=settings.WAITING_ROOM_ADMISSION_SECONDS)
+    except signing.BadSignature:
+        return False
+    return data.get('e') == event_id and data.get('u') == user_id
+
+
+def check_admission(request, event_ids):
+    """
+    None if the user may check out for these events, otherwise a 403 Response.
+    Events without a waiting room never need a token.
+    """
+    token = request.META.get(ADMISSION_HEADER, '')
+    for event_id in event_ids:
+        if get_admission_rate(event_id) and not is_admitted(token, event_id, request.user.id):
+            return Response(
+                {'error': 'Admission token required', 'event': event_id, 'queue': f'/orders/queue/{event_id}/'},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+    return None
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class OrdesConfig(AppConfig):
     name = 'orders'
+
+    def ready(self):
+        import orders.signals
@@ -0,0 +1,219 @@
+"""
+Helpers for measuring the purchase path under concurrency.
+Used by the bench_checkout, bench_issuance and loadtest_checkout commands and the concurrency tests.
+"""
+import math
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework import serializers
+
+from .fulfillment import issue_tickets_bulk
+from .inventory import enable_sharding, reserve_order
+from .models import Order, OrderItem
+from events.models import Event
+from tickets import qr
+from tickets.models import IssuedTicket, Ticket
+from users.models import CustomUser
+
+
+def legacy_reserve(items_data, **order_fields):
+    """The select_for_update() loop OrderSerializer.create used before reserve_order, kept for comparison"""
+    order = Order.objects.create(total_amount=0, status='pending', **order_fields)
+    total_amount = 0
+    for item in items_data:
+        ticket = Ticket.objects.select_for_update().get(id=item['ticket_id'])
+        if ticket.is_sold_out or (ticket.quantity_sold + item['quantity'] > ticket.quantity_available):
+            raise serializers.ValidationError("Not enough tickets available")
+        OrderItem.objects.create(order=order, ticket=ticket, quantity=item['quantity'], price_at_purchase=ticket.price)
+        ticket.quantity_sold += item['quantity']
+        ticket.save()
+        total_amount += ticket.price * item['quantity']
+    order.total_amount = total_amount
+    order.save()
+    return order
+
+
+STRATEGIES = {
+    'legacy': legacy_reserve,
+    'guarded': reserve_order,
+}
+
+
+def legacy_issue(orders):
+    """The per-seat create + stored QR PNG loop fulfill_order used before bulk issuance, kept for comparison"""
+    for order in orders:
+        for item in order.orderitem_set.all():
+            for _ in range(item.quantity):
+                issued_ticket = IssuedTicket.objects.create(ticket=item.ticket, order=order)
+                issued_ticket.qr_code.save(f"{issued_ticket.id}.png", ContentFile(qr.render_png(str(issued_ticket.id))))
+                issued_ticket.save()
+
+
+ISSUERS = {
+    'legacy': legacy_issue,
+    'bulk': issue_tickets_bulk,
+}
+
+
+def seed_catalog(events, stock, buyers, types=('general',), label='loadtest'):
+    """Create `events` published events with one ticket per type, plus `buyers` attendees"""
+    run_id = uuid.uuid4().hex[:8]
+    organizer = CustomUser.objects.create_user(username=f'{label}_org_{run_id}', role='organizer')
+    event_rows = Event.objects.bulk_create([
+        Event(
+            name=f'{label} event {run_id} #{i}',
+            description='Load test event',
+            date=timezone.now() + timedelta(days=30),
+            organizer=organizer,
+            is_published=True,
+        )
+        for i in range(events)
+    ])
+    tickets = Ticket.objects.bulk_create([
+        Ticket(event=event, type=ticket_type, price=10, quantity_available=stock)
+        for event in event_rows
+        for ticket_type in types
+    ])
+    attendees = CustomUser.objects.bulk_create([
+        CustomUser(username=f'{label}_buyer_{run_id}_{i}', role='attendee', email=f'buyer{i}@loadtest.local')
+        for i in range(buyers)
+    ])
+    return organizer, tickets, attendees
+
+
+class LockTimer:
+    """
+    Execute wrapper that times statements which take or wait on ticket row locks
+    (guarded UPDATEs and SELECT ... FOR UPDATE). Their duration bounds the lock wait.
+    """
+
+    def __init__(self):
+        self.durations = []
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        locking = 'FOR UPDATE' in sql or (sql.startswith('UPDATE') and 'tickets_ticket' in sql)
+        if not locking:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.durations.append(time.perf_counter() - started)
+
+
+def latency_summary(latencies, elapsed):
+    return {
+        'count': len(latencies),
+        'per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def seed_ticket(stock, buyers, label='bench', shards=0):
+    """Create an event with one ticket type of `stock` seats and `buyers` attendee accounts"""
+    run_id = uuid.uuid4().hex[:8]
+    organizer = CustomUser.objects.create_user(username=f'{label}_org_{run_id}', role='organizer')
+    event = Event.objects.create(
+        name=f'{label} event {run_id}',
+        description='Benchmark event',
+        date=timezone.now() + timedelta(days=30),
+        organizer=organizer,
+        is_published=True,
+    )
+    ticket = Ticket.objects.create(event=event, type='general', price=10, quantity_available=stock)
+    if shards:
+        with transaction.atomic():
+            ticket = enable_sharding(ticket, shards)
+    attendees = CustomUser.objects.bulk_create([
+        CustomUser(username=f'{label}_buyer_{run_id}_{i}', role='attendee') for i in range(buyers)
+    ])
+    return ticket, attendees
+
+
+def run_concurrently(operation, workers, operations):
+    """
+    Call operation(i) for i in range(operations) spread over `workers` threads.
+    Returns (elapsed seconds, per-call latencies, outcome counts).
+    Each call should return True when it succeeded and False when it was rejected.
+    """
+    latencies = []
+    outcomes = {'succeeded': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    counter = iter(range(operations))
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    outcome = 'succeeded' if operation(i) else 'rejected'
+                except Exception:
+                    outcome = 'errors'
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    outcomes[outcome] += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, outcomes
+
+
+def percentile(latencies, pct):
+    """Nearest-rank percentile of a list of latencies"""
+    if not latencies:
+        return 0.0
+    ordered = sorted(latencies)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def checkout_operation(strategy, ticket, attendees, quantity=1):
+    reserve = STRATEGIES[strategy]
+
+    def operation(i):
+        try:
+            with transaction.atomic():
+                reserve([{'ticket_id': ticket.id, 'quantity': quantity}], attendee=attendees[i % len(attendees)])
+        except serializers.ValidationError:
+            return False
+        return True
+
+    return operation
+
+
+def inventory_report(ticket):
+    """Check that a ticket was never oversold and that its counter matches the live order items"""
+    ticket = Ticket.objects.with_total_sold().get(id=ticket.id)
+    items_sold = OrderItem.objects.filter(
+        ticket=ticket,
+        order__status__in=['pending', 'paid'],
+    ).aggregate(total=Sum('quantity'))['total'] or 0
+    shards = list(ticket.shards.values_list('capacity', 'quantity_sold'))
+    return {
+        'quantity_available': ticket.quantity_available,
+        'quantity_sold': ticket.total_sold,
+        'items_sold': items_sold,
+        'oversold': ticket.total_sold > ticket.quantity_available or any(sold > cap for cap, sold in shards),
+        'consistent': ticket.total_sold == items_sold,
+    }
@@ -0,0 +1,121 @@
+"""
+Fulfillment of paid orders: issue tickets -> notify the attendee.
+
+Payment endpoints only mark the order paid and queue the pipeline on commit
+(queue_fulfillment); the stages then run as Celery tasks. Every stage is safe
+to run again, so a retried or re-queued pipeline never issues a ticket or sends
+a confirmation twice. fulfill_order runs the same stages inline.
+
+Tickets are issued in bulk, so group orders and comp lists cost a handful of
+queries whatever their size. QR codes are not stored at all: they are rendered
+on request by the issued ticket's qr endpoint.
+"""
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Order, OrderItem
+from tickets.models import IssuedTicket
+
+logger = logging.getLogger(__name__)
+
+
+def send_confirmation(order):
+    item = order.orderitem_set.select_related('ticket__event').first()
+    send_mail(
+        'Ticket Purchase Confirmation',
+        f'Your order {order.id} is confirmed. Event: {item.ticket.event.name}',
+        'from@example.com',
+        [order.attendee.email],
+        fail_silently=False,
+    )
+
+
+def issue_tickets_bulk(orders):
+    """
+    Create whatever IssuedTickets `orders` are still owed, in one bulk insert,
+    and return them.
+    """
+    order_ids = [order.pk for order in orders]
+    with transaction.atomic():
+        # Serialise concurrent runs of this stage for the same orders
+        list(Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk').values_list('pk'))
+        issued = defaultdict(int)
+        for row in IssuedTicket.objects.filter(order__in=order_ids).values('order', 'ticket').annotate(count=Count('id')):
+            issued[row['order'], row['ticket']] = row['count']
+
+        owed = []
+        for item in OrderItem.objects.filter(order__in=order_ids):
+            for _ in range(item.quantity - issued[item.order_id, item.ticket_id]):
+                owed.append(IssuedTicket(ticket_id=item.ticket_id, order_id=item.order_id))
+            # An order may list the same ticket type on several lines
+            issued[item.order_id, item.ticket_id] = max(0, issued[item.order_id, item.ticket_id] - item.quantity)
+
+        created = IssuedTicket.objects.bulk_create(owed, batch_size=settings.ISSUANCE_BATCH_SIZE)
+        Order.objects.filter(pk__in=order_ids, fulfillment_status__in=['none', 'queued']).update(
+            fulfillment_status='issued'
+        )
+    return created
+
+
+def issue_tickets(order):
+    """Create whatever IssuedTickets the order is still owed"""
+    issue_tickets_bulk([order])
+    if order.fulfillment_status in ('none', 'queued'):
+        order.fulfillment_status = 'issued'
+    return order
+
+
+def notify_attendee(order):
+    """Send the confirmation once; the status flip is the claim on sending it"""
+    if not Order.objects.filter(pk=order.pk).exclude(fulfillment_status__in=['notified', 'failed']).update(
+        fulfillment_status='notified'
+    ):
+        return order
+    try:
+        send_confirmation(order)
+    except Exception:
+        # Give the claim back so a retry sends it
+        Order.objects.filter(pk=order.pk).update(fulfillment_status='issued')
+        raise
+    order.fulfillment_status = 'notified'
+    return order
+
+
+def fulfill_order(order):
+    """Create issued tickets and send the confirmation, inline"""
+    # Update order status
+    if order.status != 'paid':
+        order.status = 'paid'
+        order.paid_at = timezone.now()
+        order.save()
+
+    order = issue_tickets(order)
+    notify_attendee(order)
+
+
+def queue_fulfillment(order):
+    """
+    Mark the order paid and run the fulfillment pipeline once the surrounding
+    transaction commits. Returns immediately.
+    """
+    from .tasks import start_fulfillment
+
+    order.status = 'paid'
+    order.fulfillment_status = 'queued'
+    order.paid_at = timezone.now()
+    order.save(update_fields=['status', 'fulfillment_status', 'paid_at'])
+
+    def dispatch():
+        try:
+            start_fulfillment(order.pk)
+        except Exception:
+            # Broker unavailable: resume_fulfillments picks the order up later
+            logger.exception("Could not queue fulfillment for order %s", order.pk)
+
+    transaction.on_commit(dispatch)
@@ -0,0 +1,93 @@
+"""
+Idempotency-Key support for endpoints that create orders or start payments.
+
+The first response for a (user, path, key) is rendered and stored in the cache
+(unless it is a server error or a denial the client can clear, see NOT_STORED);
+retries with the same key get those exact bytes back instead of running the
+view again. A retry that arrives while the first request is still running waits
+for its result rather than racing it.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+# Denials the client can clear without changing the body (an admission token, a
+# login, waiting out a throttle): a retry with the same key must run the view again
+NOT_STORED = {
+    status.HTTP_401_UNAUTHORIZED,
+    status.HTTP_403_FORBIDDEN,
+    status.HTTP_409_CONFLICT,
+    status.HTTP_429_TOO_MANY_REQUESTS,
+}
+
+
+def _digest(value):
+    return hashlib.sha256(value).hexdigest()
+
+
+def replay(stored):
+    response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(handler):
+    """Decorate a DRF view's POST handler to honour the Idempotency-Key header"""
+
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = 'idempotency_' + _digest(f'{request.user.pk}:{request.path}:{key}'.encode())
+        lock_key = cache_key + '_lock'
+        fingerprint = _digest(request.body)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+
+        while True:
+            stored = cache.get(cache_key)
+            if stored is not None:
+                if stored['fingerprint'] != fingerprint:
+                    return Response(
+                        {'error': 'Idempotency-Key was already used for a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                return replay(stored)
+
+            if cache.add(lock_key, 1, settings.IDEMPOTENCY_LOCK_SECONDS):
+                break
+            if time.monotonic() >= deadline:
+                return Response(
+                    {'error': 'A request with this Idempotency-Key is still in progress'},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            time.sleep(0.05)
+
+        try:
+            response = handler(self, request, *args, **kwargs)
+            # Render now so the stored bytes are exactly what this client receives
+            response = self.finalize_response(request, response, *args, **kwargs)
+            response.render()
+            if response.status_code < 500 and response.status_code not in NOT_STORED:
+                cache.set(cache_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'content_type': response['Content-Type'],
+                    'content': response.content,
+                }, settings.IDEMPOTENCY_TTL_SECONDS)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
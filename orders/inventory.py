@@ -0,0 +1,178 @@
+import random
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import F, Sum
+from rest_framework import serializers
+
+from . import stock_gate
+from .models import Order, OrderItem
+from tickets.models import Ticket, TicketShard
+
+
+def merge_items(items_data):
+    """Collapse order lines into {ticket_id: quantity}, ordered by ticket id"""
+    quantities = {}
+    for item in items_data:
+        ticket_id = item['ticket_id']
+        quantities[ticket_id] = quantities.get(ticket_id, 0) + item['quantity']
+    # Claim rows in a stable order so two multi-ticket orders can't deadlock
+    return OrderedDict(sorted(quantities.items(), key=lambda pair: str(pair[0])))
+
+
+def claim_ticket(ticket, quantity):
+    """
+    Add `quantity` to quantity_sold only if it still fits in quantity_available.
+    One guarded UPDATE, no read-modify-write. Returns True if the stock was claimed.
+    """
+    if ticket.shard_count:
+        return claim_from_shards(ticket, quantity)
+    return Ticket.objects.filter(
+        id=ticket.id,
+        quantity_sold__lte=F('quantity_available') - quantity,
+    ).update(quantity_sold=F('quantity_sold') + quantity) == 1
+
+
+def claim_from_shards(ticket, quantity):
+    """
+    Try the shards in random order with the same guarded UPDATE, so concurrent
+    buyers spread over different rows. If no single shard has `quantity` left
+    (stock is fragmented near sell-out), take it piecewise; the caller's
+    transaction undoes a partial claim.
+    """
+    shards = TicketShard.objects.filter(ticket_id=ticket.id)
+    indexes = list(range(ticket.shard_count))
+    random.shuffle(indexes)
+    for index in indexes:
+        if shards.filter(index=index, quantity_sold__lte=F('capacity') - quantity).update(
+            quantity_sold=F('quantity_sold') + quantity
+        ):
+            return True
+
+    needed = quantity
+    remaining = shards.filter(quantity_sold__lt=F('capacity')).values_list('index', 'capacity', 'quantity_sold')
+    for index, capacity, sold in remaining:
+        take = min(capacity - sold, needed)
+        if shards.filter(index=index, quantity_sold__lte=F('capacity') - take).update(
+            quantity_sold=F('quantity_sold') + take
+        ):
+            needed -= take
+        if not needed:
+            return True
+    return False
+
+
+def release_ticket(ticket, quantity):
+    """Hand `quantity` seats back, never taking a counter below zero"""
+    if ticket.shard_count:
+        shards = TicketShard.objects.filter(ticket_id=ticket.id)
+        indexes = list(range(ticket.shard_count))
+        random.shuffle(indexes)
+        for index in indexes:
+            if shards.filter(index=index, quantity_sold__gte=quantity).update(
+                quantity_sold=F('quantity_sold') - quantity
+            ):
+                return
+        for index, sold in shards.filter(quantity_sold__gt=0).values_list('index', 'quantity_sold'):
+            give_back = min(sold, quantity)
+            if shards.filter(index=index, quantity_sold__gte=give_back).update(
+                quantity_sold=F('quantity_sold') - give_back
+            ):
+                quantity -= give_back
+            if not quantity:
+                return
+        # Whatever is left was sold before the ticket was sharded
+    Ticket.objects.filter(id=ticket.id, quantity_sold__gte=quantity).update(
+        quantity_sold=F('quantity_sold') - quantity
+    )
+
+
+def release_order(order, status):
+    """
+    Move a pending order to `status` and hand its seats back.
+    Returns False (and releases nothing) if the order was no longer pending.
+    Must run inside transaction.atomic().
+    """
+    if not Order.objects.filter(pk=order.pk, status='pending').update(status=status):
+        return False
+    order.status = status
+    release_items([order.pk])
+    return True
+
+
+def release_items(order_ids):
+    """
+    Hand back the seats held by these orders: one UPDATE per ticket type, however many orders.
+    Returns the number of ticket types touched. Must run inside transaction.atomic().
+    """
+    rows = OrderItem.objects.filter(order_id__in=order_ids).values(
+        'ticket', 'ticket__shard_count',
+    ).annotate(quantity=Sum('quantity')).order_by('ticket')
+    quantities = {}
+    for row in rows:
+        release_ticket(Ticket(id=row['ticket'], shard_count=row['ticket__shard_count']), row['quantity'])
+        quantities[row['ticket']] = row['quantity']
+
+    transaction.on_commit(lambda: stock_gate.release(quantities))
+    return len(quantities)
+
+
+def enable_sharding(ticket, shard_count):
+    """
+    Split the ticket's remaining stock across `shard_count` shards (0 turns sharding off).
+    Seats already sold stay in quantity_sold. Re-run after changing quantity_available.
+    Must run inside transaction.atomic().
+    """
+    ticket = Ticket.objects.select_for_update().get(id=ticket.id)
+    shards = TicketShard.objects.select_for_update().filter(ticket=ticket)
+    ticket.quantity_sold += shards.aggregate(total=Sum('quantity_sold'))['total'] or 0
+    shards.delete()
+
+    if shard_count:
+        remaining = max(ticket.quantity_available - ticket.quantity_sold, 0)
+        per_shard, extra = divmod(remaining, shard_count)
+        TicketShard.objects.bulk_create([
+            TicketShard(ticket=ticket, index=index, capacity=per_shard + (1 if index < extra else 0))
+            for index in range(shard_count)
+        ])
+    ticket.shard_count = shard_count
+    ticket.save(update_fields=['quantity_sold', 'shard_count', 'updated_at'])
+    return ticket
+
+
+def reserve_order(items_data, **order_fields):
+    """
+    Create the pending Order with its items, then claim stock for every line.
+    Must run inside transaction.atomic(): a failed claim raises ValidationError
+    and the rollback releases whatever was already claimed.
+    """
+    quantities = merge_items(items_data)
+
+    # One read for prices and error labels; nothing is locked yet
+    tickets = Ticket.objects.select_related('event').in_bulk(quantities.keys())
+    for ticket_id in quantities:
+        if ticket_id not in tickets:
+            raise serializers.ValidationError(f"Ticket {ticket_id} does not exist")
+
+    order = Order.objects.create(
+        total_amount=sum(tickets[ticket_id].price * quantity for ticket_id, quantity in quantities.items()),
+        status='pending',
+        **order_fields,
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            ticket_id=ticket_id,
+            quantity=quantity,
+            price_at_purchase=tickets[ticket_id].price,
+        )
+        for ticket_id, quantity in quantities.items()
+    ])
+
+    # Claim last, so the ticket rows stay locked only from the UPDATE until commit
+    for ticket_id, quantity in quantities.items():
+        ticket = tickets[ticket_id]
+        if not claim_ticket(ticket, quantity):
+            raise serializers.ValidationError(f"Not enough tickets available for {ticket.event.name} ({ticket.type})")
+
+    return order
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from users.models import CustomUser
+from orders.benchmarks import STRATEGIES, checkout_operation, inventory_report, run_concurrently, seed_ticket
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent checkouts against a single hot ticket type (run against PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategy', choices=[*STRATEGIES, 'all'], default='all')
+        parser.add_argument('--shards', default='',
+                            help='Comma-separated shard counts to compare, e.g. 1,2,4,8 (guarded strategy only)')
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent buyers')
+        parser.add_argument('--checkouts', type=int, default=2000, help='Checkout attempts per run')
+        parser.add_argument('--stock', type=int, default=1000, help='Seats on the ticket type')
+        parser.add_argument('--quantity', type=int, default=1, help='Seats per checkout')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data')
+
+    def handle(self, *args, **options):
+        if options['shards']:
+            runs = [(f'{count} shards', 'guarded', count) for count in map(int, options['shards'].split(','))]
+        elif options['strategy'] == 'all':
+            runs = [(strategy, strategy, 0) for strategy in STRATEGIES]
+        else:
+            runs = [(options['strategy'], options['strategy'], 0)]
+
+        rates = {}
+        for name, strategy, shards in runs:
+            ticket, attendees = seed_ticket(options['stock'], options['workers'], label=f'bench_{strategy}', shards=shards)
+            operation = checkout_operation(strategy, ticket, attendees, options['quantity'])
+
+            elapsed, latencies, outcomes = run_concurrently(operation, options['workers'], options['checkouts'])
+            report = inventory_report(ticket)
+            rates[name] = outcomes['succeeded'] / elapsed
+
+            self.stdout.write(
+                f"{name:>10}: {rates[name]:8.1f} checkouts/sec "
+                f"({outcomes['succeeded']} sold, {outcomes['rejected']} rejected, {outcomes['errors']} errors "
+                f"in {elapsed:.2f}s)"
+            )
+            if report['oversold'] or not report['consistent']:
+                self.stdout.write(self.style.ERROR(f'  Inventory invariant broken: {report}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"  OK: {report['quantity_sold']}/{report['quantity_available']} sold, matches order items"
+                ))
+
+            if not options['keep']:
+                ticket.event.organizer.delete()
+                CustomUser.objects.filter(pk__in=[attendee.pk for attendee in attendees]).delete()
+
+        baseline, *others = rates
+        if others and rates[baseline]:
+            for name in others:
+                self.stdout.write(f"{name:>10}: {rates[name] / rates[baseline]:.2f}x the throughput of {baseline}")
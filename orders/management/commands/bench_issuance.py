@@ -0,0 +1,48 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from users.models import CustomUser
+from orders.benchmarks import ISSUERS, seed_ticket
+from orders.models import Order, OrderItem
+from tickets.models import IssuedTicket
+
+
+class Command(BaseCommand):
+    help = 'Benchmark issuing a large comp batch: per-seat create + stored QR versus bulk issuance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategy', choices=[*ISSUERS, 'all'], default='all')
+        parser.add_argument('--tickets', type=int, default=5000, help='Seats to issue')
+        parser.add_argument('--orders', type=int, default=1, help='Orders the seats are spread over')
+
+    def handle(self, *args, **options):
+        strategies = list(ISSUERS) if options['strategy'] == 'all' else [options['strategy']]
+        per_order = max(1, options['tickets'] // options['orders'])
+
+        for strategy in strategies:
+            ticket, attendees = seed_ticket(per_order * options['orders'], 1, label=f'issue_{strategy}')
+            orders = Order.objects.bulk_create([
+                Order(attendee=attendees[0], total_amount=0, status='paid') for _ in range(options['orders'])
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, ticket=ticket, quantity=per_order) for order in orders
+            ])
+
+            with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                    CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                ISSUERS[strategy](orders)
+                elapsed = time.perf_counter() - started
+
+            issued = IssuedTicket.objects.filter(order__in=orders).count()
+            self.stdout.write(
+                f"{strategy:>7}: {issued} tickets in {elapsed:.2f}s ({issued / elapsed:.0f}/sec, {len(queries)} queries)"
+            )
+
+            ticket.event.organizer.delete()
+            CustomUser.objects.filter(pk__in=[attendee.pk for attendee in attendees]).delete()
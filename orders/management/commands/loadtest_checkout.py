@@ -0,0 +1,245 @@
+import json
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from orders.benchmarks import LockTimer, inventory_report, latency_summary, seed_catalog
+from orders.models import Order
+from orders.serializers import OrderSerializer
+from orders.tasks import expire_pending_orders
+from orders.fulfillment import fulfill_order
+from orders.views import MpesaPaymentView, cancel_order
+from users.models import CustomUser
+
+OPERATIONS = ('checkout', 'pay', 'cancel')
+
+
+def fake_stk_push(phone_number, amount, account_reference, transaction_desc):
+    """Stand-in for the Daraja API"""
+    return {'ResponseCode': '0', 'CheckoutRequestID': f'ws_CO_{account_reference}'}
+
+
+def fake_stripe_call(*args, **kwargs):
+    raise RuntimeError('Stripe must not be called during a load test')
+
+
+class Command(BaseCommand):
+    help = 'Load-test the purchase path (checkout, pay + fulfill, cancel, expire) and check inventory invariants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=5)
+        parser.add_argument('--types', default='general,vip', help='Ticket types per event')
+        parser.add_argument('--stock', type=int, default=500, help='Seats per ticket type')
+        parser.add_argument('--buyers', type=int, default=200, help='Attendee accounts to buy with')
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent simulated buyers')
+        parser.add_argument('--operations', type=int, default=3000)
+        parser.add_argument('--mix', default='70,20,10', help='Checkout, pay and cancel weights')
+        parser.add_argument('--hold-seconds', type=float, default=3.0,
+                            help='expires_at of new orders, so the expiry task has work to do')
+        parser.add_argument('--expiry-interval', type=float, default=1.0)
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, for comparable runs')
+        parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        organizer, tickets, buyers = seed_catalog(
+            options['events'], options['stock'], options['buyers'], types=options['types'].split(','),
+        )
+        run = LoadTest(tickets, buyers, options)
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            MEDIA_ROOT=media_root,
+        ), mock.patch('orders.views.initiate_stk_push', fake_stk_push), \
+                mock.patch('orders.views.stripe.checkout.Session.create', fake_stripe_call):
+            run.run()
+
+        results = run.results()
+        self.report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2, default=str)
+            self.stdout.write(f"Results written to {options['json_path']}")
+
+        if not options['keep']:
+            organizer.delete()
+            CustomUser.objects.filter(pk__in=[buyer.pk for buyer in buyers]).delete()
+
+        broken = [report for report in results['inventory'] if report['oversold'] or not report['consistent']]
+        if broken:
+            raise CommandError(f'Inventory invariant broken for {len(broken)} ticket types: {broken}')
+
+    def report(self, results):
+        self.stdout.write(f"{'operation':>10} {'count':>7} {'per sec':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name, summary in results['operations'].items():
+            self.stdout.write(
+                f"{name:>10} {summary['count']:>7} {summary['per_sec']:>8} {summary['p50_ms']:>8} "
+                f"{summary['p95_ms']:>8} {summary['p99_ms']:>8} {summary['errors']:>7}"
+            )
+        lock_wait = results['lock_wait']
+        self.stdout.write(
+            f"\nRow-lock statements: {lock_wait['count']}, {lock_wait['total_seconds']}s total, "
+            f"p99 {lock_wait['p99_ms']}ms"
+        )
+        self.stdout.write(f"Expiry: {results['expiry']}")
+        if any(r['oversold'] or not r['consistent'] for r in results['inventory']):
+            self.stdout.write(self.style.ERROR('Inventory invariants FAILED'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Inventory invariants hold for {len(results['inventory'])} ticket types"
+            ))
+
+
+class LoadTest:
+    def __init__(self, tickets, buyers, options):
+        self.tickets = tickets
+        self.buyers = buyers
+        self.options = options
+        self.weights = [int(weight) for weight in options['mix'].split(',')]
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.lock_timer = LockTimer()
+        self.expiry = {'runs': 0, 'orders': 0}
+        self.factory = RequestFactory()
+        self.api_factory = APIRequestFactory()
+
+    def run(self):
+        remaining = iter(range(self.options['operations']))
+        done = threading.Event()
+
+        def worker(worker_no):
+            # Seeded by position, not thread id, so a run can be repeated
+            rng = random.Random(self.options['seed'] + worker_no)
+            with connection.execute_wrapper(self.lock_timer):
+                try:
+                    while True:
+                        with self.lock:
+                            if next(remaining, None) is None:
+                                return
+                        self.perform(rng.choices(OPERATIONS, self.weights)[0], rng)
+                finally:
+                    connection.close()
+
+        def expirer():
+            with connection.execute_wrapper(self.lock_timer):
+                try:
+                    while not done.wait(self.options['expiry_interval']):
+                        self.expire()
+                    self.expire()
+                finally:
+                    connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.options['workers'])]
+        expiry_thread = threading.Thread(target=expirer)
+        self.started = time.perf_counter()
+        expiry_thread.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        done.set()
+        expiry_thread.join()
+
+    def perform(self, operation, rng):
+        if operation != 'checkout':
+            with self.lock:
+                order_id = self.pending.pop(rng.randrange(len(self.pending))) if self.pending else None
+            if order_id is None:
+                operation = 'checkout'
+
+        started = time.perf_counter()
+        failed = False
+        try:
+            if operation == 'checkout':
+                self.checkout(rng)
+            elif operation == 'pay':
+                self.pay(order_id)
+            else:
+                self.cancel(order_id)
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[operation].append(elapsed)
+            if failed:
+                self.errors[operation] += 1
+
+    def checkout(self, rng):
+        buyer = rng.choice(self.buyers)
+        lines = rng.sample(self.tickets, k=min(len(self.tickets), rng.choice([1, 1, 1, 2])))
+        serializer = OrderSerializer(data={
+            'items': [{'ticket_id': str(ticket.id), 'quantity': rng.randint(1, 4)} for ticket in lines]
+        })
+        serializer.is_valid(raise_exception=True)
+        try:
+            order = serializer.save(
+                attendee=buyer,
+                expires_at=timezone.now() + timedelta(seconds=self.options['hold_seconds']),
+            )
+        except serializers.ValidationError:
+            # Sold out is an expected outcome, not an error
+            return
+        with self.lock:
+            self.pending.append(order.id)
+
+    def pay(self, order_id):
+        order = Order.objects.select_related('attendee').get(id=order_id)
+        request = self.api_factory.post('/orders/mpesa/pay/', {
+            'order_id': order.id, 'phone_number': '254700000000',
+        }, format='json')
+        force_authenticate(request, user=order.attendee)
+        MpesaPaymentView.as_view()(request)
+
+        with transaction.atomic():
+            # Same guard as the payment callbacks; the pipeline stages run inline here
+            order = Order.objects.select_for_update().get(id=order_id)
+            if order.status == 'pending':
+                fulfill_order(order)
+
+    def cancel(self, order_id):
+        order = Order.objects.select_related('attendee').get(id=order_id)
+        request = self.factory.post(f'/orders/cancel/{order_id}/')
+        request.user = order.attendee
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        cancel_order(request, order_id)
+
+    def expire(self):
+        stats = expire_pending_orders()
+        self.expiry['runs'] += 1
+        self.expiry['orders'] += stats['orders']
+
+    def results(self):
+        operations = {}
+        for name in OPERATIONS:
+            operations[name] = {**latency_summary(self.latencies[name], self.elapsed), 'errors': self.errors[name]}
+        lock_wait = latency_summary(self.lock_timer.durations, self.elapsed)
+        lock_wait['total_seconds'] = round(sum(self.lock_timer.durations), 3)
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'config': {key: self.options[key] for key in (
+                'events', 'types', 'stock', 'buyers', 'workers', 'operations', 'mix', 'hold_seconds', 'seed',
+            )},
+            'elapsed_seconds': round(self.elapsed, 3),
+            'operations': operations,
+            'lock_wait': lock_wait,
+            'expiry': self.expiry,
+            'inventory': [inventory_report(ticket) for ticket in self.tickets],
+        }
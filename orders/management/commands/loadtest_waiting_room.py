@@ -0,0 +1,166 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from events.models import Event
+from users.models import CustomUser
+from orders.benchmarks import percentile, seed_ticket
+from orders.views import OrderViewSet, QueueJoinView, QueueStatusView
+
+
+class Command(BaseCommand):
+    help = 'Local load test: a 50x arrival spike against checkout, with and without the waiting room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-rate', type=float, default=4, help='Buyers arriving per second before the spike')
+        parser.add_argument('--spike', type=float, default=50, help='Arrival multiplier during the spike')
+        parser.add_argument('--warmup', type=int, default=5, help='Seconds at the base rate')
+        parser.add_argument('--spike-seconds', type=int, default=5, help='Seconds at the spiked rate')
+        parser.add_argument('--admission-rate', type=int, default=10, help='Buyers admitted per second')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between queue polls')
+        parser.add_argument('--workers', type=int, default=16, help='Threads serving the simulated buyers')
+        parser.add_argument('--no-queue', action='store_true', help='Send everyone straight to checkout')
+
+    def handle(self, *args, **options):
+        arrivals = [i / options['base_rate'] for i in range(int(options['base_rate'] * options['warmup']))]
+        spike_rate = options['base_rate'] * options['spike']
+        arrivals += [options['warmup'] + i / spike_rate for i in range(int(spike_rate * options['spike_seconds']))]
+
+        ticket, buyers = seed_ticket(stock=len(arrivals), buyers=len(arrivals), label='waiting_room')
+        event = ticket.event
+        if not options['no_queue']:
+            Event.objects.filter(id=event.id).update(admission_rate=options['admission_rate'])
+        cache.clear()
+
+        runner = Simulation(event, ticket, buyers, arrivals, options)
+        runner.run()
+
+        self.stdout.write(f"{'second':>6} {'arrived':>8} {'checkouts':>10} {'db queries':>11}")
+        for second in range(int(runner.elapsed) + 1):
+            self.stdout.write(
+                f"{second:>6} {runner.arrived[second]:>8} {runner.checkouts[second]:>10} {runner.queries[second]:>11}"
+            )
+
+        latencies = runner.checkout_latencies
+        self.stdout.write(
+            f"\n{len(latencies)} checkouts, p50 {percentile(latencies, 50) * 1000:.1f}ms, "
+            f"p99 {percentile(latencies, 99) * 1000:.1f}ms, "
+            f"peak {max(runner.queries.values(), default=0)} queries/sec"
+        )
+        if runner.errors:
+            self.stdout.write(self.style.ERROR(f'{runner.errors} requests failed'))
+
+        event.organizer.delete()
+        CustomUser.objects.filter(pk__in=[buyer.pk for buyer in buyers]).delete()
+
+
+class Simulation:
+    """
+    Simulated buyers as a time-ordered heap of next actions (join, poll, checkout),
+    drained by a small pool of threads so thousands of waiting buyers don't need a thread each.
+    """
+
+    def __init__(self, event, ticket, buyers, arrivals, options):
+        self.event = event
+        self.ticket = ticket
+        self.options = options
+        self.factory = APIRequestFactory()
+        self.heap = [(at, i, 'join', buyers[i], None) for i, at in enumerate(arrivals)]
+        heapq.heapify(self.heap)
+        self.pending = len(self.heap)
+        self.condition = threading.Condition()
+        self.arrived = defaultdict(int)
+        self.checkouts = defaultdict(int)
+        self.queries = defaultdict(int)
+        self.checkout_latencies = []
+        self.errors = 0
+        self.elapsed = 0
+
+    def run(self):
+        self.started = time.monotonic()
+        threads = [threading.Thread(target=self.worker) for _ in range(self.options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.monotonic() - self.started
+
+    def second(self):
+        return int(time.monotonic() - self.started)
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries[self.second()] += 1
+        return execute(sql, params, many, context)
+
+    def schedule(self, delay, seq, action, buyer, token):
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() - self.started + delay, seq, action, buyer, token))
+            self.pending += 1
+            self.condition.notify()
+
+    def worker(self):
+        with connection.execute_wrapper(self.count_query):
+            try:
+                while True:
+                    with self.condition:
+                        while True:
+                            if not self.pending:
+                                self.condition.notify_all()
+                                return
+                            if self.heap:
+                                due = self.heap[0][0] - (time.monotonic() - self.started)
+                                if due <= 0:
+                                    job = heapq.heappop(self.heap)
+                                    break
+                                self.condition.wait(due)
+                            else:
+                                self.condition.wait()
+                    try:
+                        self.perform(*job[1:])
+                    except Exception:
+                        self.errors += 1
+                    with self.condition:
+                        self.pending -= 1
+                        self.condition.notify_all()
+            finally:
+                connection.close()
+
+    def perform(self, seq, action, buyer, token):
+        event_id = self.event.id
+        if action == 'join':
+            self.arrived[self.second()] += 1
+            if self.options['no_queue']:
+                return self.perform(seq, 'checkout', buyer, '')
+            request = self.factory.post(f'/orders/queue/{event_id}/')
+            force_authenticate(request, user=buyer)
+            data = QueueJoinView.as_view()(request, event_id=event_id).data
+            return self.next_step(seq, buyer, data['token'], data)
+
+        if action == 'poll':
+            request = self.factory.get(f'/orders/queue/{event_id}/status/', {'token': token})
+            force_authenticate(request, user=buyer)
+            data = QueueStatusView.as_view()(request, event_id=event_id).data
+            return self.next_step(seq, buyer, token, data)
+
+        request = self.factory.post('/orders/api/', {
+            'items': [{'ticket_id': str(self.ticket.id), 'quantity': 1}]
+        }, format='json', HTTP_X_ADMISSION_TOKEN=token)
+        force_authenticate(request, user=buyer)
+        started = time.monotonic()
+        response = OrderViewSet.as_view({'post': 'create'})(request)
+        self.checkout_latencies.append(time.monotonic() - started)
+        if response.status_code != 201:
+            self.errors += 1
+        self.checkouts[self.second()] += 1
+
+    def next_step(self, seq, buyer, token, data):
+        if data['admitted']:
+            self.perform(seq, 'checkout', buyer, data['admission_token'])
+        else:
+            self.schedule(self.options['poll'], seq, 'poll', buyer, token)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from orders.inventory import enable_sharding
+from tickets.models import Ticket
+
+
+class Command(BaseCommand):
+    help = 'Spread a hot ticket type over N counter shards (0 folds the shards back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ticket_id')
+        parser.add_argument('shards', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            ticket = Ticket.objects.get(id=options['ticket_id'])
+        except (Ticket.DoesNotExist, ValueError):
+            raise CommandError(f"Ticket {options['ticket_id']} does not exist")
+
+        with transaction.atomic():
+            ticket = enable_sharding(ticket, options['shards'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{ticket}: {ticket.shard_count} shards, {ticket.total_sold}/{ticket.quantity_available} sold'
+        ))
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'expires_at'], name='orders_orde_status_62907b_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_orders_orde_status_62907b_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='fulfillment_status',
+            field=models.CharField(choices=[('none', 'Not started'), ('queued', 'Queued'), ('issued', 'Tickets issued'), ('rendered', 'QR codes rendered'), ('notified', 'Fulfilled'), ('failed', 'Failed')], default='none', max_length=20),
+        ),
+    ]
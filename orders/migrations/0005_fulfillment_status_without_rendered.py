@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-17 06:25
+
+from django.db import migrations, models
+
+
+def rendered_to_issued(apps, schema_editor):
+    # QR codes are no longer a fulfillment stage; those orders only await their confirmation
+    Order = apps.get_model('orders', 'Order')
+    Order.objects.filter(fulfillment_status='rendered').update(fulfillment_status='issued')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_fulfillment_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(rendered_to_issued, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='fulfillment_status',
+            field=models.CharField(choices=[('none', 'Not started'), ('queued', 'Queued'), ('issued', 'Tickets issued'), ('notified', 'Fulfilled'), ('failed', 'Failed')], default='none', max_length=20),
+        ),
+    ]
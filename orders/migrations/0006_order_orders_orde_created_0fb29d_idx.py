@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_fulfillment_status_without_rendered'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='orders_orde_created_0fb29d_idx'),
+        ),
+    ]
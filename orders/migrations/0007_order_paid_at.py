@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:55
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_paid_at(apps, schema_editor):
+    # Orders paid before the field existed: the best estimate left is when they were placed
+    Order = apps.get_model('orders', 'Order')
+    Order.objects.filter(status='paid', paid_at__isnull=True).update(paid_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_orders_orde_created_0fb29d_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_paid_at, migrations.RunPython.noop),
+    ]
@@ -17,6 +17,13 @@ class Order(models.Model):
         ('refunded', 'Refunded'),
         ('expired', 'Expired'),
     )
+    FULFILLMENT_STATUS_CHOICES = (
+        ('none', 'Not started'),
+        ('queued', 'Queued'),
+        ('issued', 'Tickets issued'),
+        ('notified', 'Fulfilled'),
+        ('failed', 'Failed'),
+    )
 
     attendee = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='orders')
     #tickets = models.ManyToManyField(Ticket, through='OrderItem')
@@ -24,8 +31,17 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(default=default_order_expires_at)
+    fulfillment_status = models.CharField(max_length=20, choices=FULFILLMENT_STATUS_CHOICES, default='none')
+    # When fulfillment was queued; resume_fulfillments measures stalls from here
+    paid_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
+        # Pending orders sorted by expiry: the expiry tick reads due orders off the front
+        # The API pages through orders in (created_at, id) order (core.pagination)
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['created_at', 'id']),
+        ]
         permissions = [
             ("can_issue_refunds", "Can issue refunds"),
         ]
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from tickets.models import Ticket
+from . import stock_gate
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def on_ticket_changed(sender, instance: Ticket, **kwargs):
+    # quantity_available may have changed; the gate is primed again on the next checkout
+    stock_gate.invalidate(instance.id)
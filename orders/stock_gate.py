@@ -0,0 +1,147 @@
+"""
+Cache-side stock counters that sit in front of reserve_order during on-sales.
+
+Each ticket type gets a `stock_gate_<id>` key holding the seats left. A checkout
+claims from the gate first, so once a ticket is sold out further attempts are
+rejected without opening a transaction. The guarded UPDATE in reserve_order is
+still the source of truth, so the gate can never oversell, but it can drift:
+
+- too high (reconcile() counting seats a checkout has claimed but not yet
+  committed) just lets a few more buyers through to that UPDATE;
+- too low (a worker dying between claim and commit or release, which no
+  on_commit or except block survives) turns buyers away with a false "sold
+  out". reconcile() resets the counters from the database, and the
+  reconcile-stock-gate task runs it every STOCK_GATE_RECONCILE_SECONDS
+  (default 5) for every event still on sale, which bounds how long that lasts.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+
+from tickets.models import Ticket
+
+# KEYS are gate keys, ARGV the matching quantities. Returns 0 when every claim
+# was taken, i when KEYS[i] is short, -i when KEYS[i] hasn't been primed yet.
+CLAIM_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local left = redis.call('GET', key)
+    if not left then return -i end
+    if tonumber(left) < tonumber(ARGV[i]) then return i end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('DECRBY', key, ARGV[i])
+end
+return 0
+"""
+
+_claim_script = None
+
+
+def gate_key(ticket_id):
+    return f'stock_gate_{ticket_id}'
+
+
+def gate_enabled():
+    return settings.INVENTORY_GATE_ENABLED
+
+
+def get_redis():
+    """Raw Redis client behind the default cache, or None for other backends"""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def prime(ticket_ids):
+    """Seed missing gate keys from the database. Returns the ids that exist."""
+    tickets = Ticket.objects.with_total_sold().filter(id__in=ticket_ids)
+    primed = []
+    for ticket in tickets:
+        # add() so a concurrent primer (or claims already made against it) wins
+        cache.add(gate_key(ticket.id), max(ticket.quantity_available - ticket.total_sold, 0), None)
+        primed.append(ticket.id)
+    return primed
+
+
+def claim(quantities):
+    """
+    Take {ticket_id: quantity} from the gate, all or nothing.
+    Raises ValidationError when a ticket is sold out. Returns the claimed quantities,
+    which must be handed to release() if the order isn't committed.
+    """
+    if not gate_enabled():
+        return {}
+
+    ticket_ids = list(quantities)
+    for attempt in range(2):
+        short = _claim(ticket_ids, [quantities[ticket_id] for ticket_id in ticket_ids])
+        if short is None:
+            return {ticket_id: quantities[ticket_id] for ticket_id in ticket_ids}
+        if short > 0:
+            raise serializers.ValidationError(f"Not enough tickets available for ticket {ticket_ids[short - 1]}")
+        # Unprimed key: seed it and try again. Unknown tickets are left to reserve_order to report.
+        primed = set(prime(ticket_ids))
+        ticket_ids = [ticket_id for ticket_id in ticket_ids if ticket_id in primed]
+        if not ticket_ids:
+            return {}
+    return {}
+
+
+def _claim(ticket_ids, amounts):
+    """Returns None on success, else the 1-based index of the short (>0) or unprimed (<0) key"""
+    global _claim_script
+    keys = [gate_key(ticket_id) for ticket_id in ticket_ids]
+
+    redis = get_redis()
+    if redis is not None:
+        if _claim_script is None:
+            _claim_script = redis.register_script(CLAIM_SCRIPT)
+        result = _claim_script(keys=[cache.make_key(key) for key in keys], args=amounts)
+        return result or None
+
+    # Other backends: decrement and compensate. decr is atomic, so a seat is never handed out twice.
+    taken = []
+    for position, (key, amount) in enumerate(zip(keys, amounts), start=1):
+        try:
+            left = cache.decr(key, amount)
+        except ValueError:
+            short = -position
+        else:
+            taken.append((key, amount))
+            if left >= 0:
+                continue
+            short = position
+        for taken_key, taken_amount in taken:
+            cache.incr(taken_key, taken_amount)
+        return short
+    return None
+
+
+def release(quantities):
+    """Hand claimed seats back to the gate"""
+    if not gate_enabled():
+        return
+    for ticket_id, quantity in quantities.items():
+        try:
+            cache.incr(gate_key(ticket_id), quantity)
+        except ValueError:
+            # Key evicted or invalidated; it will be primed from the database again
+            pass
+
+
+def invalidate(ticket_id):
+    cache.delete(gate_key(ticket_id))
+
+
+def reconcile(tickets=None):
+    """Reset gate keys to the stock left in the database. Returns the number of keys written."""
+    if tickets is None:
+        tickets = Ticket.objects.with_total_sold()
+    values = {
+        gate_key(ticket.id): max(ticket.quantity_available - ticket.total_sold, 0)
+        for ticket in tickets
+    }
+    cache.set_many(values, None)
+    return len(values)
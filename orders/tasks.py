@@ -1,28 +1,110 @@
-from celery import shared_task
+import logging
+import time
+from datetime import timedelta
+
+from celery import Task, chain, shared_task
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
-from .models import Order, OrderItem
+from .models import Order
+from .inventory import release_items
+from . import fulfillment, stock_gate
 from tickets.models import Ticket
 
+logger = logging.getLogger(__name__)
+
 
 @shared_task
-def expire_pending_orders():
+def expire_pending_orders(batch_size=None):
+    """
+    Release the stock held by pending orders past their expires_at, oldest first.
+    Runs every ORDER_EXPIRY_TICK_SECONDS; the (status, expires_at) index means a
+    tick only reads the orders that are due, never the whole table.
+
+    Each batch is claimed with SKIP LOCKED, so parallel workers (or a cancel in
+    flight) never wait on each other, and is released set-wise: one UPDATE per
+    ticket type and one for the order statuses.
+    """
+    batch_size = batch_size or settings.ORDER_EXPIRY_BATCH_SIZE
     now = timezone.now()
-    orders = Order.objects.select_for_update().filter(
-        status='pending',
-        expires_at__lte=now,
-    )
+    started = time.monotonic()
+    stats = {'orders': 0, 'ticket_updates': 0, 'batches': 0}
 
-    for order in orders:
+    while True:
         with transaction.atomic():
-            if order.status != 'pending':
-                continue
+            order_ids = list(Order.objects.select_for_update(skip_locked=True).filter(
+                status='pending',
+                expires_at__lte=now,
+            ).order_by('expires_at').values_list('id', flat=True)[:batch_size])
+
+            if order_ids:
+                stats['orders'] += Order.objects.filter(id__in=order_ids).update(status='expired')
+                stats['ticket_updates'] += release_items(order_ids)
+                stats['batches'] += 1
+
+        if len(order_ids) < batch_size:
+            break
+
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    if stats['orders']:
+        logger.info("Expired %(orders)d orders in %(batches)d batches "
+                    "(%(ticket_updates)d ticket updates, %(seconds)ss)", stats)
+    return stats
+
+
+@shared_task
+def reconcile_stock_gate():
+    """Repair gate counters that drifted after crashed checkouts or evictions"""
+    if not stock_gate.gate_enabled():
+        return 0
+    # Only tickets that can still be bought need a gate
+    tickets = Ticket.objects.with_total_sold().filter(event__date__gte=timezone.now())
+    return stock_gate.reconcile(tickets)
+
 
-            for item in OrderItem.objects.select_related('ticket').filter(order=order):
-                ticket = Ticket.objects.select_for_update().get(id=item.ticket_id)
-                if ticket.quantity_sold >= item.quantity:
-                    ticket.quantity_sold -= item.quantity
-                    ticket.save()
+class FulfillmentTask(Task):
+    """A fulfillment stage; retried with backoff, the order is marked failed once retries run out"""
+    autoretry_for = (Exception,)
+    retry_backoff = True
+    retry_jitter = True
+    max_retries = 5
 
-            order.status = 'expired'
-            order.save()
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        Order.objects.filter(pk=args[0]).exclude(fulfillment_status='notified').update(fulfillment_status='failed')
+        logger.error("Fulfillment of order %s failed: %s", args[0], exc)
+
+
+@shared_task(base=FulfillmentTask)
+def issue_order_tickets(order_id):
+    fulfillment.issue_tickets(Order.objects.get(pk=order_id))
+
+
+@shared_task(base=FulfillmentTask)
+def notify_order(order_id):
+    fulfillment.notify_attendee(Order.objects.select_related('attendee').get(pk=order_id))
+
+
+def start_fulfillment(order_id):
+    """Queue the fulfillment pipeline for a paid order"""
+    # Fail fast when the broker is down; resume_fulfillments re-queues the order
+    return chain(
+        issue_order_tickets.si(order_id),
+        notify_order.si(order_id),
+    ).apply_async(retry=False)
+
+
+@shared_task
+def resume_fulfillments():
+    """Re-queue paid orders whose fulfillment was never queued or stalled part-way"""
+    stalled = Order.objects.filter(
+        status='paid',
+        fulfillment_status__in=['queued', 'issued'],
+        paid_at__lte=timezone.now() - timedelta(seconds=settings.FULFILLMENT_STALL_SECONDS),
+    ).values_list('id', flat=True)
+    count = 0
+    for order_id in stalled:
+        start_fulfillment(order_id)
+        count += 1
+    if count:
+        logger.info("Re-queued fulfillment for %d orders", count)
+    return count
@@ -1,3 +1,12 @@
+from unittest import skipUnless
+from unittest.mock import patch
+
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
@@ -5,7 +14,15 @@ from users.models import CustomUser
 from events.models import Event
 from tickets.models import Ticket, IssuedTicket
 from orders.models import Order, OrderItem
-from orders.views import fulfill_order
+from orders.fulfillment import fulfill_order, issue_tickets, issue_tickets_bulk, notify_attendee
+from orders.inventory import enable_sharding
+from orders import admission
+from orders import stock_gate
+from core import streams
+from orders.tasks import reconcile_stock_gate
+from orders.tasks import expire_pending_orders
+from orders.tasks import resume_fulfillments
+from orders.benchmarks import checkout_operation, inventory_report, run_concurrently, seed_ticket
 from django.utils import timezone
 from django.core import mail
 
@@ -74,9 +91,12 @@ class OrderTests(APITestCase):
         self.assertEqual(IssuedTicket.objects.count(), 2)
         self.assertEqual(IssuedTicket.objects.filter(order=order).count(), 2)
         
-        # Check QR codes generated
+        # No QR files are written; each ticket's code is served on request
         for issued_ticket in IssuedTicket.objects.all():
-            self.assertTrue(issued_ticket.qr_code)
+            self.assertFalse(issued_ticket.qr_code)
+            response = self.client.get(reverse('tickets:issuedticket-qr', args=[issued_ticket.id, 'png']))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'image/png')
             
         # Check email sent
         self.assertEqual(len(mail.outbox), 1)
@@ -108,3 +128,476 @@ class OrderTests(APITestCase):
         # Check inventory restored
         self.ticket.refresh_from_db()
         self.assertEqual(self.ticket.quantity_sold, 0)
+
+    def test_create_order_merges_duplicate_lines(self):
+        url = reverse('orders:orders-list')
+        data = {
+            'items': [
+                {'ticket_id': str(self.ticket.id), 'quantity': 2},
+                {'ticket_id': str(self.ticket.id), 'quantity': 3},
+            ]
+        }
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(OrderItem.objects.get().quantity, 5)
+        self.assertEqual(Order.objects.get().total_amount, 500.00)
+
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.quantity_sold, 5)
+
+    def test_create_order_is_all_or_nothing(self):
+        vip = Ticket.objects.create(event=self.event, type='vip', price=300.00, quantity_available=1)
+        url = reverse('orders:orders-list')
+        data = {
+            'items': [
+                {'ticket_id': str(self.ticket.id), 'quantity': 2},
+                {'ticket_id': str(vip.id), 'quantity': 2},
+            ]
+        }
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 0)
+
+        # The general tickets claimed before the VIP line failed are rolled back
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.quantity_sold, 0)
+
+
+class ShardedInventoryTests(APITestCase):
+    def setUp(self):
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Headline', description='D', date=timezone.now(), organizer=self.organizer)
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=10, quantity_sold=2)
+        with transaction.atomic():
+            self.ticket = enable_sharding(self.ticket, 3)
+        self.client.force_authenticate(user=self.attendee)
+
+    def buy(self, quantity):
+        return self.client.post(reverse('orders:orders-list'), {
+            'items': [{'ticket_id': str(self.ticket.id), 'quantity': quantity}]
+        }, format='json')
+
+    def sold(self):
+        return Ticket.objects.with_total_sold().get(id=self.ticket.id).total_sold
+
+    def test_remaining_stock_is_split_across_shards(self):
+        self.assertEqual(sorted(self.ticket.shards.values_list('capacity', flat=True)), [2, 3, 3])
+        self.assertEqual(self.sold(), 2)
+
+    def test_purchases_fill_shards_without_overselling(self):
+        # 8 seats left, the last 5-seat order has to be taken across shards
+        self.assertEqual(self.buy(3).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.buy(5).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.buy(1).status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.sold(), 10)
+        self.assertTrue(Ticket.objects.with_total_sold().get(id=self.ticket.id).is_sold_out)
+        self.assertEqual(self.ticket.shards.aggregate(total=Sum('quantity_sold'))['total'], 8)
+
+    def test_cancel_and_expiry_release_into_shards(self):
+        first = self.buy(4).data['id']
+        second = self.buy(3).data['id']
+
+        self.client.post(reverse('orders:orders-cancel', args=[first]))
+        self.assertEqual(self.sold(), 5)
+
+        Order.objects.filter(id=second).update(expires_at=timezone.now() - timedelta(minutes=1))
+        expire_pending_orders()
+        self.assertEqual(Order.objects.get(id=second).status, 'expired')
+        self.assertEqual(self.sold(), 2)
+
+    def test_turning_sharding_off_folds_sales_back(self):
+        self.buy(4)
+        with transaction.atomic():
+            ticket = enable_sharding(self.ticket, 0)
+        self.assertEqual(ticket.quantity_sold, 6)
+        self.assertFalse(ticket.shards.exists())
+
+    def test_ticket_api_reports_sharded_sell_out(self):
+        self.buy(8)
+        response = self.client.get(reverse('tickets:ticket-list'))
+        self.assertTrue(response.data['results'][0]['is_sold_out'])
+
+    def test_dashboard_counts_shard_sales(self):
+        self.buy(4)
+        self.client.force_login(self.organizer)
+        response = self.client.get(reverse('events:my_events'))
+        event = response.context['events'][0]
+        self.assertEqual(event.total_tickets_sold, 6)
+        self.assertEqual(event.revenue, 60)
+
+
+class OrderExpiryTests(APITestCase):
+    def setUp(self):
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Expiry', description='D', date=timezone.now(), organizer=self.organizer)
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=20, quantity_sold=6)
+
+    def hold(self, expires_in, quantity=1, status='pending'):
+        order = Order.objects.create(
+            attendee=self.attendee, total_amount=10 * quantity, status=status,
+            expires_at=timezone.now() + expires_in,
+        )
+        OrderItem.objects.create(order=order, ticket=self.ticket, quantity=quantity)
+        return order
+
+    def test_only_due_orders_are_released(self):
+        due = self.hold(timedelta(seconds=-1), quantity=2)
+        later = self.hold(timedelta(minutes=5), quantity=3)
+        paid = self.hold(timedelta(seconds=-1), status='paid')
+
+        self.assertEqual(expire_pending_orders()['orders'], 1)
+
+        self.assertEqual(Order.objects.get(id=due.id).status, 'expired')
+        self.assertEqual(Order.objects.get(id=later.id).status, 'pending')
+        self.assertEqual(Order.objects.get(id=paid.id).status, 'paid')
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.quantity_sold, 4)
+
+    def test_tick_drains_every_due_batch(self):
+        for _ in range(5):
+            self.hold(timedelta(seconds=-1))
+
+        stats = expire_pending_orders(batch_size=2)
+        self.assertEqual(stats['orders'], 5)
+        self.assertEqual(stats['batches'], 3)
+        # One inventory UPDATE per ticket type per batch, not per order
+        self.assertEqual(stats['ticket_updates'], 3)
+        self.assertFalse(Order.objects.filter(status='pending').exists())
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.quantity_sold, 1)
+
+    def test_batch_sums_quantities_per_ticket(self):
+        vip = Ticket.objects.create(event=self.event, type='vip', price=50, quantity_available=5, quantity_sold=5)
+        for quantity in (1, 2, 3):
+            order = self.hold(timedelta(seconds=-1), quantity=quantity)
+            OrderItem.objects.create(order=order, ticket=vip, quantity=1)
+
+        with self.assertNumQueries(7):
+            # savepoint, claim, order statuses, summed items, inventory (general + vip), release
+            stats = expire_pending_orders()
+        self.assertEqual(stats['ticket_updates'], 2)
+
+        self.ticket.refresh_from_db()
+        vip.refresh_from_db()
+        self.assertEqual(self.ticket.quantity_sold, 0)
+        self.assertEqual(vip.quantity_sold, 2)
+
+
+@override_settings(INVENTORY_GATE_ENABLED=True)
+class StockGateTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(
+            name='Flash Sale', description='D', date=timezone.now() + timedelta(days=1), organizer=self.organizer,
+        )
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=3)
+        self.client.force_authenticate(user=self.attendee)
+
+    def buy(self, quantity):
+        return self.client.post(reverse('orders:orders-list'), {
+            'items': [{'ticket_id': str(self.ticket.id), 'quantity': quantity}]
+        }, format='json')
+
+    def gate(self):
+        return cache.get(stock_gate.gate_key(self.ticket.id))
+
+    def test_claims_are_persisted_and_counted_down(self):
+        self.assertEqual(self.buy(2).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.gate(), 1)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.quantity_sold, 2)
+
+    def test_sold_out_checkout_never_reaches_the_database(self):
+        self.buy(3)
+        with self.assertNumQueries(0):
+            response = self.buy(1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.gate(), 0)
+
+    def test_failed_database_write_returns_the_claim(self):
+        # Gate thinks there is stock the database no longer has
+        Ticket.objects.filter(id=self.ticket.id).update(quantity_sold=3)
+        cache.set(stock_gate.gate_key(self.ticket.id), 3, None)
+
+        self.assertEqual(self.buy(1).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.gate(), 3)
+
+    def test_cancel_puts_seats_back_on_the_gate(self):
+        order_id = self.buy(2).data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('orders:orders-cancel', args=[order_id]))
+        self.assertEqual(self.gate(), 3)
+
+    def test_reconcile_repairs_drift(self):
+        self.buy(2)
+        cache.set(stock_gate.gate_key(self.ticket.id), 0, None)
+        self.assertEqual(reconcile_stock_gate(), 1)
+        self.assertEqual(self.gate(), 1)
+
+    def test_reconcile_undoes_a_crashed_claim(self):
+        # A worker that dies after claiming never commits or releases: a false sold out
+        stock_gate.claim({self.ticket.id: 3})
+        self.assertEqual(self.buy(1).status_code, status.HTTP_400_BAD_REQUEST)
+
+        reconcile_stock_gate()
+        self.assertEqual(self.buy(1).status_code, status.HTTP_201_CREATED)
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Retry', description='D', date=timezone.now(), organizer=self.organizer)
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=10)
+        self.client.force_authenticate(user=self.attendee)
+        self.url = reverse('orders:orders-list')
+
+    def buy(self, quantity, key):
+        return self.client.post(self.url, {
+            'items': [{'ticket_id': str(self.ticket.id), 'quantity': quantity}]
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.buy(2, 'retry-1')
+        second = self.buy(2, 'retry-1')
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.quantity_sold, 2)
+
+    def test_new_key_creates_a_new_order(self):
+        self.buy(1, 'a')
+        self.buy(1, 'b')
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_a_different_body_is_rejected(self):
+        self.buy(1, 'same')
+        response = self.buy(3, 'same')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_keys_are_scoped_per_user(self):
+        self.buy(1, 'shared')
+        other = CustomUser.objects.create_user(username='other', password='password', role='attendee')
+        self.client.force_authenticate(user=other)
+        self.assertNotIn('Idempotent-Replayed', self.buy(1, 'shared'))
+        self.assertEqual(Order.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_duplicate_in_flight_gets_conflict(self):
+        # Simulate the first request still running: its lock is held and no result stored yet
+        with patch('orders.idempotency.cache.add', return_value=False):
+            response = self.buy(1, 'in-flight')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class WaitingRoomTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.buyers = [
+            CustomUser.objects.create_user(username=f'buyer{i}', password='password', role='attendee') for i in range(3)
+        ]
+        self.event = Event.objects.create(
+            name='Headline', description='D', date=timezone.now() + timedelta(days=1),
+            organizer=self.organizer, admission_rate=1,
+        )
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=100)
+
+    def join(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('orders:queue_join', args=[self.event.id])).data
+
+    def buy(self, user, token=''):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('orders:orders-list'), {
+            'items': [{'ticket_id': str(self.ticket.id), 'quantity': 1}]
+        }, format='json', HTTP_X_ADMISSION_TOKEN=token)
+
+    def test_checkout_requires_admission_token(self):
+        response = self.buy(self.buyers[0])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Order.objects.count(), 0)
+
+    @patch('orders.admission.time.time', return_value=1_000_000.0)
+    def test_queue_admits_in_order_at_configured_rate(self, mock_time):
+        first, second = self.join(self.buyers[0]), self.join(self.buyers[1])
+
+        # One admission per second: the first buyer is in, the second waits behind them
+        self.assertTrue(first['admitted'])
+        self.client.force_authenticate(user=self.buyers[1])
+        status_response = self.client.get(reverse('orders:queue_status', args=[self.event.id]), {'token': second['token']})
+        self.assertFalse(status_response.data['admitted'])
+        self.assertEqual(status_response.data['ahead'], 0)
+
+        self.assertEqual(self.buy(self.buyers[0], first['admission_token']).status_code, status.HTTP_201_CREATED)
+
+    def test_retry_after_admission_is_not_replayed_a_denial(self):
+        buy = lambda token: self.client.post(reverse('orders:orders-list'), {
+            'items': [{'ticket_id': str(self.ticket.id), 'quantity': 1}]
+        }, format='json', HTTP_X_ADMISSION_TOKEN=token, HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        self.client.force_authenticate(user=self.buyers[0])
+        self.assertEqual(buy('').status_code, status.HTTP_403_FORBIDDEN)
+
+        token = self.join(self.buyers[0])['admission_token']
+        response = buy(token)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(WAITING_ROOM_MAX_STREAMS=1)
+    def test_queue_streams_are_capped(self):
+        token = self.join(self.buyers[0])['token']
+        url = reverse('orders:queue_stream', args=[self.event.id])
+        # Admitted straight away: one event, and the slot is given back
+        body = b''.join(self.client.get(url, {'token': token}).streaming_content).decode()
+        self.assertEqual(body.count('data: '), 1)
+        self.assertEqual(streams.open_streams('queue', 1), 0)
+
+        slot = streams.acquire_slot('queue', 1, 60)
+        body = b''.join(self.client.get(url, {'token': token}).streaming_content).decode()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertEqual(body.count('data: '), 1)
+        self.assertIsNotNone(cache.get(slot))
+
+    def test_admission_token_is_bound_to_the_buyer(self):
+        token = self.join(self.buyers[0])['admission_token']
+        self.assertEqual(self.buy(self.buyers[2], token).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_queue_token_cannot_be_reused_by_someone_else(self):
+        token = self.join(self.buyers[0])['token']
+        self.client.force_authenticate(user=self.buyers[1])
+        response = self.client.get(reverse('orders:queue_status', args=[self.event.id]), {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('orders.admission.time.time', return_value=1_000_000.0)
+    def test_idle_queue_does_not_bank_admissions(self, mock_time):
+        cache.set(admission._key(self.event.id, 'admitted'), 0, None)
+        self.assertEqual(admission.advance(self.event.id, 50), 0)
+
+    def test_events_without_waiting_room_sell_freely(self):
+        Event.objects.filter(id=self.event.id).update(admission_rate=None)
+        cache.clear()
+        self.assertEqual(self.buy(self.buyers[0]).status_code, status.HTTP_201_CREATED)
+
+
+
+class FulfillmentTests(APITestCase):
+    def setUp(self):
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', email='attendee@example.com')
+        self.event = Event.objects.create(
+            name='Fulfillment Gig', description='d', date=timezone.now(), venue='Hall', organizer=self.organizer,
+        )
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=100.00, quantity_available=10)
+        self.order = Order.objects.create(attendee=self.attendee, total_amount=200.00)
+        OrderItem.objects.create(order=self.order, ticket=self.ticket, quantity=2)
+        self.client.force_authenticate(user=self.attendee)
+
+    @patch('orders.tasks.start_fulfillment')
+    def test_callback_queues_fulfillment_after_commit(self, start):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(reverse('orders:mpesa_callback'), {
+                'OrderID': self.order.id, 'ResultCode': 0, 'Amount': '200.00',
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(callbacks), 1)
+        start.assert_called_once_with(self.order.id)
+        # Nothing is issued on the request path
+        self.assertFalse(IssuedTicket.objects.exists())
+        self.order.refresh_from_db()
+        self.assertIsNotNone(self.order.paid_at)
+        self.assertEqual((self.order.status, self.order.fulfillment_status), ('paid', 'queued'))
+
+    @patch('orders.tasks.start_fulfillment', side_effect=ConnectionError('broker down'))
+    def test_broker_outage_does_not_fail_payment(self, start):
+        with self.assertLogs('orders.fulfillment', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('orders:mpesa_callback'), {
+                'OrderID': self.order.id, 'ResultCode': 0, 'Amount': '200.00',
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Order.objects.get(id=self.order.id).fulfillment_status, 'queued')
+
+    def test_stages_are_idempotent(self):
+        Order.objects.filter(id=self.order.id).update(status='paid', fulfillment_status='queued')
+        issue_tickets(self.order)
+        issue_tickets(self.order)
+        self.assertEqual(self.order.issued_tickets.count(), 2)
+
+        notify_attendee(self.order)
+        notify_attendee(self.order)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Order.objects.get(id=self.order.id).fulfillment_status, 'notified')
+
+    def test_failed_notification_can_be_retried(self):
+        with patch('orders.fulfillment.send_confirmation', side_effect=OSError('smtp down')):
+            with self.assertRaises(OSError):
+                notify_attendee(self.order)
+        self.assertEqual(Order.objects.get(id=self.order.id).fulfillment_status, 'issued')
+
+        notify_attendee(self.order)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_bulk_issuance_for_many_orders(self):
+        orders = [self.order] + [Order.objects.create(attendee=self.attendee, total_amount=0) for _ in range(3)]
+        for order in orders[1:]:
+            OrderItem.objects.create(order=order, ticket=self.ticket, quantity=3)
+
+        # Savepoint, lock, two reads, one INSERT, status update, release
+        with self.assertNumQueries(7):
+            created = issue_tickets_bulk(orders)
+        self.assertEqual(len(created), 11)
+        # Re-running issues nothing new
+        self.assertEqual(issue_tickets_bulk(orders), [])
+        self.assertEqual(IssuedTicket.objects.count(), 11)
+
+    @patch('orders.tasks.start_fulfillment')
+    def test_stalled_orders_are_requeued(self, start):
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Order.objects.filter(id=self.order.id).update(status='paid', fulfillment_status='issued', paid_at=an_hour_ago)
+        # Recently paid, however long ago it was placed: its pipeline may still be running
+        recent = Order.objects.create(
+            attendee=self.attendee, total_amount=0, status='paid', fulfillment_status='queued', paid_at=timezone.now(),
+        )
+        Order.objects.filter(id=recent.id).update(created_at=an_hour_ago)
+        Order.objects.create(attendee=self.attendee, total_amount=0, status='paid', fulfillment_status='notified')
+
+        self.assertEqual(resume_fulfillments(), 1)
+        start.assert_called_once_with(self.order.id)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs row-level locking to run buyers concurrently')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_concurrent_buyers_never_oversell(self):
+        ticket, attendees = seed_ticket(stock=25, buyers=8, label='concurrency')
+        operation = checkout_operation('guarded', ticket, attendees)
+
+        elapsed, latencies, outcomes = run_concurrently(operation, workers=8, operations=60)
+
+        self.assertEqual(outcomes, {'succeeded': 25, 'rejected': 35, 'errors': 0})
+        report = inventory_report(ticket)
+        self.assertFalse(report['oversold'])
+        self.assertTrue(report['consistent'])
+        self.assertEqual(report['quantity_sold'], 25)
+
+    def test_both_strategies_sell_every_seat(self):
+        # Throughput is compared by the bench_checkout command, not here
+        for strategy in ('legacy', 'guarded'):
+            ticket, attendees = seed_ticket(stock=400, buyers=8, label=strategy)
+            elapsed, latencies, outcomes = run_concurrently(
+                checkout_operation(strategy, ticket, attendees), workers=8, operations=400,
+            )
+            self.assertEqual(outcomes['succeeded'], 400)
+            self.assertFalse(inventory_report(ticket)['oversold'])
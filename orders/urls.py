@@ -8,6 +8,9 @@ from .views import (
     StripeWebhookView,
     MpesaPaymentView, 
     MpesaCallbackView,
+    QueueJoinView,
+    QueueStatusView,
+    QueueStreamView,
     order_history,
     cancel_order
 )
@@ -26,6 +29,9 @@ urlpatterns = [
     path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe_webhook'),
     path('mpesa/pay/', MpesaPaymentView.as_view(), name='mpesa_pay'),
     path('mpesa/callback/', MpesaCallbackView.as_view(), name='mpesa_callback'),
+    path('queue/<int:event_id>/', QueueJoinView.as_view(), name='queue_join'),
+    path('queue/<int:event_id>/status/', QueueStatusView.as_view(), name='queue_status'),
+    path('queue/<int:event_id>/stream/', QueueStreamView.as_view(), name='queue_stream'),
 ]
 
 # Include router URLs for OrderViewSet
@@ -1,25 +1,28 @@
 import stripe
 import requests
 import base64
-from io import BytesIO
+import json
+import time
 from decimal import Decimal
 
 from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
-from django.core.files.base import ContentFile
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
+from core import streams
+
 from .models import Order, Transaction
-from tickets.models import Ticket, IssuedTicket
+from .inventory import release_order
+from . import admission
+from .idempotency import idempotent
+from .fulfillment import queue_fulfillment
 from .serializers import OrderSerializer, TransactionSerializer
-from django.core.mail import send_mail
-
-import qrcode
 
 # ----------------------------
 # Stripe Setup
@@ -85,17 +88,8 @@ def cancel_order(request, order_id):
     
     if order.status == 'pending':
         with transaction.atomic():
-            order.status = 'cancelled'
-            order.save()
-            
-            # Restore inventory
-            for item in order.orderitem_set.all():
-                ticket = item.ticket
-                # Lock ticket for update
-                ticket = Ticket.objects.select_for_update().get(id=ticket.id)
-                if ticket.quantity_sold >= item.quantity:
-                    ticket.quantity_sold -= item.quantity
-                    ticket.save()
+            # Flips the status and restores inventory
+            release_order(order, 'cancelled')
         
         messages.success(request, f"Order #{str(order.id)[:8]} has been cancelled.")
     elif order.status == 'paid':
@@ -103,52 +97,6 @@ def cancel_order(request, order_id):
     
     return redirect('orders:history')
 
-# ----------------------------
-# QR Code Generator
-# ----------------------------
-def generate_qr(issued_ticket):
-    """Generate a QR code for an issued ticket"""
-    qr = qrcode.QRCode(box_size=10, border=4)
-    qr.add_data(str(issued_ticket.id))  # Use the issued ticket UUID
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    issued_ticket.qr_code.save(f"{issued_ticket.id}.png", ContentFile(buffer.getvalue()))
-    issued_ticket.save()
-
-def send_confirmation(order):
-    send_mail(
-        'Ticket Purchase Confirmation',
-        f'Your order {order.id} is confirmed. Event: {order.tickets.first().event.name}',
-        'from@example.com',
-        [order.attendee.email],
-        fail_silently=False,
-    )
-
-def fulfill_order(order):
-    """Create issued tickets and generate QR codes"""
-    # Update order status
-    if order.status != 'paid':
-        order.status = 'paid'
-        order.save()
-
-    # Avoid duplicate fulfillment
-    if order.issued_tickets.exists():
-        return
-
-    for item in order.orderitem_set.all():
-        for _ in range(item.quantity):
-            issued_ticket = IssuedTicket.objects.create(
-                ticket=item.ticket,
-                order=order
-            )
-            generate_qr(issued_ticket)
-    
-    send_confirmation(order)
-
-
-    
 # ----------------------------
 # Order ViewSet
 # ----------------------------
@@ -156,6 +104,22 @@ class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('created_at', 'id')
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # Events with a waiting room only sell to buyers holding an admission token
+        ticket_ids = [item['ticket_id'] for item in serializer.validated_data['items']]
+        denied = admission.check_admission(request, admission.events_for_tickets(ticket_ids))
+        if denied:
+            return denied
+
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def perform_create(self, serializer):
         order = serializer.save(attendee=self.request.user)
@@ -170,17 +134,10 @@ class OrderViewSet(viewsets.ModelViewSet):
         # Only allow cancelling pending orders automatically for now
         if order.status == 'pending':
             with transaction.atomic():
-                order.status = 'cancelled'
-                order.save()
-                
-                # Restore inventory
-                for item in order.orderitem_set.all():
-                    ticket = item.ticket
-                    # Lock ticket
-                    ticket = Ticket.objects.select_for_update().get(id=ticket.id)
-                    ticket.quantity_sold -= item.quantity
-                    ticket.save()
-                    
+                cancelled = release_order(order, 'cancelled')
+
+            if not cancelled:
+                return Response({'error': 'Order is no longer pending'}, status=status.HTTP_400_BAD_REQUEST)
             return Response({'status': 'cancelled'})
         
         return Response({'error': 'Cannot cancel paid orders automatically'}, status=status.HTTP_400_BAD_REQUEST)
@@ -191,6 +148,7 @@ class OrderViewSet(viewsets.ModelViewSet):
 class StripeCheckoutView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         order_id = request.data.get("order_id")
         try:
@@ -198,6 +156,10 @@ class StripeCheckoutView(APIView):
         except Order.DoesNotExist:
             return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
+        denied = admission.check_admission(request, set(order.orderitem_set.values_list('ticket__event_id', flat=True)))
+        if denied:
+            return denied
+
         session = stripe.checkout.Session.create(
             payment_method_types=['card'],
             line_items=[{
@@ -252,19 +214,24 @@ class StripePaymentConfirmView(APIView):
             Transaction.objects.filter(order=order, payment_method="Stripe").update(status="FAILED")
             return Response({"error": "Amount mismatch"}, status=400)
 
-        if order.status != 'pending':
-            return Response({"error": "Order not pending"}, status=400)
-
         with transaction.atomic():
+            order = Order.objects.select_for_update().get(id=order.id)
+            if order.status != 'pending':
+                return Response({"error": "Order not pending"}, status=400)
+
             Transaction.objects.filter(order=order, payment_method="Stripe").update(
                 status="COMPLETED",
                 payment_id=session.get("id"),
                 external_response=session,
             )
 
-            fulfill_order(order)
+            # Tickets are issued by the fulfillment tasks once this commits
+            queue_fulfillment(order)
 
-        return Response({"message": "Payment confirmed, QR codes generated"})
+        return Response({
+            "message": "Payment confirmed, your tickets are being issued",
+            "fulfillment_status": order.fulfillment_status,
+        })
 
 # ----------------------------
 # Stripe Webhook (Secure)
@@ -308,31 +275,31 @@ class StripeWebhookView(APIView):
         if not order_id:
             return
 
-        try:
-            order = Order.objects.select_for_update().get(id=order_id)
-        except Order.DoesNotExist:
-            return
+        with transaction.atomic():
+            try:
+                order = Order.objects.select_for_update().get(id=order_id)
+            except Order.DoesNotExist:
+                return
 
-        amount_total = session.get("amount_total")
-        if amount_total is None:
-            return
+            amount_total = session.get("amount_total")
+            if amount_total is None:
+                return
 
-        expected_amount = int(order.total_amount * 100)
-        if amount_total != expected_amount:
-            Transaction.objects.filter(order=order, payment_method="Stripe").update(status="FAILED")
-            return
+            expected_amount = int(order.total_amount * 100)
+            if amount_total != expected_amount:
+                Transaction.objects.filter(order=order, payment_method="Stripe").update(status="FAILED")
+                return
 
-        if order.status != 'pending':
-            return
+            if order.status != 'pending':
+                return
 
-        with transaction.atomic():
             Transaction.objects.filter(order=order, payment_method="Stripe").update(
                 status="COMPLETED",
                 payment_id=session.get("id"),
                 external_response=session,
             )
 
-            fulfill_order(order)
+            queue_fulfillment(order)
 
 # ----------------------------
 # M-Pesa Payment View
@@ -340,6 +307,7 @@ class StripeWebhookView(APIView):
 class MpesaPaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         order_id = request.data.get("order_id")
         phone_number = request.data.get("phone_number")
@@ -352,6 +320,10 @@ class MpesaPaymentView(APIView):
         except Order.DoesNotExist:
             return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
+        denied = admission.check_admission(request, set(order.orderitem_set.values_list('ticket__event_id', flat=True)))
+        if denied:
+            return denied
+
         mpesa_response = initiate_stk_push(
             phone_number=phone_number,
             amount=order.total_amount,
@@ -388,7 +360,7 @@ class MpesaCallbackView(APIView):
             return Response({"error": "Invalid callback data"}, status=400)
 
         try:
-            order = Order.objects.select_for_update().get(id=order_id)
+            order = Order.objects.get(id=order_id)
         except Order.DoesNotExist:
             return Response({"error": "Order not found"}, status=404)
 
@@ -405,15 +377,80 @@ class MpesaCallbackView(APIView):
             Transaction.objects.filter(order=order, payment_method="M-Pesa").update(status="FAILED")
             return Response({"error": "Amount mismatch"}, status=400)
 
-        if order.status != 'pending':
-            return Response({"error": "Order not pending"}, status=400)
-
         with transaction.atomic():
+            # Lock only for the status flip; the slow fulfillment work runs after commit
+            order = Order.objects.select_for_update().get(id=order.id)
+            if order.status != 'pending':
+                return Response({"error": "Order not pending"}, status=400)
+
             Transaction.objects.filter(order=order, payment_method="M-Pesa").update(
                 status="COMPLETED",
                 external_response=data,
             )
 
-            fulfill_order(order)
+            queue_fulfillment(order)
 
         return Response({"status": "success"})
+
+
+# ----------------------------
+# Waiting Room
+# ----------------------------
+class QueueJoinView(APIView):
+    """Join the waiting room for an event. Returns a queue token to poll with."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, event_id):
+        if not admission.get_admission_rate(event_id):
+            return Response({"error": "This event has no waiting room"}, status=status.HTTP_404_NOT_FOUND)
+
+        token = admission.join(event_id, request.user.id)
+        position = admission.read_queue_token(token, event_id, request.user.id)
+        return Response({"token": token, **admission.queue_status(event_id, request.user.id, position)})
+
+
+class QueueStatusView(APIView):
+    """Poll queue position: GET /orders/queue/<event_id>/status/?token=..."""
+    permission_classes = [IsAuthenticated]
+    throttle_classes = []  # Polling is the point; it only touches the cache
+
+    def get(self, request, event_id):
+        position = admission.read_queue_token(request.query_params.get('token', ''), event_id, request.user.id)
+        if position is None:
+            return Response({"error": "Invalid queue token"}, status=status.HTTP_400_BAD_REQUEST)
+        result = admission.queue_status(event_id, request.user.id, position)
+        headers = {} if result['admitted'] else {'Retry-After': str(settings.WAITING_ROOM_POLL_SECONDS)}
+        return Response(result, headers=headers)
+
+
+class QueueStreamView(QueueStatusView):
+    """Same as QueueStatusView, pushed as server-sent events until admitted"""
+
+    def get(self, request, event_id):
+        position = admission.read_queue_token(request.query_params.get('token', ''), event_id, request.user.id)
+        if position is None:
+            return Response({"error": "Invalid queue token"}, status=status.HTTP_400_BAD_REQUEST)
+
+        def events():
+            # Bounded so a waiting buyer doesn't pin a worker; EventSource reconnects on its own
+            deadline = time.monotonic() + settings.WAITING_ROOM_STREAM_SECONDS
+            while True:
+                result = admission.queue_status(event_id, request.user.id, position)
+                yield f"data: {json.dumps(result)}\n\n"
+                if result['admitted'] or time.monotonic() >= deadline:
+                    return
+                time.sleep(settings.WAITING_ROOM_POLL_SECONDS)
+
+        def busy():
+            # Too many streams open: one update, and the browser polls by reconnecting
+            yield f"retry: {settings.WAITING_ROOM_POLL_SECONDS * 1000}\n\n"
+            yield f"data: {json.dumps(admission.queue_status(event_id, request.user.id, position))}\n\n"
+
+        response = StreamingHttpResponse(
+            streams.bounded('queue', settings.WAITING_ROOM_MAX_STREAMS, settings.WAITING_ROOM_STREAM_SECONDS,
+                            events, busy),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -0,0 +1,144 @@
+"""
+Live check-in counts per event and ticket type, kept in the cache.
+
+Every redemption path calls record(), so organizer dashboards read a handful
+of cache keys instead of counting IssuedTickets. An event's counters are seeded
+from the database the first time they are read, and rebuilt by the
+rebuild_redemptions command. The version key goes up on every change; stream()
+uses it to push only what changed.
+
+A rebuild counts the tickets redeemed in the database plus the fast-path
+redemptions still in the write-behind log. A redemption recorded while a
+rebuild runs can still be missed, so the reconcile_checkins task rebuilds the
+counters of events being scanned every CHECKIN_RECONCILE_SECONDS.
+"""
+import json
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import redemption_store
+from .models import IssuedTicket, Ticket
+
+TYPES = [choice for choice, _ in Ticket.TYPE_CHOICES]
+TOTAL = 'all'
+
+
+def counter_key(event_id, ticket_type):
+    return f'checkins_{event_id}_{ticket_type}'
+
+
+def version_key(event_id):
+    return f'checkins_version_{event_id}'
+
+
+def loaded_key(event_id):
+    return f'checkins_loaded_{event_id}'
+
+
+def rebuild(event_id, pending=None):
+    """
+    Recount an event's check-ins from the database and the redemptions still
+    waiting to be written there (`pending` ticket ids, read from the log if None).
+    Leaves the counters, and their version, alone when they are right already.
+    """
+    if pending is None:
+        pending = redemption_store.pending_tickets().get(event_id, ()) if redemption_store.enabled() else ()
+    # One query, so a ticket the flush writes meanwhile is counted once either way
+    redeemed = Q(is_redeemed=True) | Q(id__in=pending) if pending else Q(is_redeemed=True)
+    counts = dict(
+        IssuedTicket.objects.filter(redeemed, ticket__event_id=event_id)
+        .values_list('ticket__type').annotate(count=Count('id')).order_by()
+    )
+    values = {counter_key(event_id, ticket_type): counts.get(ticket_type, 0) for ticket_type in TYPES}
+    values[counter_key(event_id, TOTAL)] = sum(counts.values())
+    current = cache.get_many([*values, loaded_key(event_id)])
+    if current.pop(loaded_key(event_id), None) is not None and current == values:
+        return values[counter_key(event_id, TOTAL)]
+    cache.set_many(values, None)
+    cache.add(version_key(event_id), 0, None)
+    cache.incr(version_key(event_id))
+    cache.set(loaded_key(event_id), 1, None)
+    return values[counter_key(event_id, TOTAL)]
+
+
+def record(event_id, ticket_types):
+    """
+    Count newly redeemed tickets of `ticket_types`, which must be in the
+    database or the write-behind log already, so seeding the counters later counts them.
+    """
+    counts = Counter(ticket_types)
+    if not counts:
+        return
+    if cache.get(loaded_key(event_id)) is None:
+        return
+    try:
+        for ticket_type, count in counts.items():
+            if ticket_type in TYPES:
+                cache.incr(counter_key(event_id, ticket_type), count)
+        cache.incr(counter_key(event_id, TOTAL), sum(counts.values()))
+        cache.incr(version_key(event_id))
+    except ValueError:
+        # A counter was evicted: start again from the database
+        rebuild(event_id)
+
+
+def snapshot(event_id):
+    """The event's check-in counts: version, checked_in and by_type"""
+    if cache.get(loaded_key(event_id)) is None:
+        rebuild(event_id)
+    keys = [version_key(event_id), counter_key(event_id, TOTAL)] + [counter_key(event_id, t) for t in TYPES]
+    values = cache.get_many(keys)
+    return {
+        'event_id': event_id,
+        'version': values.get(keys[0], 0),
+        'checked_in': values.get(keys[1], 0),
+        'by_type': {ticket_type: values.get(counter_key(event_id, ticket_type), 0) for ticket_type in TYPES},
+    }
+
+
+def message(event, data, message_id=None):
+    """One server-sent event"""
+    lines = [f'event: {event}']
+    if message_id is not None:
+        lines.append(f'id: {message_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(event_id, interval=None, duration=None):
+    """
+    Server-sent events for a dashboard: a snapshot, then a delta whenever the
+    counts change. Polls the cache only; ends after `duration` seconds and the
+    browser's EventSource reconnects.
+    """
+    interval = settings.CHECKIN_STREAM_INTERVAL_SECONDS if interval is None else interval
+    duration = settings.CHECKIN_STREAM_MAX_SECONDS if duration is None else duration
+    deadline = time.monotonic() + duration
+    last = snapshot(event_id)
+    last_sent = time.monotonic()
+    yield f'retry: {int(settings.CHECKIN_STREAM_RETRY_SECONDS * 1000)}\n\n'
+    yield message('snapshot', last, last['version'])
+
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        current = snapshot(event_id)
+        if current['version'] != last['version']:
+            yield message('delta', {
+                'version': current['version'],
+                'checked_in': current['checked_in'],
+                'added': current['checked_in'] - last['checked_in'],
+                'by_type': {
+                    ticket_type: count - last['by_type'][ticket_type]
+                    for ticket_type, count in current['by_type'].items()
+                    if count != last['by_type'][ticket_type]
+                },
+            }, current['version'])
+            last, last_sent = current, time.monotonic()
+        elif time.monotonic() - last_sent >= settings.CHECKIN_STREAM_KEEPALIVE_SECONDS:
+            # Comment line, so proxies don't drop an idle connection
+            yield ': keepalive\n\n'
+            last_sent = time.monotonic()
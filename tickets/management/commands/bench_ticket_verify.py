@@ -0,0 +1,49 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from tickets import signing
+
+
+class Command(BaseCommand):
+    help = 'Benchmark offline verification of signed ticket payloads on one core'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verifications', type=int, default=200000)
+        parser.add_argument('--tickets', type=int, default=10000, help='Distinct payloads to cycle through')
+        parser.add_argument('--events', type=int, default=10)
+
+    def handle(self, *args, **options):
+        # What a scanner holds: one key per event, nothing else
+        keys = {(event_id, 1): signing.event_key(event_id, 1) for event_id in range(1, options['events'] + 1)}
+        expires = time.time() + 3600
+        payloads = [
+            signing.encode(keys[event_id, 1], uuid.uuid4(), event_id, 1, 'general', expires)
+            for event_id in (i % options['events'] + 1 for i in range(options['tickets']))
+        ]
+        verifier = signing.Verifier(keys)
+        now = time.time()
+
+        count = options['verifications']
+        verify = verifier.verify
+        started = time.perf_counter()
+        for i in range(count):
+            verify(payloads[i % len(payloads)], now)
+        elapsed = time.perf_counter() - started
+
+        tampered = payloads[0][:10] + ('A' if payloads[0][10] != 'A' else 'B') + payloads[0][11:]
+        try:
+            verify(tampered, now)
+            rejected = False
+        except signing.InvalidTicket:
+            rejected = True
+
+        self.stdout.write(
+            f"{count} verifications in {elapsed:.2f}s: {count / elapsed:,.0f}/sec on one core "
+            f"({elapsed / count * 1e6:.1f}us each, payload {len(payloads[0])} chars)"
+        )
+        if rejected:
+            self.stdout.write(self.style.SUCCESS('Tampered payload rejected'))
+        else:
+            self.stdout.write(self.style.ERROR('Tampered payload was accepted'))
@@ -0,0 +1,93 @@
+import contextlib
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from orders.benchmarks import seed_ticket
+from orders.fulfillment import issue_tickets_bulk
+from orders.models import Order, OrderItem
+from tickets import redemption_store, signing
+from tickets.models import IssuedTicket
+from tickets.views import IssuedTicketViewSet
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark gate throughput: one validate request per scan, validate_batch, '
+        'and validate_batch on the cache-side fast path'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=5000, help='Tickets to scan (each scanned once)')
+        parser.add_argument('--batch', type=int, default=250, help='Scans per validate_batch request')
+        parser.add_argument('--duplicates', type=float, default=0.02, help='Share of scans that are re-scans')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        # Pass the @action options along, as the router does
+        single = IssuedTicketViewSet.as_view({'post': 'validate'}, **IssuedTicketViewSet.validate.kwargs)
+        batch = IssuedTicketViewSet.as_view({'post': 'validate_batch'}, **IssuedTicketViewSet.validate_batch.kwargs)
+
+        for mode in ('single', 'batch', 'fast'):
+            issued, organizer, cleanup = self.seed(options['tickets'])
+            scans = [signing.sign_ticket(ticket) for ticket in issued]
+            # A few attendees scan twice; those must be turned away
+            scans += scans[:int(len(scans) * options['duplicates'])]
+
+            fast = override_settings(
+                REDEMPTION_FAST_PATH_ENABLED=True, CACHES=self.uncapped_caches(),
+            ) if mode == 'fast' else contextlib.nullcontext()
+            with fast, CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                if mode == 'single':
+                    for ticket in issued + issued[:len(scans) - len(issued)]:
+                        request = factory.post(f'/tickets/api/issued_tickets/{ticket.id}/validate/')
+                        force_authenticate(request, user=organizer)
+                        single(request, pk=str(ticket.id))
+                else:
+                    for start in range(0, len(scans), options['batch']):
+                        request = factory.post('/tickets/api/issued_tickets/validate_batch/', {
+                            'scans': scans[start:start + options['batch']],
+                        }, format='json')
+                        force_authenticate(request, user=organizer)
+                        batch(request)
+                elapsed = time.perf_counter() - started
+
+                flush_note = ''
+                if mode == 'fast':
+                    started = time.perf_counter()
+                    redemption_store.flush()
+                    flush_note = f', written behind in {time.perf_counter() - started:.2f}s'
+            redeemed = IssuedTicket.objects.filter(id__in=[ticket.id for ticket in issued], is_redeemed=True).count()
+            self.stdout.write(
+                f"{mode:>6}: {len(scans)} scans in {elapsed:.2f}s ({len(scans) / elapsed:,.0f} scans/sec, "
+                f"{len(queries) / len(scans):.2f} queries/scan), {redeemed}/{len(issued)} redeemed{flush_note}"
+            )
+            cleanup()
+
+    def uncapped_caches(self):
+        """The local-memory cache culls at 300 entries, which would evict redemption marks mid-run"""
+        caches = {alias: dict(config) for alias, config in settings.CACHES.items()}
+        if caches['default']['BACKEND'].endswith('LocMemCache'):
+            caches['default']['OPTIONS'] = {**caches['default'].get('OPTIONS', {}), 'MAX_ENTRIES': 10 ** 7}
+        return caches
+
+    def seed(self, count):
+        ticket, attendees = seed_ticket(count, 1, label='gate')
+        order = Order.objects.create(attendee=attendees[0], total_amount=0, status='paid')
+        OrderItem.objects.create(order=order, ticket=ticket, quantity=count)
+        issue_tickets_bulk([order])
+        issued = list(IssuedTicket.objects.filter(order=order).select_related('ticket__event'))
+        organizer = ticket.event.organizer
+
+        def cleanup():
+            organizer.delete()
+            CustomUser.objects.filter(pk__in=[attendee.pk for attendee in attendees]).delete()
+
+        return issued, organizer, cleanup
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tickets import qr_cache
+from tickets.models import IssuedTicket
+
+
+class Command(BaseCommand):
+    help = (
+        'Manage ticket QR codes now that they are rendered on request: pre-render them into the cache '
+        '(--warm) and delete the PNG files fulfillment used to store (--cleanup)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warm', action='store_true', help='Pre-render QR images into the cache')
+        parser.add_argument('--event', type=int, help='Only warm tickets for this event (default: upcoming events)')
+        parser.add_argument('--format', choices=list(qr_cache.CONTENT_TYPES), default='png')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Render processes (default: QR_RENDER_WORKERS, 0 = one per CPU)')
+        parser.add_argument('--cleanup', action='store_true', help='Delete stored QR files and clear qr_code')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report what --cleanup would delete')
+
+    def handle(self, *args, **options):
+        if not options['warm'] and not options['cleanup']:
+            raise CommandError('Pass --warm, --cleanup or both')
+        if options['warm']:
+            self.warm(options)
+        if options['cleanup']:
+            self.cleanup(options)
+
+    def warm(self, options):
+        # The payload is signed with the event's key: load both with the ticket
+        tickets = IssuedTicket.objects.filter(is_redeemed=False).select_related('ticket__event')
+        if options['event']:
+            tickets = tickets.filter(ticket__event_id=options['event'])
+        else:
+            tickets = tickets.filter(ticket__event__date__gte=timezone.now())
+        rendered = qr_cache.warm(
+            list(tickets.iterator(chunk_size=options['batch_size'])),
+            options['format'], options['workers'], options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} {options["format"]} QR codes into the cache'))
+
+    def cleanup(self, options):
+        stored = IssuedTicket.objects.exclude(qr_code='').exclude(qr_code__isnull=True)
+        deleted = 0
+        while True:
+            batch = list(stored.values_list('id', 'qr_code')[:options['batch_size']])
+            if not batch:
+                break
+            if options['dry_run']:
+                deleted = stored.count()
+                break
+            storage = IssuedTicket._meta.get_field('qr_code').storage
+            for _, name in batch:
+                # Missing files are fine; the point is that none are left
+                storage.delete(name)
+            deleted += IssuedTicket.objects.filter(id__in=[pk for pk, _ in batch]).update(qr_code='')
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} stored QR files'))
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events.models import Event
+from tickets import checkins, redemption_store
+
+
+class Command(BaseCommand):
+    help = (
+        'Recreate the fast-path redemption marks and live check-in counts from the database, e.g. after '
+        'the cache was flushed or failed over. Pending redemptions are written to the database first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help='Event to rebuild (default: events from yesterday on)')
+
+    def handle(self, *args, **options):
+        flushed = redemption_store.flush()
+        self.stdout.write(f'Flushed {flushed} pending redemptions ({redemption_store.pending()} still pending)')
+
+        event_ids = options['event'] or Event.objects.filter(
+            date__gte=timezone.now() - timedelta(days=1),
+        ).values_list('id', flat=True)
+        for event_id in event_ids:
+            count = redemption_store.rebuild(event_id)
+            checkins.rebuild(event_id)
+            self.stdout.write(f'Event {event_id}: {count} redeemed tickets marked')
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TicketShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('capacity', models.PositiveIntegerField()),
+                ('quantity_sold', models.PositiveIntegerField(default=0)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='tickets.ticket')),
+            ],
+            options={
+                'unique_together': {('ticket', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-17 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_fulfillment_status_without_rendered'),
+        ('tickets', '0002_ticket_shard_count_ticketshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuedticket',
+            name='redeemed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='issuedticket',
+            index=models.Index(fields=['ticket', 'created_at'], name='tickets_iss_ticket__eb0d94_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedticket',
+            index=models.Index(fields=['ticket', 'redeemed_at'], name='tickets_iss_ticket__a0741b_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_orders_orde_created_0fb29d_idx'),
+        ('tickets', '0003_issuedticket_redeemed_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='issuedticket',
+            index=models.Index(fields=['created_at', 'id'], name='tickets_iss_created_11ae70_idx'),
+        ),
+    ]
@@ -1,8 +1,18 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from events.models import Event
 import uuid
 
 
+class TicketQuerySet(models.QuerySet):
+    def with_total_sold(self):
+        """Annotate shard_sold so total_sold/is_sold_out don't query per ticket"""
+        return self.annotate(shard_sold=shard_sales(ticket=OuterRef('pk')))
+
+
 class Ticket(models.Model):
     TYPE_CHOICES = (
         ('general', 'General'),
@@ -21,10 +31,14 @@ class Ticket(models.Model):
 
     quantity_available = models.PositiveIntegerField()
     quantity_sold = models.PositiveIntegerField(default=0)
+    # 0 = every sale updates quantity_sold; N = sales are spread over N TicketShard rows
+    shard_count = models.PositiveSmallIntegerField(default=0)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TicketQuerySet.as_manager()
+
     class Meta:
         unique_together = ('event', 'type')
         ordering = ['event', 'type']
@@ -32,9 +46,48 @@ class Ticket(models.Model):
     def __str__(self):
         return f"{self.event.name} - {self.type}"
 
+    @property
+    def total_sold(self):
+        """quantity_sold plus whatever was sold through shards"""
+        if not self.shard_count:
+            return self.quantity_sold
+        shard_sold = getattr(self, 'shard_sold', None)
+        if shard_sold is None:
+            cache_key = f'ticket_shard_sold_{self.id}'
+            shard_sold = cache.get(cache_key)
+            if shard_sold is None:
+                shard_sold = self.shards.aggregate(total=Sum('quantity_sold'))['total'] or 0
+                if settings.INVENTORY_SHARD_CACHE_SECONDS:
+                    cache.set(cache_key, shard_sold, settings.INVENTORY_SHARD_CACHE_SECONDS)
+        return self.quantity_sold + shard_sold
+
     @property
     def is_sold_out(self):
-        return self.quantity_sold >= self.quantity_available
+        return self.total_sold >= self.quantity_available
+
+
+class TicketShard(models.Model):
+    """A slice of a ticket's remaining stock, so concurrent buyers don't all queue on the Ticket row"""
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    capacity = models.PositiveIntegerField()
+    quantity_sold = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('ticket', 'index')
+
+    def __str__(self):
+        return f"{self.ticket} #{self.index}"
+
+
+def shard_sales(amount=F('quantity_sold'), output_field=None, **filters):
+    """
+    Subquery summing `amount` over the shards matching `filters`,
+    e.g. shard_sales(ticket__event=OuterRef('pk')) inside an Event annotation.
+    """
+    shards = TicketShard.objects.filter(**filters).order_by().annotate(group=models.Value(1))
+    totals = shards.values('group').annotate(total=Sum(amount, output_field=output_field)).values('total')
+    return Coalesce(Subquery(totals, output_field=output_field), 0, output_field=output_field)
 
 
 class IssuedTicket(models.Model):
@@ -43,9 +96,17 @@ class IssuedTicket(models.Model):
     order = models.ForeignKey('orders.Order', on_delete=models.CASCADE, related_name='issued_tickets')
     qr_code = models.ImageField(upload_to='ticket_qr/', blank=True, null=True)
     is_redeemed = models.BooleanField(default=False)
+    redeemed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
+        # Scanner manifest deltas read an event's tickets issued or redeemed since a version
+        indexes = [
+            models.Index(fields=['ticket', 'created_at']),
+            models.Index(fields=['ticket', 'redeemed_at']),
+            # The API pages through issued tickets in (created_at, id) order (core.pagination)
+            models.Index(fields=['created_at', 'id']),
+        ]
         permissions = [
             ("can_scan_tickets", "Can scan tickets"),
         ]
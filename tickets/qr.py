@@ -0,0 +1,77 @@
+"""
+QR code rendering (PNG and compact SVG). Nothing here imports Django, so worker
+processes spawned to render large batches start without setting up the project.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import qrcode
+
+
+def render_png(data):
+    """Render `data` as a QR code and return the PNG bytes"""
+    qr = qrcode.QRCode(box_size=10, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_svg(data):
+    """
+    Render `data` as a QR code and return SVG bytes. Each run of dark modules in
+    a row is one stroked segment, which keeps the markup a fraction of the size
+    of one rectangle per module.
+    """
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    segments = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                segments.append(f'M{start} {y}.5h{x - start}')
+            else:
+                x += 1
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/>'
+        f'<path stroke="#000" d="{"".join(segments)}"/></svg>'
+    ).encode()
+
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg,
+}
+
+
+def _render(job):
+    return RENDERERS[job[1]](job[0])
+
+
+def render_many(values, workers=1, fmt='png'):
+    """
+    Yield the image for each of `values`, in order. With workers > 1 the images
+    are rendered in a pool of that many processes (0 means one per CPU).
+    """
+    jobs = [(value, fmt) for value in values]
+    workers = workers or os.cpu_count() or 1
+    # Daemonic processes (e.g. multiprocessing pool workers) can't start a pool of their own
+    if workers == 1 or len(jobs) < 2 or multiprocessing.current_process().daemon:
+        yield from map(_render, jobs)
+        return
+
+    # spawn, not fork: the caller may hold database connections and threads
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        yield from pool.map(_render, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
@@ -0,0 +1,76 @@
+"""
+Ticket QR images, rendered on request and cached instead of stored as files.
+
+A process-local LRU sits in front of the shared cache, so a hot image costs
+neither a render nor a cache round trip. The image is a pure function of the
+ticket's payload, which makes its digest a strong ETag and, in the URL, a
+version that lets browsers keep the image for good.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import qr, signing
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def payload(issued_ticket):
+    """What a ticket's QR code encodes: its signed payload"""
+    return signing.sign_ticket(issued_ticket)
+
+
+def _digest(payload, fmt):
+    return hashlib.sha256(f'{fmt}:{payload}'.encode()).hexdigest()[:32]
+
+
+def version(payload, fmt):
+    """Changes whenever the image does (e.g. a key rotation); versioned URLs carry it as ?v="""
+    return _digest(payload, fmt)[:16]
+
+
+def etag(payload, fmt):
+    return f'"{_digest(payload, fmt)}"'
+
+
+def cache_key(payload, fmt):
+    return f'ticket_qr_{_digest(payload, fmt)}'
+
+
+@functools.lru_cache(maxsize=settings.QR_MEMORY_CACHE_SIZE)
+def image(payload, fmt):
+    """The rendered image, from the LRU, the shared cache, or rendered on a miss"""
+    key = cache_key(payload, fmt)
+    data = cache.get(key)
+    if data is None:
+        data = qr.RENDERERS[fmt](payload)
+        cache.set(key, data, settings.QR_CACHE_SECONDS)
+    return data
+
+
+def warm(issued_tickets, fmt='png', workers=None, batch_size=500):
+    """Pre-render QR images into the shared cache, e.g. before doors open. Returns the number rendered."""
+    workers = settings.QR_RENDER_WORKERS if workers is None else workers
+    keys = {}
+    for issued_ticket in issued_tickets:
+        value = payload(issued_ticket)
+        keys[cache_key(value, fmt)] = value
+    key_list = list(keys)
+    cached = set()
+    for start in range(0, len(key_list), batch_size):
+        cached.update(cache.get_many(key_list[start:start + batch_size]))
+    missing = [value for key, value in keys.items() if key not in cached]
+
+    batch = {}
+    for value, data in zip(missing, qr.render_many(missing, workers, fmt)):
+        batch[cache_key(value, fmt)] = data
+        if len(batch) >= batch_size:
+            cache.set_many(batch, settings.QR_CACHE_SECONDS)
+            batch = {}
+    cache.set_many(batch, settings.QR_CACHE_SECONDS)
+    return len(missing)
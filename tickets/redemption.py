@@ -0,0 +1,223 @@
+"""
+Ticket redemption at the gate.
+
+A ticket is only ever redeemed by an UPDATE conditional on is_redeemed=False,
+so two gates scanning the same ticket can't both admit it. redeem_batch
+handles a whole batch of scans in a fixed number of queries; apply_offline
+merges the logs of scanners that worked from a manifest while offline.
+
+With the fast path enabled (see redemption_store), signed payloads in a batch
+are redeemed against cache-side marks and written to the database behind.
+"""
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import checkins, redemption_store, signing
+from .models import IssuedTicket
+
+
+def redeem(issued_ticket):
+    """Redeem one ticket; False when it was already redeemed (possibly by another gate just now)"""
+    now = timezone.now()
+    fast = redemption_store.enabled()
+    if fast:
+        # Claim the mark first so a fast-path scan of the same ticket can't also admit it
+        event_id = issued_ticket.ticket.event_id
+        if not redemption_store.mark(event_id, issued_ticket.pk, log=False):
+            return False
+    try:
+        redeemed = IssuedTicket.objects.filter(pk=issued_ticket.pk, is_redeemed=False).update(
+            is_redeemed=True, redeemed_at=now,
+        )
+    except Exception:
+        if fast:
+            cache.delete(redemption_store.mark_key(event_id, issued_ticket.pk))
+        raise
+    if redeemed:
+        issued_ticket.is_redeemed = True
+        issued_ticket.redeemed_at = now
+        checkins.record(issued_ticket.ticket.event_id, [issued_ticket.ticket.type])
+    return bool(redeemed)
+
+
+def parse_scan(scan):
+    """A scan is a signed QR payload or, from older codes, a bare ticket UUID. Returns (ticket_id, error)"""
+    try:
+        return signing.verifier.verify(scan).ticket_id, None
+    except signing.InvalidTicket as e:
+        if e.reason != 'malformed':
+            return None, e.reason
+    try:
+        return uuid.UUID(str(scan)), None
+    except ValueError:
+        return None, 'malformed'
+
+
+def redeem_fast(scan, organizer):
+    """
+    Redeem a signed payload against the cache-side marks, without the database.
+    Returns the scan's result, or None when it isn't a valid signed payload.
+    """
+    try:
+        claims = signing.verifier.verify(scan)
+    except signing.InvalidTicket:
+        return None
+    result = {'ticket_id': claims.ticket_id}
+    if redemption_store.organizer_id(claims.event_id) != organizer.pk:
+        result['status'] = 'not_authorized'
+    elif not redemption_store.mark(claims.event_id, claims.ticket_id):
+        result['status'] = 'already_redeemed'
+    else:
+        # The attendee's name would cost a query; the gate gets the ticket type from the payload
+        result.update(status='admitted', type=claims.ticket_type)
+        checkins.record(claims.event_id, [claims.ticket_type])
+    return result
+
+
+def redeem_batch(scans, organizer):
+    """
+    Redeem a batch of scans for `organizer`'s events. Returns one result per
+    scan, in order, each with a status of admitted, already_redeemed,
+    not_found, not_authorized or invalid.
+    """
+    fast = redemption_store.enabled()
+    results = []
+    for scan in scans:
+        result = redeem_fast(scan, organizer) if fast else None
+        if result is not None:
+            results.append(result)
+            continue
+        ticket_id, error = parse_scan(scan)
+        results.append({'ticket_id': ticket_id, 'status': 'invalid', 'reason': error} if error else
+                       {'ticket_id': ticket_id})
+
+    ids = {result['ticket_id'] for result in results if 'status' not in result}
+    tickets, admit, marked = {}, set(), []
+    # A batch of signed scans on the fast path never reaches the database
+    if ids:
+        try:
+            with transaction.atomic():
+                # Lock the unredeemed rows so the conditional UPDATE below admits exactly these
+                tickets = {
+                    row['id']: row
+                    for row in IssuedTicket.objects.select_for_update(of=('self',)).filter(id__in=ids).values(
+                        'id', 'is_redeemed', 'ticket__type', 'ticket__event_id', 'ticket__event__organizer_id',
+                        'order__attendee__username',
+                    )
+                }
+                admit = {pk for pk, row in tickets.items()
+                         if not row['is_redeemed'] and row['ticket__event__organizer_id'] == organizer.pk}
+                if fast:
+                    claimed = set()
+                    for pk in admit:
+                        event_id = tickets[pk]['ticket__event_id']
+                        if redemption_store.mark(event_id, pk, log=False):
+                            claimed.add(pk)
+                            marked.append(redemption_store.mark_key(event_id, pk))
+                    admit = claimed
+                if admit:
+                    IssuedTicket.objects.filter(id__in=admit, is_redeemed=False).update(
+                        is_redeemed=True, redeemed_at=timezone.now(),
+                    )
+        except Exception:
+            # The database still has these tickets unused
+            cache.delete_many(marked)
+            raise
+
+    admitted = set()
+    checked_in = defaultdict(list)
+    for result in results:
+        if 'status' in result:
+            continue
+        row = tickets.get(result['ticket_id'])
+        if row is None:
+            result['status'] = 'not_found'
+        elif row['ticket__event__organizer_id'] != organizer.pk:
+            result['status'] = 'not_authorized'
+        elif result['ticket_id'] not in admit or result['ticket_id'] in admitted:
+            # Redeemed earlier, or scanned twice in this batch
+            result['status'] = 'already_redeemed'
+        else:
+            admitted.add(result['ticket_id'])
+            checked_in[row['ticket__event_id']].append(row['ticket__type'])
+            result.update(status='admitted', type=row['ticket__type'], attendee=row['order__attendee__username'])
+
+    for event_id, ticket_types in checked_in.items():
+        checkins.record(event_id, ticket_types)
+    return results
+
+
+def apply_offline(event_id, entries, count=True):
+    """
+    Apply redemptions that scanners logged while offline; `entries` are dicts of
+    ticket_id, scanned_at (epoch milliseconds) and device.
+
+    For each ticket the earliest scan wins, ties broken by device and then by
+    position in the upload, and a scan already recorded by the server wins a
+    tie with an offline one. Replaying the same logs therefore always resolves
+    the same way. Returns a result per entry (applied, duplicate, unknown or
+    invalid) and the tickets that were scanned in more than once. With count,
+    newly redeemed tickets are added to the live check-in counts.
+    """
+    results = [None] * len(entries)
+    scans = {}
+    for index, entry in enumerate(entries):
+        try:
+            ticket_id = uuid.UUID(str(entry['ticket_id']))
+            scanned_at = datetime.fromtimestamp(int(entry['scanned_at']) / 1000, tz=dt_timezone.utc)
+        except (KeyError, TypeError, ValueError, OverflowError, OSError):
+            results[index] = {'status': 'invalid'}
+            continue
+        scans.setdefault(ticket_id, []).append((scanned_at, str(entry.get('device', '')), index))
+
+    conflicts = []
+    with transaction.atomic():
+        tickets = IssuedTicket.objects.select_for_update(of=('self',)).filter(
+            id__in=scans, ticket__event_id=event_id,
+        ).select_related('ticket').only('id', 'is_redeemed', 'redeemed_at', 'ticket__type').in_bulk()
+
+        changed = []
+        newly_redeemed = []
+        for ticket_id, ticket_scans in scans.items():
+            ticket = tickets.get(ticket_id)
+            if ticket is None:
+                for _, _, index in ticket_scans:
+                    results[index] = {'status': 'unknown'}
+                continue
+
+            ticket_scans.sort()
+            first_at, _, first_index = ticket_scans[0]
+            was_redeemed = ticket.is_redeemed
+            # A legacy redemption with no time recorded is taken to be the earliest
+            server_first = was_redeemed and (ticket.redeemed_at is None or ticket.redeemed_at <= first_at)
+
+            for _, _, index in ticket_scans:
+                results[index] = {'status': 'duplicate'}
+            if not server_first:
+                results[first_index] = {'status': 'applied'}
+                if not was_redeemed:
+                    newly_redeemed.append(ticket.ticket.type)
+                ticket.is_redeemed = True
+                ticket.redeemed_at = first_at
+                changed.append(ticket)
+
+            scan_count = len(ticket_scans) + was_redeemed
+            if scan_count > 1:
+                # Double entry: report it with the scan that won
+                conflicts.append({'ticket_id': ticket_id, 'redeemed_at': ticket.redeemed_at, 'scans': scan_count})
+
+        IssuedTicket.objects.bulk_update(changed, ['is_redeemed', 'redeemed_at'], batch_size=1000)
+
+    if count:
+        checkins.record(event_id, newly_redeemed)
+    if redemption_store.enabled():
+        redemption_store.remember(event_id, [ticket.pk for ticket in changed])
+
+    for index, entry in enumerate(entries):
+        results[index]['ticket_id'] = entry.get('ticket_id') if isinstance(entry, dict) else None
+    return results, conflicts
@@ -0,0 +1,240 @@
+"""
+Cache-side redemption marks: the optional fast path for gate scans.
+
+With REDEMPTION_FAST_PATH_ENABLED, a signed QR payload is redeemed by setting
+a per-ticket mark only if it isn't set yet, without a database round trip: the
+signature already proves which event the ticket belongs to. Each redemption is
+appended to a log that flush() writes to IssuedTicket in batches (the
+flush_redemptions task); until then the mark is what refuses a second entry.
+On Redis the mark and its log entry are written by one Lua script, so a crashed
+worker can't leave a ticket admitted but never logged.
+
+An event's marks are rebuilt from the database the first time it is scanned,
+or by the rebuild_redemptions command after the cache was lost. Marks must not
+be evicted, so the cache needs a no-eviction policy; redemptions still in the
+log when the cache is lost are lost with it. Marks and the event's loaded flag
+expire together, REDEMPTION_MARK_MARGIN_SECONDS after the event's signed codes
+do (signing.expiry), so the cache doesn't fill up with past events.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from events.models import Event
+from . import signing
+from .models import IssuedTicket
+
+logger = logging.getLogger(__name__)
+
+SEQ_KEY = 'redemption_log_seq'
+FLUSHED_KEY = 'redemption_log_flushed'
+FLUSH_LOCK_KEY = 'redemption_log_flush_lock'
+
+# KEYS[1] is the mark, KEYS[2] the log sequence. ARGV: the mark's value and
+# timeout, the log key prefix (empty for no log entry) and the encoded entry.
+# Returns 1 when the mark was set, 0 when the ticket was redeemed already.
+MARK_SCRIPT = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then return 0 end
+if ARGV[3] ~= '' then
+    redis.call('SET', ARGV[3] .. redis.call('INCR', KEYS[2]), ARGV[4])
+end
+return 1
+"""
+
+_mark_script = None
+
+
+def enabled():
+    return settings.REDEMPTION_FAST_PATH_ENABLED
+
+
+def mark_key(event_id, ticket_id):
+    return f'redeemed_{event_id}_{ticket_id}'
+
+
+def loaded_key(event_id):
+    return f'redeemed_loaded_{event_id}'
+
+
+def log_key(position):
+    return f'redemption_log_{position}'
+
+
+def get_redis():
+    """Raw Redis client behind the default cache, or None for other backends"""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def event_info(event_id):
+    """
+    (organizer id, signed code expiry) of the event, cached so the fast path
+    stays off the database. (0, 0) if there is no such event.
+    """
+    key = f'event_gate_{event_id}'
+    value = cache.get(key)
+    if value is None:
+        event = Event.objects.filter(pk=event_id).only('organizer_id', 'date', 'end_date').first()
+        value = (event.organizer_id, signing.expiry(event)) if event else (0, 0)
+        cache.set(key, value, settings.REDEMPTION_ORGANIZER_CACHE_SECONDS)
+    return value
+
+
+def organizer_id(event_id):
+    """The event's organizer. None if there is no such event."""
+    return event_info(event_id)[0] or None
+
+
+def mark_timeout(event_id):
+    """Seconds an event's marks are kept: until its codes expire, plus REDEMPTION_MARK_MARGIN_SECONDS"""
+    return max(int(event_info(event_id)[1] - time.time()), 0) + settings.REDEMPTION_MARK_MARGIN_SECONDS
+
+
+# ---------------------------------------------------------------------------
+# Marks
+# ---------------------------------------------------------------------------
+
+def rebuild(event_id):
+    """Recreate an event's marks from the database. Returns the number of redeemed tickets."""
+    rows = IssuedTicket.objects.filter(ticket__event_id=event_id, is_redeemed=True).values_list('id', 'redeemed_at')
+    timeout = mark_timeout(event_id)
+    marks = {}
+    count = 0
+    for ticket_id, redeemed_at in rows.iterator(chunk_size=settings.REDEMPTION_FLUSH_BATCH_SIZE):
+        marks[mark_key(event_id, ticket_id)] = int(redeemed_at.timestamp() * 1000) if redeemed_at else 0
+        count += 1
+        if len(marks) >= settings.REDEMPTION_FLUSH_BATCH_SIZE:
+            cache.set_many(marks, timeout)
+            marks = {}
+    cache.set_many(marks, timeout)
+    cache.set(loaded_key(event_id), 1, timeout)
+    return count
+
+
+def ensure_loaded(event_id):
+    if cache.get(loaded_key(event_id)) is None:
+        rebuild(event_id)
+
+
+def mark(event_id, ticket_id, scanned_ms=None, log=True):
+    """
+    Atomically check-and-mark a ticket as redeemed: True for the first scan,
+    False when it was redeemed already. With log, the redemption is queued for flush().
+    """
+    global _mark_script
+    ensure_loaded(event_id)
+    scanned_ms = scanned_ms or int(time.time() * 1000)
+    entry = (event_id, str(ticket_id), scanned_ms)
+
+    redis = get_redis()
+    if redis is not None:
+        if _mark_script is None:
+            _mark_script = redis.register_script(MARK_SCRIPT)
+        # Log keys are numbered inside the script: the made key of position n is the prefix + n
+        prefix = cache.make_key(log_key('')) if log else ''
+        return bool(_mark_script(
+            keys=[cache.make_key(mark_key(event_id, ticket_id)), cache.make_key(SEQ_KEY)],
+            args=[scanned_ms, mark_timeout(event_id), prefix, cache.client.encode(entry) if log else ''],
+        ))
+
+    # Other backends: separate writes. A crash in between leaves a log gap that flush() skips.
+    if not cache.add(mark_key(event_id, ticket_id), scanned_ms, mark_timeout(event_id)):
+        return False
+    if log:
+        cache.add(SEQ_KEY, 0, None)
+        cache.set(log_key(cache.incr(SEQ_KEY)), entry, None)
+    return True
+
+
+def remember(event_id, ticket_ids):
+    """Mark tickets that were redeemed in the database directly, e.g. from offline scanner uploads"""
+    if cache.get(loaded_key(event_id)) is None:
+        # The next scan rebuilds from the database anyway
+        return
+    timeout = mark_timeout(event_id)
+    for ticket_id in ticket_ids:
+        cache.add(mark_key(event_id, ticket_id), 0, timeout)
+
+
+# ---------------------------------------------------------------------------
+# Write-behind
+# ---------------------------------------------------------------------------
+
+def gap_expired(key):
+    """True once a log position has been taken but left unwritten for REDEMPTION_LOG_GAP_SECONDS"""
+    now = time.time()
+    if cache.add(f'{key}_gap', now, settings.REDEMPTION_LOG_GAP_SECONDS + 60):
+        return False
+    return now - cache.get(f'{key}_gap', now) >= settings.REDEMPTION_LOG_GAP_SECONDS
+
+
+def flush(batch_size=None):
+    """
+    Write logged redemptions to the database, oldest first, in batches.
+    Returns the number written; 0 if another flush is running.
+    """
+    from .redemption import apply_offline
+
+    if not cache.add(FLUSH_LOCK_KEY, 1, 60):
+        return 0
+    batch_size = batch_size or settings.REDEMPTION_FLUSH_BATCH_SIZE
+    flushed = 0
+    try:
+        position = cache.get(FLUSHED_KEY, 0)
+        end = cache.get(SEQ_KEY, 0)
+        while position < end:
+            keys = [log_key(n) for n in range(position + 1, min(end, position + batch_size) + 1)]
+            found = cache.get_many(keys)
+            consumed = []
+            for key in keys:
+                # A position whose entry isn't written yet holds up the log, unless it never will be
+                if key not in found:
+                    if not gap_expired(key):
+                        break
+                    logger.warning("Skipping redemption log entry %s, which was never written", key)
+                consumed.append(key)
+            if not consumed:
+                break
+
+            by_event = {}
+            for key in consumed:
+                if key in found:
+                    event_id, ticket_id, scanned_ms = found[key]
+                    by_event.setdefault(event_id, []).append(
+                        {'ticket_id': ticket_id, 'scanned_at': scanned_ms, 'device': 'gate'}
+                    )
+            for event_id, entries in by_event.items():
+                # Earliest scan wins, so replaying entries after a crash changes nothing.
+                # The check-ins were counted when the scans were admitted.
+                apply_offline(event_id, entries, count=False)
+                flushed += len(entries)
+
+            position += len(consumed)
+            cache.set(FLUSHED_KEY, position, None)
+            cache.delete_many(consumed)
+            if len(consumed) < len(keys):
+                break
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+    return flushed
+
+
+def pending():
+    """Logged redemptions not yet written to the database"""
+    return cache.get(SEQ_KEY, 0) - cache.get(FLUSHED_KEY, 0)
+
+
+def pending_tickets():
+    """{event_id: set of ticket ids} of the logged redemptions not yet written to the database"""
+    position, end = cache.get(FLUSHED_KEY, 0), cache.get(SEQ_KEY, 0)
+    tickets = {}
+    for start in range(position + 1, end + 1, settings.REDEMPTION_FLUSH_BATCH_SIZE):
+        keys = [log_key(n) for n in range(start, min(end, start + settings.REDEMPTION_FLUSH_BATCH_SIZE - 1) + 1)]
+        for event_id, ticket_id, _ in cache.get_many(keys).values():
+            tickets.setdefault(event_id, set()).add(ticket_id)
+    return tickets
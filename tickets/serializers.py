@@ -1,4 +1,6 @@
+from django.urls import reverse
 from rest_framework import serializers
+from . import qr_cache
 from .models import Ticket, IssuedTicket
 
 class TicketSerializer(serializers.ModelSerializer):
@@ -24,7 +26,23 @@ class IssuedTicketSerializer(serializers.ModelSerializer):
     event_name = serializers.CharField(source='ticket.event.name', read_only=True)
     ticket_type = serializers.CharField(source='ticket.type', read_only=True)
     attendee_name = serializers.CharField(source='order.attendee.username', read_only=True)
+    # QR codes are rendered on request by the qr action
+    qr_code = serializers.SerializerMethodField()
+    qr_code_svg = serializers.SerializerMethodField()
 
     class Meta:
         model = IssuedTicket
-        fields = ['id', 'ticket_type', 'event_name', 'attendee_name', 'is_redeemed', 'qr_code']
+        fields = ['id', 'ticket_type', 'event_name', 'attendee_name', 'is_redeemed', 'qr_code', 'qr_code_svg']
+
+    def qr_url(self, obj, fmt):
+        # Versioned, so browsers may cache the image for good and still pick up a rotated key
+        version = qr_cache.version(qr_cache.payload(obj), fmt)
+        url = reverse('tickets:issuedticket-qr', kwargs={'pk': obj.pk, 'fmt': fmt}) + f'?v={version}'
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_qr_code(self, obj):
+        return self.qr_url(obj, 'png')
+
+    def get_qr_code_svg(self, obj):
+        return self.qr_url(obj, 'svg')
@@ -1,9 +1,22 @@
+import base64
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
 from rest_framework.test import APITestCase
 from rest_framework import status
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.conf import settings
+from django.test import override_settings
 from django.urls import reverse
 from users.models import CustomUser
 from events.models import Event
+from core import streams
+from tickets import checkins, manifests, qr_cache, redemption, redemption_store, signing
 from tickets.models import Ticket, IssuedTicket
+from tickets.tasks import reconcile_checkins
 from orders.models import Order
 from django.utils import timezone
 
@@ -44,7 +57,7 @@ class TicketTests(APITestCase):
         url = reverse('tickets:ticket-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_create_ticket(self):
         self.client.force_authenticate(user=self.organizer)
@@ -114,3 +127,546 @@ class TicketValidationTest(APITestCase):
         url = reverse('tickets:issuedticket-validate', args=[issued_ticket.id])
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+    def test_redeem_is_conditional(self):
+        # Another gate redeems the ticket after this one loaded it
+        stale = IssuedTicket.objects.get(id=self.issued_ticket.id)
+        self.assertTrue(redemption.redeem(self.issued_ticket))
+        self.assertFalse(redemption.redeem(stale))
+
+
+class BatchValidationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.other_organizer = CustomUser.objects.create_user(username='other', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Event', date=timezone.now(), organizer=self.organizer)
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=10)
+        self.order = Order.objects.create(attendee=self.attendee, total_amount=10)
+        self.tickets = [IssuedTicket.objects.create(ticket=self.ticket, order=self.order) for _ in range(3)]
+        self.url = reverse('tickets:issuedticket-validate-batch')
+        self.client.force_authenticate(user=self.organizer)
+
+    def test_each_scan_gets_its_own_result(self):
+        other_event = Event.objects.create(name='Other', date=timezone.now(), organizer=self.other_organizer)
+        other_ticket = Ticket.objects.create(event=other_event, type='general', price=10, quantity_available=10)
+        foreign = IssuedTicket.objects.create(ticket=other_ticket, order=self.order)
+        IssuedTicket.objects.filter(id=self.tickets[2].id).update(is_redeemed=True)
+        payload = signing.sign_ticket(self.tickets[0])
+        tampered = payload[:20] + ('A' if payload[20] != 'A' else 'B') + payload[21:]
+
+        scans = [
+            payload,
+            str(self.tickets[1].id),  # a bare ticket id from an older QR code
+            payload,
+            str(self.tickets[2].id),
+            str(foreign.id),
+            '00000000-0000-0000-0000-000000000000',
+            tampered,
+        ]
+        response = self.client.post(self.url, {'scans': scans}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']], [
+            'admitted', 'admitted', 'already_redeemed', 'already_redeemed', 'not_authorized', 'not_found', 'invalid',
+        ])
+        self.assertEqual(response.data['admitted'], 2)
+        self.assertEqual(response.data['results'][0]['attendee'], 'attendee')
+        self.assertEqual(response.data['results'][6]['reason'], 'bad_signature')
+        self.assertFalse(IssuedTicket.objects.get(id=foreign.id).is_redeemed)
+        self.assertEqual(IssuedTicket.objects.filter(is_redeemed=True).count(), 3)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        scans = [str(ticket.id) for ticket in self.tickets]
+        # Savepoint, locked read, conditional UPDATE, release
+        with self.assertNumQueries(4):
+            redemption.redeem_batch(scans, self.organizer)
+
+    def test_batch_limits(self):
+        self.assertEqual(self.client.post(self.url, {'scans': []}, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        with self.settings(VALIDATION_BATCH_MAX=2):
+            response = self.client.post(self.url, {'scans': [str(t.id) for t in self.tickets]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.attendee)
+        response = self.client.post(self.url, {'scans': [str(self.tickets[0].id)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(REDEMPTION_FAST_PATH_ENABLED=True)
+class FastPathRedemptionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Event', date=timezone.now(), organizer=self.organizer)
+        self.ticket = Ticket.objects.create(event=self.event, type='vip', price=10, quantity_available=10)
+        self.order = Order.objects.create(attendee=self.attendee, total_amount=10)
+        self.tickets = [IssuedTicket.objects.create(ticket=self.ticket, order=self.order) for _ in range(3)]
+        self.payloads = [signing.sign_ticket(ticket) for ticket in self.tickets]
+
+    def test_signed_scans_are_redeemed_without_the_database_and_flushed_behind(self):
+        # Warm the per-event lookups the first scan makes
+        redemption_store.rebuild(self.event.id)
+        redemption_store.organizer_id(self.event.id)
+        signing.current_key_version(self.event.id)
+        checkins.snapshot(self.event.id)
+        with self.assertNumQueries(0):
+            results = redemption.redeem_batch([self.payloads[0], self.payloads[1], self.payloads[0]], self.organizer)
+        self.assertEqual([result['status'] for result in results], ['admitted', 'admitted', 'already_redeemed'])
+        self.assertEqual(results[0]['type'], 'vip')
+        self.assertFalse(IssuedTicket.objects.filter(is_redeemed=True).exists())
+        self.assertEqual(redemption_store.pending(), 2)
+
+        self.assertEqual(redemption_store.flush(batch_size=1), 2)
+        self.assertEqual(redemption_store.pending(), 0)
+        redeemed = IssuedTicket.objects.filter(is_redeemed=True)
+        self.assertEqual({ticket.id for ticket in redeemed}, {self.tickets[0].id, self.tickets[1].id})
+        self.assertTrue(all(ticket.redeemed_at for ticket in redeemed))
+        # Nothing left to write
+        self.assertEqual(redemption_store.flush(), 0)
+
+    def test_fast_and_database_paths_share_marks(self):
+        redemption.redeem_batch([self.payloads[0]], self.organizer)
+        self.assertFalse(redemption.redeem(IssuedTicket.objects.get(id=self.tickets[0].id)))
+        self.assertEqual(redemption.redeem_batch([str(self.tickets[0].id)], self.organizer)[0]['status'],
+                         'already_redeemed')
+
+        self.assertTrue(redemption.redeem(self.tickets[1]))
+        self.assertEqual(redemption.redeem_batch([self.payloads[1]], self.organizer)[0]['status'], 'already_redeemed')
+
+        other = CustomUser.objects.create_user(username='other', password='password', role='organizer')
+        self.assertEqual(redemption.redeem_batch([self.payloads[2]], other)[0]['status'], 'not_authorized')
+        self.assertEqual(redemption.redeem_batch([self.payloads[2]], self.organizer)[0]['status'], 'admitted')
+
+    def test_failed_database_write_releases_the_marks(self):
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                redemption.redeem_batch([str(self.tickets[0].id)], self.organizer)
+        self.assertIsNone(cache.get(redemption_store.mark_key(self.event.id, self.tickets[0].id)))
+        self.assertEqual(redemption.redeem_batch([str(self.tickets[0].id)], self.organizer)[0]['status'], 'admitted')
+
+    def test_marks_are_rebuilt_from_the_database(self):
+        redemption.redeem(self.tickets[0])
+        # The cache was lost
+        cache.clear()
+        self.assertEqual(redemption.redeem_batch([self.payloads[0]], self.organizer)[0]['status'], 'already_redeemed')
+
+        IssuedTicket.objects.filter(id=self.tickets[1].id).update(is_redeemed=True, redeemed_at=timezone.now())
+        out = StringIO()
+        call_command('rebuild_redemptions', event=[self.event.id], stdout=out)
+        self.assertIn('2 redeemed tickets marked', out.getvalue())
+        self.assertEqual(redemption.redeem_batch([self.payloads[1]], self.organizer)[0]['status'], 'already_redeemed')
+
+    @override_settings(REDEMPTION_LOG_GAP_SECONDS=0)
+    def test_flush_waits_for_an_unwritten_log_entry(self):
+        redemption.redeem_batch([self.payloads[0]], self.organizer)
+        # A scan that took a log position and crashed before writing its entry
+        cache.incr(redemption_store.SEQ_KEY)
+        redemption.redeem_batch([self.payloads[1]], self.organizer)
+
+        self.assertEqual(redemption_store.flush(), 1)
+        self.assertEqual(redemption_store.pending(), 2)
+        self.assertFalse(IssuedTicket.objects.get(id=self.tickets[1].id).is_redeemed)
+        # Missing for long enough: skipped
+        self.assertEqual(redemption_store.flush(), 1)
+        self.assertEqual(redemption_store.pending(), 0)
+        self.assertTrue(IssuedTicket.objects.get(id=self.tickets[1].id).is_redeemed)
+
+    def test_redis_marks_and_logs_in_one_script(self):
+        redemption_store.rebuild(self.event.id)
+        timeout = redemption_store.mark_timeout(self.event.id)
+        script = mock.Mock(return_value=1)
+        redis = mock.Mock(**{'register_script.return_value': script})
+        encode = mock.Mock(return_value=b'entry')
+        with mock.patch.object(redemption_store, 'get_redis', return_value=redis), \
+                mock.patch.object(redemption_store, '_mark_script', None), \
+                mock.patch.object(cache, 'client', mock.Mock(encode=encode), create=True):
+            self.assertTrue(redemption_store.mark(self.event.id, self.tickets[0].id, scanned_ms=5))
+            script.return_value = 0
+            self.assertFalse(redemption_store.mark(self.event.id, self.tickets[0].id, scanned_ms=6, log=False))
+
+        redis.register_script.assert_called_once_with(redemption_store.MARK_SCRIPT)
+        encode.assert_called_once_with((self.event.id, str(self.tickets[0].id), 5))
+        keys = [cache.make_key(redemption_store.mark_key(self.event.id, self.tickets[0].id)),
+                cache.make_key(redemption_store.SEQ_KEY)]
+        self.assertEqual(script.call_args_list, [
+            mock.call(keys=keys, args=[5, timeout, cache.make_key('redemption_log_'), b'entry']),
+            mock.call(keys=keys, args=[6, timeout, '', '']),
+        ])
+        # Nothing went through the cache primitives
+        self.assertIsNone(cache.get(redemption_store.mark_key(self.event.id, self.tickets[0].id)))
+
+    def test_marks_expire_after_the_event(self):
+        redemption.redeem_batch([self.payloads[0]], self.organizer)
+        mark = redemption_store.mark_key(self.event.id, self.tickets[0].id)
+        loaded = redemption_store.loaded_key(self.event.id)
+        expires = signing.expiry(self.event) + settings.REDEMPTION_MARK_MARGIN_SECONDS
+
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=expires - 60):
+            self.assertIsNotNone(cache.get(mark))
+            self.assertIsNotNone(cache.get(loaded))
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=expires + 1):
+            self.assertIsNone(cache.get(mark))
+            self.assertIsNone(cache.get(loaded))
+
+
+class TicketQRTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        qr_cache.image.cache_clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Event', date=timezone.now(), organizer=self.organizer)
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=10)
+        self.order = Order.objects.create(attendee=self.attendee, total_amount=10)
+        self.issued_ticket = IssuedTicket.objects.create(ticket=self.ticket, order=self.order)
+        self.client.force_authenticate(user=self.attendee)
+
+    def qr_url(self, fmt='png'):
+        return reverse('tickets:issuedticket-qr', args=[self.issued_ticket.id, fmt])
+
+    def test_png_is_rendered_and_cached(self):
+        response = self.client.get(self.qr_url())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        payload = qr_cache.payload(self.issued_ticket)
+        self.assertEqual(cache.get(qr_cache.cache_key(payload, 'png')), response.content)
+
+    def test_svg(self):
+        response = self.client.get(self.qr_url('svg'))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(response.content.startswith(b'<svg'))
+        self.assertNotEqual(response['ETag'], self.client.get(self.qr_url())['ETag'])
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get(self.qr_url())['ETag']
+        response = self.client.get(self.qr_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_other_attendees_cannot_fetch_the_code(self):
+        stranger = CustomUser.objects.create_user(username='stranger', password='password', role='attendee')
+        self.client.force_authenticate(user=stranger)
+        self.assertEqual(self.client.get(self.qr_url()).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serializer_points_at_versioned_endpoint(self):
+        response = self.client.get(reverse('tickets:issuedticket-detail', args=[self.issued_ticket.id]))
+        self.assertIn(self.qr_url() + '?v=', response.data['qr_code'])
+        self.assertIn(self.qr_url('svg') + '?v=', response.data['qr_code_svg'])
+
+        image = self.client.get(response.data['qr_code'])
+        self.assertIn('immutable', image['Cache-Control'])
+        self.assertIn('private', image['Cache-Control'])
+
+    def test_key_rotation_changes_the_url(self):
+        detail = reverse('tickets:issuedticket-detail', args=[self.issued_ticket.id])
+        before = self.client.get(detail).data['qr_code']
+        signing.rotate_key(self.event)
+        after = self.client.get(detail).data['qr_code']
+        self.assertNotEqual(before, after)
+        # The old version is no longer the image's: not cacheable for good
+        self.assertNotIn('immutable', self.client.get(before)['Cache-Control'])
+
+    def test_warm_renders_into_cache_with_process_pool(self):
+        IssuedTicket.objects.create(ticket=self.ticket, order=self.order)
+        out = StringIO()
+        call_command('qr_codes', '--warm', '--event', str(self.event.id), '--workers', '2', stdout=out)
+        self.assertIn('Rendered 2 png', out.getvalue())
+        for issued_ticket in IssuedTicket.objects.all():
+            self.assertIsNotNone(cache.get(qr_cache.cache_key(qr_cache.payload(issued_ticket), 'png')))
+
+        # Already cached: nothing to render, and no query per ticket to find that out
+        with self.assertNumQueries(1):
+            call_command('qr_codes', '--warm', '--event', str(self.event.id), stdout=out)
+        self.assertIn('Rendered 0 png', out.getvalue())
+
+    def test_cleanup_deletes_stored_files(self):
+        self.issued_ticket.qr_code.save(f'{self.issued_ticket.id}.png', ContentFile(b'png'))
+        name = self.issued_ticket.qr_code.name
+        storage = self.issued_ticket.qr_code.storage
+        self.assertTrue(storage.exists(name))
+
+        call_command('qr_codes', '--cleanup', stdout=StringIO())
+        self.assertFalse(storage.exists(name))
+        self.issued_ticket.refresh_from_db()
+        self.assertFalse(self.issued_ticket.qr_code)
+
+
+class SignedPayloadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Event', date=timezone.now(), organizer=self.organizer, is_published=True)
+        self.ticket = Ticket.objects.create(event=self.event, type='vip', price=10, quantity_available=10)
+        self.order = Order.objects.create(attendee=self.attendee, total_amount=10)
+        self.issued_ticket = IssuedTicket.objects.create(ticket=self.ticket, order=self.order)
+        self.payload = signing.sign_ticket(self.issued_ticket)
+
+    def test_round_trip(self):
+        claims = signing.verifier.verify(self.payload)
+        self.assertEqual(claims.ticket_id, self.issued_ticket.id)
+        self.assertEqual(claims.event_id, self.event.id)
+        self.assertEqual(claims.ticket_type, 'vip')
+        self.assertEqual(len(self.payload), signing.PAYLOAD_CHARS)
+
+    def test_rejections(self):
+        tampered = self.payload[:20] + ('A' if self.payload[20] != 'A' else 'B') + self.payload[21:]
+        cases = [
+            (tampered, 'bad_signature'),
+            (self.payload[:-1], 'malformed'),
+            (self.payload.lower(), 'malformed'),
+        ]
+        for payload, reason in cases:
+            with self.assertRaises(signing.InvalidTicket) as raised:
+                signing.verifier.verify(payload)
+            self.assertEqual(raised.exception.reason, reason)
+
+        with self.assertRaises(signing.InvalidTicket) as raised:
+            signing.verifier.verify(self.payload, now=signing.expiry(self.event) + 1)
+        self.assertEqual(raised.exception.reason, 'expired')
+
+    def test_rotation_invalidates_old_codes(self):
+        self.client.force_authenticate(user=self.organizer)
+        response = self.client.post(reverse('event-rotate-signing-key', args=[self.event.id]))
+        self.assertEqual(response.data['key_version'], 2)
+
+        with self.assertRaises(signing.InvalidTicket) as raised:
+            signing.verifier.verify(self.payload)
+        self.assertEqual(raised.exception.reason, 'unknown_key')
+
+        self.issued_ticket = IssuedTicket.objects.select_related('ticket__event').get(id=self.issued_ticket.id)
+        new_payload = signing.sign_ticket(self.issued_ticket)
+        self.assertEqual(signing.verifier.verify(new_payload).key_version, 2)
+
+    def test_scanner_verifies_offline_with_provisioned_key(self):
+        self.client.force_authenticate(user=self.organizer)
+        data = self.client.get(reverse('event-scanner-key', args=[self.event.id])).data
+        scanner = signing.Verifier({(data['event_id'], data['key_version']): base64.urlsafe_b64decode(data['key'])})
+        with self.assertNumQueries(0):
+            self.assertEqual(scanner.verify(self.payload).ticket_id, self.issued_ticket.id)
+
+        self.client.force_authenticate(user=self.attendee)
+        response = self.client.get(reverse('event-scanner-key', args=[self.event.id]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_verify_endpoint(self):
+        url = reverse('tickets:issuedticket-verify')
+        self.client.force_authenticate(user=self.organizer)
+        response = self.client.post(url, {'payload': self.payload}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['ticket_id'], self.issued_ticket.id)
+
+        response = self.client.post(url, {'payload': 'NOT-A-TICKET'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['reason'], 'malformed')
+
+        self.client.force_authenticate(user=self.attendee)
+        self.assertEqual(self.client.post(url, {'payload': self.payload}, format='json').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+
+class ScannerSyncTests(APITestCase):
+    def setUp(self):
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Event', date=timezone.now(), organizer=self.organizer, is_published=True)
+        self.ticket = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=10)
+        self.order = Order.objects.create(attendee=self.attendee, total_amount=10, status='paid')
+        self.tickets = [IssuedTicket.objects.create(ticket=self.ticket, order=self.order) for _ in range(4)]
+        self.client.force_authenticate(user=self.organizer)
+
+    def download(self, since=None):
+        url = reverse('event-scanner-manifest', args=[self.event.id])
+        response = self.client.get(url, {'since': since} if since else {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return manifests.parse(response.content), int(response['X-Manifest-Version'])
+
+    def upload(self, entries):
+        url = reverse('event-scanner-redemptions', args=[self.event.id])
+        return self.client.post(url, {'redemptions': entries}, format='json')
+
+    def test_full_manifest(self):
+        redemption.redeem(self.tickets[0])
+        refunded = Order.objects.create(attendee=self.attendee, total_amount=10, status='refunded')
+        revoked = IssuedTicket.objects.create(ticket=self.ticket, order=refunded)
+
+        manifest, version = self.download()
+        self.assertEqual(manifest.kind, manifests.FULL)
+        self.assertEqual(manifest.version, version)
+        self.assertEqual(len(manifest.valid), 3 * manifests.UUID_BYTES)
+        self.assertTrue(manifests.contains(manifest.redeemed, self.tickets[0].id))
+        for ticket in self.tickets[1:]:
+            self.assertTrue(manifests.contains(manifest.valid, ticket.id))
+        self.assertFalse(manifests.contains(manifest.valid, revoked.id))
+
+    def test_delta_since_version(self):
+        _, version = self.download()
+        # Changes from before the overlap window are not repeated
+        IssuedTicket.objects.filter(id__in=[t.id for t in self.tickets]).update(
+            created_at=timezone.now() - timedelta(hours=1),
+        )
+        added = IssuedTicket.objects.create(ticket=self.ticket, order=self.order)
+        redemption.redeem(self.tickets[1])
+
+        manifest, _ = self.download(since=version)
+        self.assertEqual(manifest.kind, manifests.DELTA)
+        self.assertEqual(bytes(manifest.valid), added.id.bytes)
+        self.assertEqual(bytes(manifest.redeemed), self.tickets[1].id.bytes)
+
+        # Too old to serve as a delta base
+        manifest, _ = self.download(since=version - 60 * 60 * 24 * 1000)
+        self.assertEqual(manifest.kind, manifests.FULL)
+
+    def test_offline_redemptions_earliest_scan_wins(self):
+        t0 = int(timezone.now().timestamp() * 1000)
+        first, second, online = self.tickets[:3]
+        redemption.redeem(online)
+        response = self.upload([
+            {'ticket_id': str(first.id), 'scanned_at': t0 + 500, 'device': 'gate-2'},
+            {'ticket_id': str(first.id), 'scanned_at': t0, 'device': 'gate-1'},
+            {'ticket_id': str(second.id), 'scanned_at': t0, 'device': 'gate-1'},
+            # Scanned offline before the server saw it at a connected gate
+            {'ticket_id': str(online.id), 'scanned_at': t0 - 60000, 'device': 'gate-3'},
+            {'ticket_id': '00000000-0000-0000-0000-000000000000', 'scanned_at': t0},
+            {'ticket_id': 'garbage', 'scanned_at': t0},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['duplicate', 'applied', 'applied', 'applied', 'unknown', 'invalid'])
+        self.assertEqual({c['ticket_id'] for c in response.data['conflicts']}, {first.id, online.id})
+
+        first.refresh_from_db()
+        online.refresh_from_db()
+        self.assertTrue(first.is_redeemed)
+        self.assertEqual(int(first.redeemed_at.timestamp() * 1000), t0)
+        self.assertEqual(int(online.redeemed_at.timestamp() * 1000), t0 - 60000)
+
+        # Replaying the same log changes nothing
+        replay = self.upload([{'ticket_id': str(second.id), 'scanned_at': t0, 'device': 'gate-1'}])
+        self.assertEqual(replay.data['results'][0]['status'], 'duplicate')
+
+    def test_only_the_organizer_syncs(self):
+        self.client.force_authenticate(user=self.attendee)
+        url = reverse('event-scanner-manifest', args=[self.event.id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.upload([]).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CheckInCounterTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organizer = CustomUser.objects.create_user(username='organizer', password='password', role='organizer')
+        self.attendee = CustomUser.objects.create_user(username='attendee', password='password', role='attendee')
+        self.event = Event.objects.create(name='Event', date=timezone.now(), organizer=self.organizer)
+        self.general = Ticket.objects.create(event=self.event, type='general', price=10, quantity_available=10)
+        self.vip = Ticket.objects.create(event=self.event, type='vip', price=50, quantity_available=10)
+        self.order = Order.objects.create(attendee=self.attendee, total_amount=10, status='paid')
+        self.tickets = [IssuedTicket.objects.create(ticket=self.general, order=self.order) for _ in range(3)]
+        self.tickets.append(IssuedTicket.objects.create(ticket=self.vip, order=self.order))
+        self.url = reverse('event-checkins', args=[self.event.id])
+        self.client.force_authenticate(user=self.organizer)
+
+    def counts(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['checked_in'], response.data['by_type']
+
+    def test_every_redemption_path_is_counted(self):
+        # Redeemed before the counters existed: picked up when they are first read
+        redemption.redeem(self.tickets[0])
+        self.assertEqual(self.counts(), (1, {'general': 1, 'vip': 0, 'early_bird': 0}))
+
+        redemption.redeem_batch([str(self.tickets[1].id), signing.sign_ticket(self.tickets[3])], self.organizer)
+        redemption.apply_offline(self.event.id, [
+            {'ticket_id': str(self.tickets[2].id), 'scanned_at': int(timezone.now().timestamp() * 1000)},
+            # Already counted: an earlier offline scan moves redeemed_at, not the count
+            {'ticket_id': str(self.tickets[0].id), 'scanned_at': 0},
+        ])
+        self.assertFalse(redemption.redeem(self.tickets[3]))
+        self.assertEqual(self.counts(), (4, {'general': 3, 'vip': 1, 'early_bird': 0}))
+
+        # Reading the counts costs no queries
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_reconcile_repairs_a_count_lost_to_a_racing_rebuild(self):
+        self.counts()
+        # Redeemed after a rebuild's count, recorded before it had finished loading
+        IssuedTicket.objects.filter(id=self.tickets[0].id).update(is_redeemed=True, redeemed_at=timezone.now())
+        self.assertEqual(self.counts()[0], 0)
+
+        self.assertEqual(reconcile_checkins(), 1)
+        self.assertEqual(self.counts(), (1, {'general': 1, 'vip': 0, 'early_bird': 0}))
+        # Counters that are right already keep their version
+        version = checkins.snapshot(self.event.id)['version']
+        reconcile_checkins()
+        self.assertEqual(checkins.snapshot(self.event.id)['version'], version)
+
+    @override_settings(REDEMPTION_FAST_PATH_ENABLED=True)
+    def test_rebuild_counts_redemptions_waiting_to_be_flushed(self):
+        redemption.redeem_batch([signing.sign_ticket(self.tickets[3])], self.organizer)
+        self.assertEqual(redemption_store.pending(), 1)
+        checkins.rebuild(self.event.id)
+        self.assertEqual(self.counts(), (1, {'general': 0, 'vip': 1, 'early_bird': 0}))
+
+    @override_settings(REDEMPTION_FAST_PATH_ENABLED=True)
+    def test_fast_path_is_counted_once(self):
+        redemption.redeem_batch([signing.sign_ticket(self.tickets[3])], self.organizer)
+        self.assertEqual(self.counts(), (1, {'general': 0, 'vip': 1, 'early_bird': 0}))
+        redemption_store.flush()
+        self.assertEqual(self.counts()[0], 1)
+
+        cache.clear()
+        self.assertEqual(self.counts()[0], 1)
+
+    def test_only_the_organizer_sees_counts(self):
+        other = CustomUser.objects.create_user(username='other', password='password', role='organizer')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(reverse('event-checkins', args=[self.event.id + 100])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    @override_settings(CHECKIN_STREAM_INTERVAL_SECONDS=0, CHECKIN_STREAM_MAX_SECONDS=0)
+    def test_stream_sends_a_snapshot(self):
+        response = self.client.get(reverse('event-checkins-stream', args=[self.event.id]),
+                                   HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: snapshot', body)
+        self.assertIn('"checked_in": 0', body)
+
+    @override_settings(CHECKIN_MAX_STREAMS=1, CHECKIN_STREAM_INTERVAL_SECONDS=0, CHECKIN_STREAM_MAX_SECONDS=60)
+    def test_streams_beyond_the_cap_get_one_snapshot(self):
+        slot = streams.acquire_slot('checkins', 1, 60)
+        response = self.client.get(reverse('event-checkins-stream', args=[self.event.id]),
+                                   HTTP_ACCEPT='text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertEqual(body.count('event: snapshot'), 1)
+        self.assertNotIn('keepalive', body)
+
+        cache.delete(slot)
+        response = self.client.get(reverse('event-checkins-stream', args=[self.event.id]),
+                                   HTTP_ACCEPT='text/event-stream')
+        content = iter(response.streaming_content)
+        next(content), next(content)  # retry, snapshot
+        self.assertEqual(streams.open_streams('checkins', 1), 1)
+        response.close()
+        self.assertEqual(streams.open_streams('checkins', 1), 0)
+
+    def test_stream_pushes_deltas(self):
+        stream = checkins.stream(self.event.id, interval=0, duration=60)
+        next(stream)  # retry
+        self.assertIn('event: snapshot', next(stream))
+        redemption.redeem(self.tickets[3])
+        delta = next(stream)
+        self.assertIn('event: delta', delta)
+        self.assertIn('"added": 1, "by_type": {"vip": 1}', delta)
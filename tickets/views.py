@@ -2,9 +2,13 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.utils.cache import patch_cache_control
 
+from . import qr_cache, redemption, signing
 from .models import Ticket, IssuedTicket
 from .serializers import TicketSerializer, IssuedTicketSerializer
 
@@ -14,9 +18,11 @@ def my_tickets(request):
     return render(request, 'tickets/my_tickets.html', {'issued_tickets': issued_tickets})
 
 class TicketViewSet(viewsets.ModelViewSet):
-    queryset = Ticket.objects.all()
+    queryset = Ticket.objects.with_total_sold()
     serializer_class = TicketSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    # Unique by Meta.unique_together, so its index serves the pages
+    keyset_ordering = ('event_id', 'type')
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -30,18 +36,63 @@ class IssuedTicketViewSet(viewsets.ModelViewSet):
     queryset = IssuedTicket.objects.all()
     serializer_class = IssuedTicketSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('created_at', 'id')
 
     def get_queryset(self):
         user = self.request.user
+        queryset = IssuedTicket.objects.select_related('ticket__event', 'order__attendee')
         # Attendees see their own tickets
         if user.role == 'attendee':
-            return IssuedTicket.objects.filter(order__attendee=user)
+            return queryset.filter(order__attendee=user)
         # Organizers see tickets for their events
         elif user.role == 'organizer':
-            return IssuedTicket.objects.filter(ticket__event__organizer=user)
+            return queryset.filter(ticket__event__organizer=user)
         return IssuedTicket.objects.none()
 
-    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    @action(detail=True, methods=['get'], url_path='qr/(?P<fmt>png|svg)', throttle_classes=[])
+    def qr(self, request, pk=None, fmt='png'):
+        """
+        The ticket's QR code, rendered on first request.
+        URL: GET /api/issued_tickets/{id}/qr/png/?v={version} (or /qr/svg/), as linked by the serializer
+        """
+        payload = qr_cache.payload(self.get_object())
+        etag = qr_cache.etag(payload, fmt)
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(qr_cache.image(payload, fmt), content_type=qr_cache.CONTENT_TYPES[fmt])
+        response['ETag'] = etag
+        # Private because it is the holder's entry pass. The image behind a versioned URL never
+        # changes; the bare URL changes with key rotations, so it is revalidated on every use.
+        if request.query_params.get('v') == qr_cache.version(payload, fmt):
+            patch_cache_control(response, private=True, max_age=60 * 60 * 24 * 365, immutable=True)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(detail=False, methods=['post'], throttle_classes=[])
+    def verify(self, request):
+        """
+        Check a scanned QR payload's signature and expiry, without touching the database.
+        URL: POST /api/issued_tickets/verify/ {"payload": "..."}
+        Redemption still goes through validate.
+        """
+        if request.user.role != 'organizer':
+            return Response({'error': 'Only organizers can verify tickets'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            claims = signing.verifier.verify(request.data.get('payload') or '')
+        except signing.InvalidTicket as e:
+            return Response({'valid': False, 'reason': e.reason}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'valid': True,
+            'ticket_id': claims.ticket_id,
+            'event_id': claims.event_id,
+            'ticket_type': claims.ticket_type,
+            'expires': claims.expires,
+        })
+
+    # Unthrottled: a busy gate scans far more than the per-user daily quota
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated], throttle_classes=[])
     def validate(self, request, pk=None):
         """
         Scan/Validate a ticket.
@@ -55,22 +106,44 @@ class IssuedTicketViewSet(viewsets.ModelViewSet):
         if request.user.role != 'organizer':
              return Response({'error': 'Only organizers can validate tickets'}, status=status.HTTP_403_FORBIDDEN)
         
-        if issued_ticket.ticket.event.organizer != request.user:
+        if issued_ticket.ticket.event.organizer_id != request.user.pk:
              return Response({'error': 'Not authorized for this event'}, status=status.HTTP_403_FORBIDDEN)
 
-        if issued_ticket.is_redeemed:
+        # Conditional update: of two gates scanning the same ticket, only one admits it
+        if not redemption.redeem(issued_ticket):
+            issued_ticket.refresh_from_db(fields=['redeemed_at'])
             return Response({
                 'status': 'error', 
                 'message': 'Ticket already used!',
-                'redeemed_at': issued_ticket.updated_at if hasattr(issued_ticket, 'updated_at') else 'Previously'
+                'redeemed_at': issued_ticket.redeemed_at or 'Previously'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        issued_ticket.is_redeemed = True
-        issued_ticket.save()
-
         return Response({
             'status': 'success',
             'message': 'Ticket valid. Entry authorized.',
             'attendee': issued_ticket.order.attendee.username,
             'type': issued_ticket.ticket.type
         })
+
+    @action(detail=False, methods=['post'], throttle_classes=[])
+    def validate_batch(self, request):
+        """
+        Redeem a batch of scans from an entry gate in one request.
+        URL: POST /api/issued_tickets/validate_batch/ {"scans": ["<QR payload or ticket id>", ...]}
+        Every scan gets its own result, in order.
+        """
+        if request.user.role != 'organizer':
+             return Response({'error': 'Only organizers can validate tickets'}, status=status.HTTP_403_FORBIDDEN)
+
+        scans = request.data.get('scans')
+        if not isinstance(scans, list) or not scans:
+            return Response({'error': 'scans must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(scans) > settings.VALIDATION_BATCH_MAX:
+            return Response({'error': f'At most {settings.VALIDATION_BATCH_MAX} scans per batch'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = redemption.redeem_batch(scans, request.user)
+        return Response({
+            'admitted': sum(result['status'] == 'admitted' for result in results),
+            'results': results,
+        })